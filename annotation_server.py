@@ -0,0 +1,287 @@
+"""
+Local server annotating TLINKs. The models, word embeddings and NewsReader pipeline are loaded once, when
+the server starts, instead of once per run of predict_network.py.
+
+    POST /annotate              body is a TimeML document with EVENT and TIMEX3 tags.
+                                Returns the TimeML document with TLINKs
+    POST /annotate?dct=DATE     body is raw text, DATE its document creation time (e.g. 2017-09-07).
+                                EVENTs are tagged with the event model first (see --event_model)
+    GET  /health                status of the server, as JSON
+
+Documents are annotated one at a time, in the order they are received. Requests wait in a queue of
+--queue_size documents, and get 503 when it is full, or when the models failed to load. A request that is not
+annotated within --timeout seconds gets 504.
+"""
+
+import sys
+from code.config import env_paths
+
+if env_paths()["PY4J_DIR_PATH"] is None:
+    sys.exit("PY4J_DIR_PATH environment variable not specified")
+
+import os
+import stat
+import json
+import time
+import argparse
+import threading
+import traceback
+import Queue
+import urlparse
+import SocketServer
+import BaseHTTPServer
+
+from code.learning.annotator import TLinkAnnotator
+
+
+class AnnotationUnavailable(Exception):
+    '''the annotator failed to load, or its worker thread stopped'''
+    pass
+
+
+class AnnotationTimeout(Exception):
+    pass
+
+
+class AnnotationQueue(object):
+    '''
+    Queue of documents, annotated in order by a single worker thread.
+    The TLinkAnnotator is created in the worker thread, since Keras models must be used from the thread that loaded them.
+    '''
+
+    def __init__(self, annotator_args, queue_size=100, timeout=600):
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.timeout = timeout
+        self.status = 'loading'
+        self.started = time.time()
+        self.n_annotated = 0
+        self.n_failed = 0
+
+        self.worker = threading.Thread(target=self._work, args=(annotator_args,))
+        self.worker.daemon = True
+        self.worker.start()
+
+    def annotate(self, document, dct=None):
+        '''
+        annotate a TimeML document, or raw text if dct is given. Blocks until it is annotated.
+        Raises Queue.Full if the queue is full, AnnotationUnavailable if the annotator cannot annotate,
+        and AnnotationTimeout if the document is not annotated within self.timeout seconds
+        '''
+        if not self.is_available():
+            raise AnnotationUnavailable("the annotator failed to load")
+
+        job = {'document': document, 'dct': dct, 'done': threading.Event(), 'result': None, 'error': None,
+               'cancelled': False}
+        self.queue.put(job, block=False)
+
+        deadline = time.time() + self.timeout
+        # wake up regularly, in case the worker stops while the job is queued
+        while not job['done'].wait(min(1.0, max(deadline - time.time(), 0))):
+            if not self.is_available():
+                raise AnnotationUnavailable("the annotator failed to load")
+            if time.time() >= deadline:
+                job['cancelled'] = True
+                raise AnnotationTimeout("not annotated within {} s".format(self.timeout))
+
+        if job['error'] is not None:
+            raise job['error']
+        return job['result']
+
+    def is_available(self):
+        return self.status != 'failed' and self.worker.is_alive()
+
+    def get_health(self):
+        status = self.status if self.worker.is_alive() or self.status == 'failed' else 'stopped'
+        return {'status': status, 'queued': self.queue.qsize(), 'annotated': self.n_annotated,
+                'failed': self.n_failed, 'uptime': int(time.time() - self.started)}
+
+    def _work(self, annotator_args):
+        try:
+            annotator = TLinkAnnotator(**annotator_args)
+        except Exception:
+            traceback.print_exc()
+            self.status = 'failed'
+            return
+
+        self.status = 'ok'
+        print "annotation server is ready"
+
+        while True:
+            job = self.queue.get()
+            if job['cancelled']:
+                continue
+            try:
+                if job['dct'] is None:
+                    job['result'] = annotator.annotate_timeml(job['document'])
+                else:
+                    job['result'] = annotator.annotate_text(job['document'], job['dct'])
+                self.n_annotated += 1
+            except Exception as e:
+                traceback.print_exc()
+                job['error'] = e
+                self.n_failed += 1
+            job['done'].set()
+
+
+class AnnotationHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if urlparse.urlparse(self.path).path != '/health':
+            self.send_error(404)
+            return
+
+        health = self.server.annotation_queue.get_health()
+        self._respond(200 if health['status'] == 'ok' else 503, json.dumps(health), 'application/json')
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != '/annotate':
+            self.send_error(404)
+            return
+
+        dct = urlparse.parse_qs(url.query).get('dct', [None])[0]
+        document = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        if not document:
+            self.send_error(400, "empty document")
+            return
+
+        try:
+            result = self.server.annotation_queue.annotate(document, dct=dct)
+        except Queue.Full:
+            self.send_error(503, "annotation queue is full")
+            return
+        except AnnotationUnavailable as e:
+            self.send_error(503, str(e))
+            return
+        except AnnotationTimeout as e:
+            self.send_error(504, str(e))
+            return
+        except Exception as e:
+            self._respond(500, "annotation failed: {}\n".format(e), 'text/plain')
+            return
+
+        self._respond(200, result, 'application/xml')
+
+    def address_string(self):
+        # clients of a Unix socket have no address
+        if not self.client_address:
+            return 'unix'
+        return BaseHTTPServer.BaseHTTPRequestHandler.address_string(self)
+
+    def _respond(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ThreadedUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def is_socket(path):
+    return stat.S_ISSOCK(os.stat(path).st_mode)
+
+
+def remove_socket(path):
+    '''remove the Unix socket at path, if there is one. Other files are left alone'''
+    if os.path.exists(path) and is_socket(path):
+        os.remove(path)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("intra_model_path",
+                        help="Where trained model for intra-sentence pairs is located")
+
+    parser.add_argument("cross_model_path",
+                        help="Where trained model for cross-sentence pairs is located")
+
+    parser.add_argument("dct_model_path",
+                        help="Where trained model for events and document creation time is located")
+
+    parser.add_argument("newsreader_annotations",
+                        help="Where newsreader pipeline parsed file objects go. Used for the embedding subset, if any")
+
+    parser.add_argument("--event_model",
+                        default=None,
+                        help="Where trained event model is located. Needed to annotate raw text")
+
+    parser.add_argument("--port",
+                        default=8085,
+                        type=int,
+                        help="Port to listen on, on localhost")
+
+    parser.add_argument("--socket",
+                        default=None,
+                        help="Listen on this Unix socket instead of a port")
+
+    parser.add_argument("--queue_size",
+                        default=100,
+                        type=int,
+                        help="Number of documents waiting to be annotated before requests are refused")
+
+    parser.add_argument("--timeout",
+                        default=600,
+                        type=float,
+                        help="Seconds a request waits for its document to be annotated, including its time in the queue")
+
+    parser.add_argument("--batch_size",
+                        default=256,
+                        type=int,
+                        help="Number of pairs per forward pass of the models")
+
+    parser.add_argument("--numpy",
+                        action='store_true',
+                        default=False,
+                        help="Run the models with NumPy only, instead of Keras. "
+                             "Sentence encoder models (train_network.py --sentence_encoder) are not supported")
+
+    parser.add_argument("--cache_encoders",
+                        action='store_true',
+                        default=False,
+                        help="Encode every distinct dependency subpath once, and only run the decoder per pair")
+
+    args = parser.parse_args()
+
+    annotator_args = {'intra_model_path': args.intra_model_path,
+                      'cross_model_path': args.cross_model_path,
+                      'dct_model_path': args.dct_model_path,
+                      'newsreader_dir': args.newsreader_annotations,
+                      'event_model_path': args.event_model,
+                      'batch_size': args.batch_size,
+                      'use_numpy': args.numpy,
+                      'cache_encoders': args.cache_encoders}
+
+    if args.socket is not None:
+        # a socket left by an earlier server is replaced, anything else is kept
+        if os.path.exists(args.socket) and not is_socket(args.socket):
+            sys.exit("{} exists and is not a socket".format(args.socket))
+        remove_socket(args.socket)
+        server = ThreadedUnixServer(args.socket, AnnotationHandler)
+        print "listening on", args.socket
+    else:
+        server = ThreadedHTTPServer(('localhost', args.port), AnnotationHandler)
+        print "listening on localhost:{}".format(args.port)
+
+    server.annotation_queue = AnnotationQueue(annotator_args, queue_size=args.queue_size, timeout=args.timeout)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None:
+            remove_socket(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+'''
+Compare the throughput and accuracy of event models on notes with EVENT tags, e.g. a windowed model and a sentence model
+(see sentence_model in event_network.py).
+'''
+
+import sys
+import os
+from code.config import env_paths
+if env_paths()["PY4J_DIR_PATH"] is None:
+    sys.exit("PY4J_DIR_PATH environment variable not specified")
+
+import argparse
+import time
+
+from keras.models import load_model
+
+from event_network import EventNetwork
+from code.learning.numpy_inference import load_numpy_model
+from code.learning.word2vec import load_word_vectors
+
+
+def benchmark_model(network, notes, model, batch_size=256, repeats=3):
+    '''
+    tag the events of the notes repeats times, after a first pass that warms up the model.
+    Returns the fastest time, and the precision, recall and F1 of the tagged tokens.
+    Event tokens are the first words of the gold events, as in EventNetwork.get_input()
+    '''
+    network.predict_event_tokens(model, notes[0], batch_size=batch_size)
+
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        tagged = [network.predict_event_tokens(model, note, batch_size=batch_size) for note in notes]
+        times.append(time.time() - start)
+
+    n_correct = n_tagged = n_gold = 0
+    for note, note_tagged in zip(notes, tagged):
+        if hasattr(note, 'event_ids'):
+            event_ids = note.event_ids
+        else:
+            id_chunk_map, event_ids, timex_ids, sentence_chunks = note.get_id_chunk_map()
+        gold_wordIDs = set([note.id_to_wordIDs[x][0] for x in event_ids])
+        tagged_wordIDs = set([token['id'] for token in note_tagged])
+
+        n_correct += len(gold_wordIDs & tagged_wordIDs)
+        n_tagged += len(tagged_wordIDs)
+        n_gold += len(gold_wordIDs)
+
+    precision = float(n_correct) / max(n_tagged, 1)
+    recall = float(n_correct) / max(n_gold, 1)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+
+    return min(times), precision, recall, f1
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("test_dir",
+                        help="Directory containing files with EVENT tags")
+
+    parser.add_argument("newsreader_annotations",
+                        help="Where newsreader pipeline parsed file objects go")
+
+    parser.add_argument("model_paths",
+                        nargs='+',
+                        help="Directories of the trained event models (model.h5)")
+
+    parser.add_argument("--batch_size",
+                        default=256,
+                        type=int,
+                        help="Number of tokens per forward pass of the event models")
+
+    parser.add_argument("--repeats",
+                        default=3,
+                        type=int,
+                        help="Number of timed passes over the notes. The fastest is reported")
+
+    parser.add_argument("--numpy",
+                        action='store_true',
+                        default=False,
+                        help="Run the event models with NumPy only, instead of Keras")
+
+    args = parser.parse_args()
+
+    if os.path.isdir(args.newsreader_annotations) is False:
+        sys.exit("invalid path for time note dir")
+
+    network = EventNetwork(word_vectors=load_word_vectors(newsreader_dir=args.newsreader_annotations))
+    notes = network.get_notes(args.test_dir, args.newsreader_annotations)
+    if not notes:
+        sys.exit("no notes found in " + args.test_dir)
+    n_tokens = sum([len(note.id_to_tok) for note in notes])
+
+    results = []
+    for model_path in args.model_paths:
+        if args.numpy:
+            model = load_numpy_model(os.path.join(model_path, 'model.h5'))
+        else:
+            model = load_model(os.path.join(model_path, 'model.h5'))
+        kind = 'sentence' if EventNetwork.is_sentence_model(model) else 'window'
+        print "benchmarking {} model {}".format(kind, model_path)
+        results.append((model_path, kind) + benchmark_model(network, notes, model, batch_size=args.batch_size,
+                                                           repeats=args.repeats))
+
+    print
+    print "{} tokens, {} notes".format(n_tokens, len(notes))
+    for model_path, kind, seconds, precision, recall, f1 in results:
+        print "{} ({})".format(model_path, kind)
+        print "    {:.2f} s, {:.1f} tokens/s".format(seconds, n_tokens / max(seconds, 1e-9))
+        print "    event precision {:.3f} recall {:.3f} F1 {:.3f}".format(precision, recall, f1)
+
+
+if __name__ == "__main__":
+    main()
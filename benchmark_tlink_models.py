@@ -0,0 +1,133 @@
+'''
+Compare the throughput and accuracy of TLINK models of the same pair type on annotated notes, e.g. a model trained on
+dependency paths and a sentence model (train_network.py --sentence_encoder).
+'''
+
+import sys
+import os
+from code.config import env_paths
+if env_paths()["PY4J_DIR_PATH"] is None:
+    sys.exit("PY4J_DIR_PATH environment variable not specified")
+
+import argparse
+import glob
+import time
+
+import numpy
+
+from code.learning.network import Network, LABELS
+from code.learning.annotator import load_tlink_model
+from train_network import get_notes
+
+
+def benchmark_model(network, notes, model, pair_type, batch_size=256, repeats=3):
+    '''
+    predict the pairs of the notes repeats times, after a first pass that loads the embeddings the model needs.
+    Returns the number of pairs, the fastest time, and the accuracy of the labels before and after smart predict
+    '''
+    network.single_predict(notes, model, pair_type, batch_size=batch_size)
+
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        labels, probs, pair_table = network.single_predict(notes, model, pair_type, predict_prob=True, batch_size=batch_size)
+        times.append(time.time() - start)
+
+    gold = numpy.zeros(len(pair_table), dtype='int64')
+    for i, note in enumerate(notes):
+        note_slice = pair_table.get_note_slice(i)
+        if note.id_to_labels:
+            gold[pair_table.row[note_slice]] = network._get_note_test_labels(note, pair_table.get_pairs(note_slice))
+        else:
+            gold[pair_table.row[note_slice]] = LABELS.index("None")
+
+    scores = [get_scores(labels, gold)]
+    if pair_type != 'dct':
+        try:
+            smart_labels, _ = network.smart_predict(labels, probs, pair_table, type='int')
+            scores.append(get_scores(smart_labels, gold))
+        except KeyError:
+            print "cannot perform smart predicting"
+
+    return len(pair_table), min(times), scores
+
+
+def get_scores(labels, gold):
+    '''
+    accuracy over all pairs, and precision, recall and F1 of the tlinks, i.e. of the labels other than "None"
+    '''
+    labels = numpy.asarray(labels)
+    no_link = LABELS.index("None")
+    correct = labels == gold
+    predicted = labels != no_link
+    actual = gold != no_link
+
+    precision = float(numpy.sum(correct & predicted)) / max(numpy.sum(predicted), 1)
+    recall = float(numpy.sum(correct & actual)) / max(numpy.sum(actual), 1)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+
+    return numpy.mean(correct) if len(labels) else 0.0, precision, recall, f1
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("test_dir",
+                        help="Directory containing annotated notes with TLINKs")
+
+    parser.add_argument("newsreader_annotations",
+                        help="Where newsreader pipeline parsed file objects go")
+
+    parser.add_argument("model_paths",
+                        nargs='+',
+                        help="Where the trained models are located, as given to predict_network.py")
+
+    parser.add_argument("--pair_type",
+                        default='intra',
+                        help="specify the pair type of the models: intra, cross or dct")
+
+    parser.add_argument("--batch_size",
+                        default=256,
+                        type=int,
+                        help="Number of pairs per forward pass of the models")
+
+    parser.add_argument("--repeats",
+                        default=3,
+                        type=int,
+                        help="Number of timed passes over the notes. The fastest is reported")
+
+    args = parser.parse_args()
+
+    assert args.pair_type in ('intra', 'cross', 'dct')
+
+    if os.path.isdir(args.newsreader_annotations) is False:
+        sys.exit("invalid path for time note dir")
+
+    files = sorted([f for f in glob.glob(os.path.join(args.test_dir, '*')) if f.endswith('.tml')])
+    notes = get_notes(files, args.newsreader_annotations)
+    if not notes:
+        sys.exit("no notes found in " + args.test_dir)
+
+    network = Network(newsreader_dir=args.newsreader_annotations)
+
+    results = []
+    for model_path in args.model_paths:
+        model = load_tlink_model(model_path, args.pair_type)
+        kind = 'sentence' if Network.is_sentence_model(model) else 'path'
+        print "benchmarking {} model {}".format(kind, model_path)
+        results.append((model_path, kind) + benchmark_model(network, notes, model, args.pair_type,
+                                                            batch_size=args.batch_size, repeats=args.repeats))
+
+    print
+    print "{} {} pairs, {} notes".format(args.pair_type, results[0][2], len(notes))
+    for model_path, kind, n_pairs, seconds, scores in results:
+        print "{} ({})".format(model_path, kind)
+        print "    {:.2f} s, {:.1f} pairs/s".format(seconds, n_pairs / max(seconds, 1e-9))
+        for name, (accuracy, precision, recall, f1) in zip(["raw", "smart predict"], scores):
+            print "    {:14s} accuracy {:.3f}  tlink precision {:.3f} recall {:.3f} F1 {:.3f}".format(name, accuracy, precision,
+                                                                                                   recall, f1)
+
+
+if __name__ == "__main__":
+    main()
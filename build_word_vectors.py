@@ -0,0 +1,58 @@
+'''
+Build the on-disk word embedding stores used by the networks.
+'''
+
+import sys
+import os
+import argparse
+
+from code.learning.word2vec import convert_word2vec_binary, get_word2vec_path
+from code.learning.word2vec import build_word_vector_subset, load_word_vectors
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+
+    convert_parser = subparsers.add_parser("convert",
+                                           help="convert a word2vec binary file into a memory-mappable store")
+
+    convert_parser.add_argument("--word2vec",
+                                default=None,
+                                help="word2vec binary file to convert. Defaults to GoogleNews-vectors-negative300.bin in TEA_PATH")
+
+    convert_parser.add_argument("--store",
+                                default=None,
+                                help="Where to write the converted store. Defaults to the binary file name with .store extension")
+
+    subset_parser = subparsers.add_parser("subset",
+                                          help="write the vectors of the words in a directory of cached notes")
+
+    subset_parser.add_argument("newsreader_annotations",
+                               help="Where newsreader pipeline parsed file objects go")
+
+    subset_parser.add_argument("--word2vec",
+                               default=None,
+                               help="word2vec binary file or converted store to take the vectors from")
+
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        word2vec_path = args.word2vec
+        if word2vec_path is None:
+            word2vec_path = get_word2vec_path()
+        if os.path.isfile(word2vec_path) is False:
+            sys.exit("invalid path to word2vec binary file")
+
+        convert_word2vec_binary(word2vec_path, args.store)
+
+    elif args.command == "subset":
+        if os.path.isdir(args.newsreader_annotations) is False:
+            sys.exit("invalid path for time note dir")
+
+        build_word_vector_subset(args.newsreader_annotations, word_vectors=load_word_vectors(args.word2vec, verbose=1))
+
+
+if __name__ == "__main__":
+    main()
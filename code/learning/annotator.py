@@ -0,0 +1,281 @@
+'''
+Annotate TLINKs with the intra-sentence, cross-sentence and DCT models.
+TLinkAnnotator keeps the models, word embeddings and NewsReader pipeline loaded between documents:
+
+    annotator = TLinkAnnotator('model_destination/intra/', 'model_destination/cross/', 'model_destination/dct/')
+    tlinks = annotator.annotate(timeml_string) # [(src, tgt, relType, score), ...]
+'''
+
+import os
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy
+from keras.models import model_from_json, load_model
+
+from code.learning.network import Network
+from code.learning.pair_table import PairTable
+from code.learning.time_ref import predict_timex_rel
+from code.learning.break_cycle import modify_tlinks
+from code.learning.word2vec import load_word_vectors
+from code.learning.numpy_inference import load_numpy_model, load_numpy_tlink_model
+from code.notes.TimeNote import TimeNote
+from code.notes.utilities.xml_utilities import XMLDocument, read_xml
+from code.notes.utilities.pre_processing import pre_processing
+
+TIMEML_TEMPLATE = '''<?xml version="1.0" ?>
+<TimeML xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://timeml.org/timeMLdocs/TimeML_1.2.1.xsd">
+
+<DOCID>{docid}</DOCID>
+
+<DCT><TIMEX3 tid="t0" type="DATE" value={dct} temporalFunction="false" functionInDocument="CREATION_TIME">{dct_text}</TIMEX3></DCT>
+
+<TEXT>
+{text}
+</TEXT>
+
+</TimeML>
+'''
+
+
+def load_tlink_model(model_path, pair_type, use_numpy=False):
+    '''
+    load a model saved by train_network.py for pair_type ('intra', 'cross' or 'dct')
+    use_numpy: load it for inference with NumPy only, see numpy_inference.py
+    '''
+    if use_numpy:
+        return load_numpy_tlink_model(model_path, pair_type)
+
+    model = model_from_json(open(os.path.join(model_path, pair_type, '.arch.json')).read())
+    model.load_weights(os.path.join(model_path, pair_type, '.weights.h5'))
+    return model
+
+
+def predict_tlinks(network, notes, intra_model, cross_model, dct_model, batch_size=256, cache_encoders=False):
+    '''
+    combine the predictions of the three models and the timex rules for some notes.
+    Returns the (id_pairs, labels, scores) of the tlinks of every note, after modify_tlinks()
+    cache_encoders: encode every distinct subpath once, see Network.single_predict()
+    '''
+    intra_labels, intra_probs, intra_pairs = network.single_predict(notes, intra_model, 'intra', predict_prob=True, batch_size=batch_size,
+                                                                    cache_encoders=cache_encoders)
+    intra_labels, intra_pairs, intra_scores = network.smart_predict(intra_labels, intra_probs, intra_pairs, type='str')
+
+    cross_labels, cross_probs, cross_pairs = network.single_predict(notes, cross_model, 'cross', predict_prob=True, batch_size=batch_size,
+                                                                    cache_encoders=cache_encoders)
+    cross_labels, cross_pairs, cross_scores = network.smart_predict(cross_labels, cross_probs, cross_pairs, type='str')
+
+    timex_labels, timex_pairs = predict_timex_rel(notes)
+    timex_scores = [1.0] * len(timex_labels) # trust timex tlinks
+
+    dct_labels, dct_probs, dct_pairs = network.single_predict(notes, dct_model, 'dct', predict_prob=True, batch_size=batch_size,
+                                                              cache_encoders=cache_encoders)
+    dct_labels = network._convert_int_labels_to_str(dct_labels)
+    dct_scores = dct_probs.max(axis=1)
+    assert len(dct_labels) == len(dct_scores)
+
+    # only one pair of every couple of opposite intra and cross pairs is used, their labels agree after smart predict
+    pair_table, labels, scores = merge_predictions([(intra_pairs, intra_labels, intra_scores, True),
+                                                    (cross_pairs, cross_labels, cross_scores, True),
+                                                    (timex_pairs, timex_labels, timex_scores, False),
+                                                    (dct_pairs, dct_labels, dct_scores, False)])
+
+    tlinks = []
+    for i, note in enumerate(notes):
+        note_slice = pair_table.get_note_slice(i)
+        rows = pair_table.row[note_slice]
+        note_id_pairs = pair_table.get_pairs(note_slice)
+        note_labels = labels[rows].tolist()
+        note_scores = scores[rows].tolist()
+
+        # note_labels, note_scores = resolve_coref(note, note_id_pairs, note_labels, note_scores)
+        note_labels = modify_tlinks(note_id_pairs, note_labels, note_scores)
+        tlinks.append((note_id_pairs, note_labels, note_scores))
+
+    return tlinks
+
+
+def merge_predictions(predictions):
+    '''
+    merge the (pair_table, labels, scores, symmetric) predictions of several models into one PairTable, and the
+    labels and scores of its rows. For symmetric predictions, only the first pair of a couple of opposite pairs is kept
+    '''
+    tables = []
+    labels = []
+    scores = []
+    for pair_table, table_labels, table_scores, symmetric in predictions:
+        if symmetric:
+            pair_table = pair_table.take(pair_table.get_first_of_couples())
+        tables.append(pair_table)
+        labels.append(numpy.array(table_labels, dtype=object)[pair_table.row])
+        scores.append(numpy.asarray(table_scores, dtype='float64')[pair_table.row])
+
+    return PairTable.concatenate(tables), numpy.concatenate(labels), numpy.concatenate(scores)
+
+
+def get_annotated_timeml(note, id_pairs, note_labels):
+    '''
+    get the TimeML document of a note, with the MAKEINSTANCE and TLINK tags of the given labels
+    '''
+    raw_text = []
+    for line in read_xml(note.annotated_note_path).splitlines(True):
+        if '<MAKEINSTANCE' in line:
+            break
+        elif '<TLINK' in line:
+            break
+        else:
+            raw_text.append(line)
+
+    raw_text = ''.join(raw_text)
+    tlinks = []
+    makeinstances = []
+
+    for i, (id_pair, note_label) in enumerate(zip(id_pairs, note_labels)):
+        if note_label != 'None':
+            src_eid, target_eid = id_pair
+            if src_eid[0] == 'e' and target_eid[0] == 'e':
+                src_eiid = 'ei' + src_eid[1:]
+                target_eiid = 'ei' + target_eid[1:]
+                lid = 'l' + str(i)
+                tlink = '<TLINK eventInstanceID="{}" lid="{}" relType="{}" relatedToEventInstance="{}"/>'.format(
+                                                                                                    src_eiid, lid,
+                                                                                                    note_label, target_eiid)
+                makeinstance = '<MAKEINSTANCE eiid="{}" eventID="{}" pos="UNKNOWN" tense="NONE"/>'.format(src_eiid, src_eid)
+                makeinstances.append(makeinstance)
+                makeinstance = '<MAKEINSTANCE eiid="{}" eventID="{}" pos="UNKNOWN" tense="NONE"/>'.format(target_eiid, target_eid)
+                makeinstances.append(makeinstance)
+
+            elif src_eid[0] == 'e' and target_eid[0] == 't':
+                src_eiid = 'ei' + src_eid[1:]
+                target_tid = target_eid
+                lid = 'l' + str(i)
+                tlink = '<TLINK eventInstanceID="{}" lid="{}" relType="{}" relatedToTime="{}"/>'.format(src_eiid, lid,
+                                                                                                note_label, target_tid)
+                makeinstance = '<MAKEINSTANCE eiid="{}" eventID="{}" pos="UNKNOWN" tense="NONE"/>'.format(src_eiid, src_eid)
+                makeinstances.append(makeinstance)
+
+            elif src_eid[0] == 't' and target_eid[0] == 'e':
+                src_tid = src_eid
+                target_eiid = 'ei' + target_eid[1:]
+                lid = 'l' + str(i)
+                tlink = '<TLINK timeID="{}" lid="{}" relType="{}" relatedToEventInstance="{}"/>'.format(src_tid, lid,
+                                                                                                note_label, target_eiid)
+                makeinstance = '<MAKEINSTANCE eiid="{}" eventID="{}" pos="UNKNOWN" tense="NONE"/>'.format(target_eiid, target_eid)
+                makeinstances.append(makeinstance)
+
+            elif src_eid[0] == 't' and target_eid[0] == 't':
+                src_tid = src_eid
+                target_tid = target_eid
+                lid = 'l' + str(i)
+                tlink = '<TLINK timeID="{}" lid="{}" relType="{}" relatedToTime="{}"/>'.format(src_tid, lid,
+                                                                                               note_label, target_tid)
+            tlinks.append(tlink)
+
+    raw_text = raw_text.replace('</TimeML>', '')
+    makeinstances = sorted(list(set(makeinstances)))
+    for makeinstance in makeinstances:
+        raw_text += '\n' + makeinstance
+    for tlink in sorted(list(set(tlinks))):
+        raw_text += '\n' + tlink
+
+    raw_text += '\n</TimeML>'
+
+    return raw_text
+
+
+class TLinkAnnotator(object):
+    '''
+    Annotate TLINKs of single documents, with everything loaded once:
+    the three TLINK models, the word embeddings, the NewsReader pipeline and, optionally, the event model
+    used to tag EVENTs in raw text. Documents are read from strings, and nothing is written to disk.
+
+    Keras models must be used from the thread that loaded them, so create the annotator in the thread
+    that annotates.
+    '''
+
+    def __init__(self, intra_model_path, cross_model_path, dct_model_path, newsreader_dir=None, event_model_path=None,
+                 batch_size=256, use_numpy=False, cache_encoders=False):
+        self.batch_size = batch_size
+        self.cache_encoders = cache_encoders
+
+        print 'Loading models...'
+        self.intra_model = load_tlink_model(intra_model_path, 'intra', use_numpy=use_numpy)
+        self.cross_model = load_tlink_model(cross_model_path, 'cross', use_numpy=use_numpy)
+        self.dct_model = load_tlink_model(dct_model_path, 'dct', use_numpy=use_numpy)
+        if event_model_path is None:
+            self.event_model = None
+        elif use_numpy:
+            self.event_model = load_numpy_model(os.path.join(event_model_path, 'model.h5'))
+        else:
+            self.event_model = load_model(os.path.join(event_model_path, 'model.h5'))
+
+        print 'Loading word embeddings...'
+        self.network = Network(newsreader_dir=newsreader_dir)
+        self.network.word_vectors = load_word_vectors(newsreader_dir=newsreader_dir)
+
+        print 'Starting NewsReader...'
+        pre_processing.start()
+
+    def annotate(self, timeml, name='document'):
+        '''
+        get the TLINKs of a TimeML document with EVENT and TIMEX3 tags, as a list of (src, tgt, relType, score).
+        Pairs predicted to have no link are left out
+        '''
+        note, id_pairs, labels, scores = self._predict(timeml, name)
+        return [(src, tgt, label, score) for (src, tgt), label, score in zip(id_pairs, labels, scores) if label != 'None']
+
+    def annotate_timeml(self, timeml, name='document'):
+        '''
+        annotate the TLINKs of a TimeML document with EVENT and TIMEX3 tags. Returns the TimeML document
+        '''
+        note, id_pairs, labels, scores = self._predict(timeml, name)
+        return get_annotated_timeml(note, id_pairs, labels)
+
+    def annotate_text(self, text, dct, docid='document'):
+        '''
+        tag the EVENTs of raw text with the event model, and annotate its TLINKs.
+        dct: document creation time, e.g. 2017-09-07. It is the only TIMEX3 of the document
+        '''
+        if self.event_model is None:
+            raise ValueError("annotating raw text needs an event model")
+
+        document = XMLDocument(get_timeml(text, dct, docid=docid), name=docid)
+        note = TimeNote(document, document)
+        tagged_timeml = self._tag_events(note)
+
+        # the tagged document has the same text, so the NewsReader output of the untagged one is reused
+        note, id_pairs, labels, scores = self._predict(tagged_timeml, docid, pre_processed_note=note)
+        return get_annotated_timeml(note, id_pairs, labels)
+
+    def tag_events(self, timeml):
+        '''
+        tag the EVENTs of a TimeML document with the event model, see predict_event.py
+        '''
+        document = XMLDocument(timeml)
+        return self._tag_events(TimeNote(document, document))
+
+    def _tag_events(self, note):
+        # imported here, as event_network.py is a script in the TEA directory
+        from code.learning.model_event import EventWriter
+
+        tokens = [token for num in note.pre_processed_text for token in note.pre_processed_text[num]]
+        event_writer = EventWriter(note, word_vectors=self.network.word_vectors, NNet=self.event_model,
+                                   batch_size=self.batch_size)
+        timeml_root = event_writer.tag_text([], tokens, note)
+
+        return '<?xml version="1.0" ?>\n' + ET.tostring(timeml_root)
+
+    def _predict(self, timeml, name, pre_processed_note=None):
+        document = XMLDocument(timeml, name=name)
+        note = TimeNote(document, document, pre_processed_note=pre_processed_note)
+        id_pairs, labels, scores = predict_tlinks(self.network, [note], self.intra_model, self.cross_model,
+                                                  self.dct_model, batch_size=self.batch_size,
+                                                  cache_encoders=self.cache_encoders)[0]
+        return note, id_pairs, labels, scores
+
+
+def get_timeml(text, dct, docid='document'):
+    '''
+    wrap raw text in a TimeML document with a document creation time
+    '''
+    return TIMEML_TEMPLATE.format(docid=escape(docid), dct=quoteattr(dct), dct_text=escape(dct), text=escape(text))
@@ -1,15 +1,15 @@
 from code.notes.utilities import timeml_utilities
 from code.notes.utilities.xml_utilities import write_root_to_file
 from code.notes.TimeNote import TimeNote
+from code.notes.note_cache import NoteCache, get_document_name, load_note
 from keras.models import model_from_json
 from event_network import EventNetwork
-from code.learning.word2vec import load_word2vec_binary
+from code.learning.word2vec import load_word_vectors
 from code.notes.utilities.time_norm import get_normalized_time_expressions
 from code.notes.utilities.timeml_utilities import get_doctime_timex
 
 import glob
 import os
-import cPickle
 import numpy
 import json
 numpy.random.seed(1337)
@@ -22,7 +22,7 @@ convert_pos_tags = lambda tag: EVENT_POS_TAGS.get(tag[0], 'UNKNOWN')
 
 class EventWriter(object):
 
-    def __init__(self, note, word_vectors=None, NNet=None):
+    def __init__(self, note, word_vectors=None, NNet=None, newsreader_dir=None, batch_size=256):
         self.note = note
         self.predicate_tokens = []
         self.event_tokens_network = []
@@ -31,7 +31,7 @@ class EventWriter(object):
         #self.find_predicates()
 
         if NNet:
-            self.find_event_tokens(word_vectors, NNet)
+            self.find_event_tokens(word_vectors, NNet, newsreader_dir=newsreader_dir, batch_size=batch_size)
 
 
 
@@ -40,19 +40,14 @@ class EventWriter(object):
             predicate_tokens = [tok for tok in self.note.pre_processed_text[sent_num] if tok.get('is_predicate', False)]
             self.predicate_tokens += predicate_tokens
 
-    def find_event_tokens(self, word_vectors, NNet):
+    def find_event_tokens(self, word_vectors, NNet, newsreader_dir=None, batch_size=256):
         if word_vectors is None:
-            word_vectors = load_word2vec_binary(os.environ["TEA_PATH"] + '/GoogleNews-vectors-negative300.bin', verbose=0)
+            word_vectors = load_word_vectors(newsreader_dir=newsreader_dir)
 
+        # windowed and sentence models are both supported, see EventNetwork.predict_event_tokens()
         event_network = EventNetwork(word_vectors=word_vectors)
-        data = event_network.get_test_input(self.note)
         print "predicting events..."
-        predictions, probs = event_network.predict(NNet, data)
-        for i, pred in enumerate(predictions):
-            if pred:
-                wordID = 'w' + str(i+1)
-                token = self.note.id_to_tok[wordID]
-                self.event_tokens_network.append(token)
+        self.event_tokens_network += event_network.predict_event_tokens(NNet, self.note, batch_size=batch_size)
 
     def tag_predicates(self):
         make_instances = []
@@ -103,7 +98,7 @@ class EventWriter(object):
         return event_elements
 
     def tag_text(self, timexLabels, tokens, note):
-        timeml_root = timeml_utilities.get_stripped_root(self.note.note_path)
+        timeml_root = timeml_utilities.get_stripped_root(self.note.timeml_document)
 
         if self.event_elements:
             event_elements = self.event_elements
@@ -161,7 +156,7 @@ def tag_timex(timexLabels, tokens, note):
     offsets = note.get_token_char_offsets()
     length = len(offsets)
     timex_elements = []
-    doc_time = get_doctime_timex(note.note_path).attrib["value"]
+    doc_time = get_doctime_timex(note.timeml_document).attrib["value"]
 
     # # hack so events are detected in next for loop.
     # for label in timexLabels:
@@ -251,18 +246,24 @@ def evaluate_tagging(annotated_dir, newsreader_dir):
     annotated_files = sorted(glob.glob(os.path.join(annotated_dir,'*.tml')))
 
     base_names = [os.path.basename(x) for x in annotated_files]
-    gold_notes = [os.path.join(newsreader_dir, x[0:x.index(".tml")]+'.parsed.pickle') for x in base_names]
+    note_cache = NoteCache(newsreader_dir)
 
     event_results = numpy.array([0, 0, 0])
     timex_results = numpy.array([0, 0, 0])
 
-    for i, gold_note_file in enumerate(gold_notes):
+    for i in range(len(annotated_files)):
         event_ids = []
         timex_ids = []
         print "processing file: ", base_names[i]
         pred_file = annotated_files[i]
         pred_note = TimeNote(pred_file, pred_file)
-        gold_note = cPickle.load(open(gold_note_file))
+        # the gold note was cached from the original document, whose contents differ from the predicted one.
+        # The entry of the predicted document itself, e.g. cached by an earlier run, is not gold
+        gold_note_file = note_cache.find_note(get_document_name(pred_file),
+                                              exclude=[note_cache.get_note_path(pred_file, pred_file)])
+        if gold_note_file is None:
+            raise IOError("no cached gold note of {} in {}".format(base_names[i], newsreader_dir))
+        gold_note = load_note(gold_note_file)
         try:
             len(gold_note.event_ids)
             event_ids = gold_note.event_ids
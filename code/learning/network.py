@@ -1,28 +1,57 @@
 import os
 import pickle
 import copy
+import json
+import functools
 
 import numpy as np
 from keras.utils.np_utils import to_categorical
-from keras.models import Sequential
-from keras.layers import Embedding, LSTM, Dense, Merge, MaxPooling1D, TimeDistributed, Flatten, Masking, Input, Dropout, Permute
+from keras.models import Sequential, Model, model_from_json
+from keras.layers import Embedding, LSTM, Dense, Merge, MaxPooling1D, GlobalMaxPooling1D, TimeDistributed, Flatten, Masking, Input, Dropout, Permute
+from keras.layers import Bidirectional, Lambda, concatenate
 from keras.regularizers import l2
+from keras import backend as K
 
-from word2vec import load_word2vec_binary
+from word2vec import load_word_vectors, get_word_matrix, OOVVectors
+from pair_table import PairTable
+from numpy_inference import NumpyModel
 from sklearn.metrics import classification_report
 
 LABELS = ["SIMULTANEOUS", "BEFORE", "AFTER", "IBEFORE", "IAFTER", "IS_INCLUDED", "INCLUDES",
           "DURING","BEGINS","BEGUN_BY","ENDS","ENDED_BY", "None"]
 
+
+def _pool_subpaths(inputs):
+    '''
+    max pool the hidden states of the subpath tokens of every pair, in the Lambda layers of sentence models.
+    inputs: (n_sentences, n_tokens, size) hidden states, and (n_sentences, n_pairs, path_len) token positions,
+    -1 for padding. Lambda layers are saved as code, so only K can be used here
+    '''
+    hidden, positions = inputs
+    shape = K.shape(hidden)
+    flat_hidden = K.reshape(hidden, (-1, K.int_shape(hidden)[-1]))
+    offsets = K.reshape(K.arange(0, shape[0]) * shape[1], (-1, 1, 1))
+    states = K.gather(flat_hidden, K.maximum(positions, 0) + offsets)
+    is_padding = 1. - K.cast(K.greater_equal(positions, 0), K.floatx())
+    return K.max(states - 1e4 * K.expand_dims(is_padding), axis=2)
+
+
+def _pool_subpaths_shape(input_shapes):
+    return tuple(input_shapes[1][:2]) + tuple(input_shapes[0][-1:])
+
+
 class Network(object):
-    def __init__(self):
+    def __init__(self, newsreader_dir=None):
         #self.id_to_path = {}
         self.label_to_int = {}
         self.int_to_label = {}
         self.label_reverse_map = {} # map BEFORE to AFTER etc., in int label
         self.word_vectors = None
+        self.newsreader_dir = newsreader_dir # use the embedding subset of this note directory, if it has one
+        self.oov_vectors = OOVVectors()
+        self.word_index = {} # word -> id, for word id inputs. Id 0 is for padding
 
-    def get_untrained_model(self, encoder_dropout=0, decoder_dropout=0, input_dropout=0, reg_W=0, reg_B=0, reg_act=0, LSTM_size=256, dense_size=100, maxpooling=True, data_dim=300, max_len=22, nb_classes=7):
+    def get_untrained_model(self, encoder_dropout=0, decoder_dropout=0, input_dropout=0, reg_W=0, reg_B=0, reg_act=0, LSTM_size=256, dense_size=100, maxpooling=True, data_dim=300, max_len=22, nb_classes=7, embedding_matrix=None):
         '''
         Creates a neural network with the specified conditions.
         Arguments:
@@ -35,8 +64,10 @@ class Network(object):
             maxpooling: if True, pool over LSTM output at each timestep,
                         otherwise just take the output from the final LSTM timestep
             data_dim: dimension of word embeddings
-            max_len: maximum length of an input sequence
+            max_len: maximum length of an input sequence. None for a model that takes inputs of any length
             nb_classes: number of classes present in the training data
+            embedding_matrix: if given, the inputs are (max_len,) word ids instead of (data_dim, max_len) word vectors,
+                              and a frozen Embedding layer initialized with this matrix looks them up
         '''
 
         # create regularization objects if needed
@@ -58,16 +89,25 @@ class Network(object):
         # encode the first entity
         encoder_L = Sequential()
 
-        encoder_L.add(Dropout(input_dropout, input_shape=(data_dim, max_len)))
-        encoder_L.add(Permute((2, 1)))
+        if embedding_matrix is None:
+            encoder_L.add(Dropout(input_dropout, input_shape=(data_dim, max_len)))
+            encoder_L.add(Permute((2, 1)))
+        else:
+            # the embeddings come out as (max_len, data_dim), no need to permute
+            encoder_L.add(Embedding(embedding_matrix.shape[0], embedding_matrix.shape[1], weights=[embedding_matrix],
+                                    input_length=max_len, trainable=False))
+            encoder_L.add(Dropout(input_dropout))
 
         # with maxpooling
         if maxpooling:
             encoder_L.add(LSTM(LSTM_size, return_sequences=True, inner_activation="sigmoid"))
             if encoder_dropout != 0:
                 encoder_L.add(TimeDistributed(Dropout(encoder_dropout)))
-            encoder_L.add(MaxPooling1D(pool_length=max_len))
-            encoder_L.add(Flatten())
+            if max_len is None:
+                encoder_L.add(GlobalMaxPooling1D())
+            else:
+                encoder_L.add(MaxPooling1D(pool_length=max_len))
+                encoder_L.add(Flatten())
 
         # without maxpooling
         else:
@@ -79,16 +119,25 @@ class Network(object):
         # encode the second entity
         encoder_R = Sequential()
 
-        encoder_R.add(Dropout(input_dropout, input_shape=(data_dim, max_len)))
-        encoder_R.add(Permute((2, 1)))
+        if embedding_matrix is None:
+            encoder_R.add(Dropout(input_dropout, input_shape=(data_dim, max_len)))
+            encoder_R.add(Permute((2, 1)))
+        else:
+            # the embeddings come out as (max_len, data_dim), no need to permute
+            encoder_R.add(Embedding(embedding_matrix.shape[0], embedding_matrix.shape[1], weights=[embedding_matrix],
+                                    input_length=max_len, trainable=False))
+            encoder_R.add(Dropout(input_dropout))
 
         # with maxpooling
         if maxpooling:
             encoder_R.add(LSTM(LSTM_size, return_sequences=True, inner_activation="sigmoid"))
             if encoder_dropout != 0:
                 encoder_R.add(TimeDistributed(Dropout(encoder_dropout)))
-            encoder_R.add(MaxPooling1D(pool_length=max_len))
-            encoder_R.add(Flatten())
+            if max_len is None:
+                encoder_R.add(GlobalMaxPooling1D())
+            else:
+                encoder_R.add(MaxPooling1D(pool_length=max_len))
+                encoder_R.add(Flatten())
 
         else:
         # without maxpooling
@@ -109,9 +158,66 @@ class Network(object):
         decoder.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
         return decoder
 
+    def get_untrained_sentence_model(self, embedding_matrix, encoder_dropout=0, decoder_dropout=0, input_dropout=0, reg_W=0, reg_B=0,
+                                     reg_act=0, LSTM_size=128, dense_size=100, nb_classes=13):
+        '''
+        Creates a network that encodes every sentence once, instead of encoding the subpaths of every pair.
+        A BiLSTM runs over the word ids of the sentence. The hidden states of the tokens on the left and right
+        subpaths of each pair are max pooled, and the decoder classifies the pair from them.
+        Cross-sentence pairs are encoded over their two sentences, one after the other.
+        Inputs: (n_sentences, n_tokens) word ids, and (n_sentences, n_pairs, path_len) positions of the left
+                and right subpath tokens, -1 for padding. See _get_sentence_batch()
+        Output: (n_sentences, n_pairs, nb_classes) probabilities
+        Arguments:
+            embedding_matrix: embeddings of the word ids, for a frozen Embedding layer
+            LSTM_size: number of units in each direction of the BiLSTM
+            All other arguments are as in get_untrained_model()
+        '''
+        W_reg = l2(reg_W) if reg_W != 0 else None
+        B_reg = l2(reg_B) if reg_B != 0 else None
+        act_reg = l2(reg_act) if reg_act != 0 else None
+
+        words = Input(shape=(None,), dtype='int32')
+        left_positions = Input(shape=(None, None), dtype='int32')
+        right_positions = Input(shape=(None, None), dtype='int32')
+
+        # encode the sentence
+        embedded = Embedding(embedding_matrix.shape[0], embedding_matrix.shape[1], weights=[embedding_matrix],
+                             trainable=False)(words)
+        embedded = Dropout(input_dropout)(embedded)
+        hidden = Bidirectional(LSTM(LSTM_size, return_sequences=True, inner_activation="sigmoid"))(embedded)
+        if encoder_dropout != 0:
+            hidden = Dropout(encoder_dropout)(hidden)
+
+        # pool the states of the subpaths of every pair
+        left = Lambda(_pool_subpaths, output_shape=_pool_subpaths_shape)([hidden, left_positions])
+        right = Lambda(_pool_subpaths, output_shape=_pool_subpaths_shape)([hidden, right_positions])
+
+        # classify every pair
+        decoded = concatenate([left, right])
+        decoded = TimeDistributed(Dense(dense_size, W_regularizer=W_reg, b_regularizer=B_reg, activity_regularizer=act_reg,
+                                        activation='relu'))(decoded)
+        if decoder_dropout != 0:
+            decoded = Dropout(decoder_dropout)(decoded)
+        probs = TimeDistributed(Dense(nb_classes, W_regularizer=W_reg, b_regularizer=B_reg, activity_regularizer=act_reg,
+                                      activation='softmax'))(decoded)
+
+        # padding pairs get a sample weight of 0
+        model = Model(inputs=[words, left_positions, right_positions], outputs=probs)
+        model.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'], sample_weight_mode='temporal')
+        return model
+
+    @staticmethod
+    def is_sentence_model(model):
+        '''
+        whether a model was made by get_untrained_sentence_model()
+        '''
+        return isinstance(model.input_shape, list) and len(model.input_shape) == 3
+
     def train_model(self, notes, epochs=5, training_input=None, val_input=None, no_val=False, weight_classes=False, batch_size=256,
         encoder_dropout=0, decoder_dropout=0, input_dropout=0, reg_W=0, reg_B=0, reg_act=0, LSTM_size=32, dense_size=100,
-        maxpooling=True, data_dim=300, max_len='auto', nb_classes=13, callbacks=[], ordered=False):
+        maxpooling=True, data_dim=300, max_len='auto', nb_classes=13, callbacks=[], ordered=False, embedding_matrix=None,
+        max_len_percentile=None, bucket_width=None):
         '''
         obtains entity pairs and tlink labels from every note passed, and uses them to train the network.
         Arguments:
@@ -125,6 +231,13 @@ class Network(object):
             batch_size: size of training batches to use
             max_len: either an integer specifying the maximum input sequence length, or 'auto',
                     which infer maximum length from the training data
+            max_len_percentile: with max_len='auto', cap max_len at this percentile of the path lengths
+                                instead of using the longest path. Longer paths are truncated
+            embedding_matrix: embeddings of the word ids, if the inputs are word ids.
+                              Built from word_index by default
+            bucket_width: if given, train a model that takes inputs of any length, on batches of pairs with similar
+                          path lengths. Lengths are rounded up to a multiple of bucket_width, and each batch
+                          is only padded to the length of its bucket
             All other parameters feed directly into get_untrained_model(), and are described there.
         '''
         if training_input == None:
@@ -141,19 +254,33 @@ class Network(object):
         else:
             class_weights = None
 
+        # word id inputs are (n_pairs, max_len), word vector inputs are (n_pairs, data_dim, max_len)
+        time_axis = XL.ndim - 1
+        if time_axis == 1 and embedding_matrix is None:
+            embedding_matrix = self.get_embedding_matrix()
+
         # infer maximum sequence length
         if max_len == 'auto':
-            max_len = XL.shape[2]
+            max_len = XL.shape[time_axis]
+            if max_len_percentile is not None:
+                lengths = Network._get_path_lengths(XL, XR)
+                max_len = max(int(np.ceil(np.percentile(lengths, max_len_percentile))), 1)
+                print "max_len {} at percentile {}: {} of {} pairs truncated".format(max_len, max_len_percentile,
+                                                                                  np.sum(lengths > max_len), len(lengths))
+                XL = Network._strip_to_length(XL, max_len, time_axis)
+                XR = Network._strip_to_length(XR, max_len, time_axis)
         # pad input to reach max_len
         else:
-            filler = np.ones((1,1,max_len))
-            XL, _ = Network._pad_to_match_dimensions(XL, filler, 2, pad_left=True)
-            XR, _ = Network._pad_to_match_dimensions(XR, filler, 2, pad_left=True)
+            filler = np.ones((1,) * time_axis + (max_len,))
+            XL, _ = Network._pad_to_match_dimensions(XL, filler, time_axis, pad_left=True)
+            XR, _ = Network._pad_to_match_dimensions(XR, filler, time_axis, pad_left=True)
 
         model = self.get_untrained_model(encoder_dropout=encoder_dropout, decoder_dropout=decoder_dropout,
                                          input_dropout=input_dropout, reg_W=reg_W, reg_B=reg_B, reg_act=reg_act,
                                          LSTM_size=LSTM_size, dense_size=dense_size,
-                                         maxpooling=maxpooling, data_dim=data_dim, max_len=max_len, nb_classes=nb_classes)
+                                         maxpooling=maxpooling, data_dim=data_dim, nb_classes=nb_classes,
+                                         max_len=max_len if bucket_width is None else None,
+                                         embedding_matrix=embedding_matrix)
 
         # train the network
         print 'Training network...'
@@ -163,284 +290,623 @@ class Network(object):
         elif val_input is None:
             # split off validation data with 20 80 split
             # this way we get the same validation data every time
-            V_XL = XL[:(XL.shape[0]/5),:,:]
-            V_XR = XR[:(XR.shape[0]/5),:,:]
+            V_XL = XL[:(XL.shape[0]/5)]
+            V_XR = XR[:(XR.shape[0]/5)]
             V_Y  = Y [:( Y.shape[0]/5),:]
             V_labels = labels[:(Y.shape[0]/5)]
 
-            XL = XL[(XL.shape[0]/5):,:,:]
-            XR = XR[(XR.shape[0]/5):,:,:]
+            XL = XL[(XL.shape[0]/5):]
+            XR = XR[(XR.shape[0]/5):]
             Y  = Y [( Y.shape[0]/5):,:]
 
             validation_split = 0.2
             validation_data = ([V_XL, V_XR], V_Y)
         else:
             validation_split = 0 # will be overwritten by val data
-            V_XL, V_XR, V_labels, V_pair_index = val_input
+            V_XL, V_XR, V_labels, V_pair_table = val_input
             V_Y = to_categorical(V_labels, nb_classes)
-            filler = np.ones((1, 1, max_len))
-            V_XL, _ = Network._pad_to_match_dimensions(V_XL, filler, 2, pad_left=True)
-            V_XR, _ = Network._pad_to_match_dimensions(V_XR, filler, 2, pad_left=True)
+            filler = np.ones((1,) * time_axis + (max_len,))
+            V_XL, _ = Network._pad_to_match_dimensions(V_XL, filler, time_axis, pad_left=True)
+            V_XR, _ = Network._pad_to_match_dimensions(V_XR, filler, time_axis, pad_left=True)
+            V_XL = Network._strip_to_length(V_XL, max_len, time_axis)
+            V_XR = Network._strip_to_length(V_XR, max_len, time_axis)
             validation_data = ([V_XL, V_XR], V_Y)
 
-        training_history = model.fit([XL, XR], Y, nb_epoch=epochs, validation_split=validation_split, class_weight=class_weights,
-                                         batch_size=batch_size, validation_data=validation_data, callbacks=callbacks)
+        if bucket_width is None:
+            training_history = model.fit([XL, XR], Y, nb_epoch=epochs, validation_split=validation_split, class_weight=class_weights,
+                                             batch_size=batch_size, validation_data=validation_data, callbacks=callbacks)
+
+            V_probs = model.predict([V_XL, V_XR], batch_size=batch_size)
+        else:
+            buckets = Network._get_buckets(Network._get_path_lengths(XL, XR), bucket_width)
+            print "{} length buckets: {}".format(len(buckets), sorted(buckets))
+            if validation_data is None:
+                validation_steps = None
+            else:
+                V_buckets = Network._get_buckets(Network._get_path_lengths(V_XL, V_XR), bucket_width)
+                validation_steps = Network._count_batches(V_buckets, batch_size)
+                validation_data = Network._bucket_batches(V_XL, V_XR, V_Y, V_buckets, batch_size, shuffle=False)
 
-        test = model.predict_classes([V_XL, V_XR])
+            training_history = model.fit_generator(Network._bucket_batches(XL, XR, Y, buckets, batch_size),
+                                                   Network._count_batches(buckets, batch_size), epochs=epochs,
+                                                   class_weight=class_weights, validation_data=validation_data,
+                                                   validation_steps=validation_steps, callbacks=callbacks)
+
+            V_probs = Network._predict_bucketed(model, V_XL, V_XR, bucket_width, batch_size=batch_size)
+
+        # a single pass for both the labels and the probabilities
+        test = Network.get_labels_from_probs(V_probs)
         Network.class_confusion(test, V_labels, nb_classes)
 
         if val_input is not None and not ordered:
             try:
                 print "Trying smart predict..."
-                probs = model.predict_proba([V_XL, V_XR])
-                smart_test, pair_index = self.smart_predict(test, probs, V_pair_index, type='int')
+                smart_test, pair_table = self.smart_predict(test, V_probs, V_pair_table, type='int')
                 Network.class_confusion(smart_test, V_labels, nb_classes)
             except KeyError:
                 print "cannot perform smart predicting"
 
         return model, training_history.history
 
-    def single_predict(self, notes, model, pair_type, evalu=False, predict_prob=False):
+    def train_model_streaming(self, stream, epochs=5, val_input=None, weight_classes=False, encoder_dropout=0, decoder_dropout=0,
+        input_dropout=0, reg_W=0, reg_B=0, reg_act=0, LSTM_size=32, dense_size=100, maxpooling=True, data_dim=300, nb_classes=13,
+        callbacks=[], ordered=False, bucket_width=4, max_q_size=10):
         '''
-        predict using a trained single pass model
+        train on batches from a TrainingStream, instead of tensors built from all notes up front.
+        Arguments:
+            stream: TrainingStream of the training notes. Its max_len and word_ids settings decide the model input
+            val_input: validation data, formatted as in train_model(). No validation is done without it
+            bucket_width: for models that take inputs of any length, predict validation data in buckets of this width
+            max_q_size: number of batches to prepare ahead of training
+            All other parameters feed directly into get_untrained_model(), and are described there.
         '''
+        # use weighting to assist with the imbalanced data set problem
+        if weight_classes:
+            label_counts = stream.label_counts.astype('float32')
+            class_weights = label_counts.sum() / (nb_classes * label_counts)
+        else:
+            class_weights = None
 
-        XL, XR, _labels, pair_index = self._get_test_input(notes, pair_type)
+        if stream.word_ids:
+            embedding_matrix = self.get_embedding_matrix()
+        else:
+            embedding_matrix = None
 
-        # get expected length of model input
-        model_input_len = model.input_shape[0][2]
+        model = self.get_untrained_model(encoder_dropout=encoder_dropout, decoder_dropout=decoder_dropout,
+                                         input_dropout=input_dropout, reg_W=reg_W, reg_B=reg_B, reg_act=reg_act,
+                                         LSTM_size=LSTM_size, dense_size=dense_size,
+                                         maxpooling=maxpooling, data_dim=data_dim, max_len=stream.max_len, nb_classes=nb_classes,
+                                         embedding_matrix=embedding_matrix)
 
-        if model_input_len > XL.shape[2]:
-            # pad input matrix to fit expected length
-            filler = np.ones((1, 1, model_input_len))
-            XL, _ = Network._pad_to_match_dimensions(XL, filler, 2, pad_left=True)
-            XR, _ = Network._pad_to_match_dimensions(XR, filler, 2, pad_left=True)
+        if val_input is None:
+            validation_data = None
         else:
-            XL = Network._strip_to_length(XL, model_input_len, 2)
-            XR = Network._strip_to_length(XR, model_input_len, 2)
+            V_XL, V_XR, V_labels, V_pair_table = val_input
+            if stream.max_len is not None:
+                time_axis = V_XL.ndim - 1
+                filler = np.ones((1,) * time_axis + (stream.max_len,))
+                V_XL, _ = Network._pad_to_match_dimensions(V_XL, filler, time_axis, pad_left=True)
+                V_XR, _ = Network._pad_to_match_dimensions(V_XR, filler, time_axis, pad_left=True)
+                V_XL = Network._strip_to_length(V_XL, stream.max_len, time_axis)
+                V_XR = Network._strip_to_length(V_XR, stream.max_len, time_axis)
+            elif stream.truncate_len is not None:
+                # truncated like the training batches, see TrainingStream
+                V_XL = Network._strip_to_length(V_XL, stream.truncate_len, V_XL.ndim - 1)
+                V_XR = Network._strip_to_length(V_XR, stream.truncate_len, V_XR.ndim - 1)
+            validation_data = ([V_XL, V_XR], to_categorical(V_labels, nb_classes))
+
+        # train the network
+        print 'Training network...'
+        training_history = model.fit_generator(stream, stream.steps_per_epoch, epochs=epochs, class_weight=class_weights,
+                                               validation_data=validation_data, callbacks=callbacks, max_q_size=max_q_size)
+
+        if val_input is not None:
+            if stream.max_len is None:
+                probs = Network._predict_bucketed(model, V_XL, V_XR, bucket_width, batch_size=stream.batch_size)
+            else:
+                probs = model.predict([V_XL, V_XR], batch_size=stream.batch_size)
+            test = Network.get_labels_from_probs(probs)
+            Network.class_confusion(test, V_labels, nb_classes)
+
+            if not ordered:
+                try:
+                    print "Trying smart predict..."
+                    smart_test, pair_table = self.smart_predict(test, probs, V_pair_table, type='int')
+                    Network.class_confusion(smart_test, V_labels, nb_classes)
+                except KeyError:
+                    print "cannot perform smart predicting"
 
-        print 'Predicting...'
-        labels = model.predict_classes([XL, XR])
-        if predict_prob:
-            probs = model.predict_proba([XL, XR])
+        return model, training_history.history
+
+    def train_sentence_model(self, training_input, epochs=5, val_input=None, no_val=False, weight_classes=False, batch_size=256,
+        encoder_dropout=0, decoder_dropout=0, input_dropout=0, reg_W=0, reg_B=0, reg_act=0, LSTM_size=128, dense_size=100,
+        nb_classes=13, callbacks=[], ordered=False, bucket_width=4):
+        '''
+        train a sentence model, see get_untrained_sentence_model().
+        Arguments:
+            training_input: (sentence_input, labels), from _get_sentence_training_input()
+            val_input: (sentence_input, labels, pair_table), from _get_sentence_test_input().
+                       If not given, 20% of the training sentences are used for validation, unless no_val is True
+            batch_size: number of pairs per batch. Sentences are not split across batches
+            bucket_width: sentence lengths are rounded up to a multiple of bucket_width, and each batch
+                          is only padded to the length of its bucket
+            All other parameters feed directly into get_untrained_sentence_model(), and are described there.
+        '''
+        sentence_input, labels = training_input
+        labels = np.asarray(labels)
+        Y = to_categorical(labels, nb_classes)
+
+        # class weights are given as sample weights, since every sample is a sentence of pairs
+        if weight_classes:
+            sample_weights = self.get_uniform_class_weights(Y)[labels].astype('float32')
         else:
-            probs = None
+            sample_weights = np.ones(len(labels), dtype='float32')
 
-        # format of pair_index: {(note_index, (e1, e2)) : index}
-        return labels, probs, pair_index # int labels
+        model = self.get_untrained_sentence_model(self.get_embedding_matrix(), encoder_dropout=encoder_dropout,
+                                                  decoder_dropout=decoder_dropout, input_dropout=input_dropout, reg_W=reg_W,
+                                                  reg_B=reg_B, reg_act=reg_act, LSTM_size=LSTM_size, dense_size=dense_size,
+                                                  nb_classes=nb_classes)
 
-    def smart_predict(self, labels, probs, pair_index, type='int'):
+        V_pair_table = None
+        if no_val:
+            V_input = None
+        elif val_input is None:
+            # split off 20% of the sentences, with all their pairs
+            n_sentences = len(sentence_input[0])
+            order = np.random.permutation(n_sentences)
+            V_input, V_rows = Network._take_sentences(sentence_input, order[:n_sentences / 5])
+            sentence_input, rows = Network._take_sentences(sentence_input, order[n_sentences / 5:])
+            V_labels = labels[V_rows]
+            Y = Y[rows]
+            sample_weights = sample_weights[rows]
+        else:
+            V_input, V_labels, V_pair_table = val_input
 
-        proccessed = {}
-        label_scores = [0.0 for i in labels]
-        for key, index in pair_index.iteritems():
-            if key in proccessed:
-                continue
-            note_index, pair = key
-            label = labels[index]
+        if V_input is None:
+            validation_data = None
+            validation_steps = None
+        else:
+            V_Y = to_categorical(V_labels, nb_classes)
+            validation_steps = len(Network._get_sentence_batches(V_input, batch_size, bucket_width, shuffle=False))
+            validation_data = Network._sentence_batch_generator(V_input, V_Y, np.ones(len(V_Y), dtype='float32'),
+                                                                batch_size, bucket_width, shuffle=False)
+
+        # train the network
+        print 'Training network...'
+        steps_per_epoch = len(Network._get_sentence_batches(sentence_input, batch_size, bucket_width, shuffle=False))
+        training_history = model.fit_generator(Network._sentence_batch_generator(sentence_input, Y, sample_weights, batch_size,
+                                                                                 bucket_width),
+                                               steps_per_epoch, epochs=epochs, validation_data=validation_data,
+                                               validation_steps=validation_steps, callbacks=callbacks)
+
+        if V_input is not None:
+            V_probs = Network._predict_sentences(model, V_input, bucket_width, batch_size=batch_size)
+            test = Network.get_labels_from_probs(V_probs)
+            Network.class_confusion(test, V_labels, nb_classes)
+
+            if V_pair_table is not None and not ordered:
+                try:
+                    print "Trying smart predict..."
+                    smart_test, pair_table = self.smart_predict(test, V_probs, V_pair_table, type='int')
+                    Network.class_confusion(smart_test, V_labels, nb_classes)
+                except KeyError:
+                    print "cannot perform smart predicting"
+
+        return model, training_history.history
+
+    def single_predict(self, notes, model, pair_type, evalu=False, predict_prob=False, bucket_width=4, batch_size=256,
+                       cache_encoders=False):
+        '''
+        predict using a trained single pass model
+        models that take inputs of any length predict on buckets of pairs with similar path lengths,
+        see train_model()
+        batch_size: number of pairs per forward pass
+        cache_encoders: encode every distinct subpath once, and only run the decoder per pair. See _predict_cached()
+        sentence models encode every sentence once anyway, see get_untrained_sentence_model()
+        '''
+        if Network.is_sentence_model(model):
+            sentence_input, _labels, pair_table = self._get_sentence_test_input(notes, pair_type)
+            model = self._get_id_model(model)
+
+            print 'Predicting...'
+            probs = Network._predict_sentences(model, sentence_input, bucket_width, batch_size=batch_size)
+            labels = Network.get_labels_from_probs(probs)
+            if not predict_prob:
+                probs = None
+            return labels, probs, pair_table
 
-            opposite_key = (note_index, (pair[1], pair[0]))
-            opposite_index = pair_index[opposite_key]
-            opposite_label = labels[opposite_index] # predicted label of the opposite pair
+        # models with an Embedding layer take word ids instead of word vectors
+        time_axis = len(model.input_shape[0]) - 1
+        word_ids = time_axis == 1
 
-            if label == 0: # set it to 0, so "no link" has the lowest priority
-                score = 0
+        XL, XR, _labels, pair_table = self._get_test_input(notes, pair_type, word_ids=word_ids)
+        if word_ids:
+            model = self._get_id_model(model)
+
+        # get expected length of model input
+        model_input_len = model.input_shape[0][time_axis]
+
+        if model_input_len is None:
+            print 'Predicting...'
+            if cache_encoders:
+                probs = self._predict_cached(model, XL, XR, bucket_width=bucket_width, batch_size=batch_size)
             else:
-                score = probs[index, label]
-            if opposite_label == 0:
-                opposite_score = 0
+                probs = Network._predict_bucketed(model, XL, XR, bucket_width, batch_size=batch_size)
+        else:
+            if model_input_len > XL.shape[time_axis]:
+                # pad input matrix to fit expected length
+                filler = np.ones((1,) * time_axis + (model_input_len,))
+                XL, _ = Network._pad_to_match_dimensions(XL, filler, time_axis, pad_left=True)
+                XR, _ = Network._pad_to_match_dimensions(XR, filler, time_axis, pad_left=True)
             else:
-                opposite_score = probs[opposite_index, opposite_label]
+                XL = Network._strip_to_length(XL, model_input_len, time_axis)
+                XR = Network._strip_to_length(XR, model_input_len, time_axis)
 
-            if score > opposite_score:
-                labels[opposite_index] = self.reverse_labels([label])[0]
-                label_scores[index] = score
-                label_scores[opposite_index] = score
+            print 'Predicting...'
+            if cache_encoders:
+                probs = self._predict_cached(model, XL, XR, batch_size=batch_size)
             else:
-                labels[index] = self.reverse_labels([opposite_label])[0]
-                label_scores[index] = opposite_score
-                label_scores[opposite_index] = opposite_score
+                probs = model.predict([XL, XR], batch_size=batch_size)
+
+        # a single forward pass gives both the labels and the probabilities
+        labels = Network.get_labels_from_probs(probs)
+        if not predict_prob:
+            probs = None
+
+        # rows of labels and probs are given by pair_table, see PairTable
+        return labels, probs, pair_table # int labels
+
+    def smart_predict(self, labels, probs, pair_table, type='int'):
+        '''
+        make the labels of every pair and its opposite pair agree, keeping the label with the higher score.
+        "no link" has the lowest priority. See smart_predict_arrays()
+        Raises KeyError if a pair of pair_table has no opposite pair
+        '''
+        if (pair_table.opposite < 0).any():
+            raise KeyError("pairs without an opposite pair")
+        labels, label_scores = self.smart_predict_arrays(labels, probs, pair_table.row, pair_table.opposite)
 
-            proccessed[key] = 1
-            proccessed[opposite_key] = 1
         if type == 'int':
-            return labels, pair_index
-        return self._convert_int_labels_to_str(labels), pair_index, label_scores
+            return labels, pair_table
+        return self._convert_int_labels_to_str(labels), pair_table, label_scores
 
-    def _get_training_input(self, notes, pair_type, nolink_ratio=None, presence=False, shuffle=True, ordered=False):
+    def smart_predict_arrays(self, labels, probs, index, opposite_index):
+        '''
+        smart predict for pairs given as int arrays: row index[k] holds a pair, and opposite_index[k] its opposite pair.
+        Both pairs of a symmetric couple are resolved at the first of them in index, so ties go as in a loop over index.
+        Returns the list of labels, and the list of the score each label was chosen with
+        '''
+        labels = np.array(labels, dtype='int64')
+        index = np.asarray(index, dtype='int64')
+        opposite_index = np.asarray(opposite_index, dtype='int64')
+        label_scores = np.zeros(len(labels), dtype='float64')
+
+        # only keep the first pair of each couple
+        position = np.empty(len(labels), dtype='int64')
+        position[index] = np.arange(len(index))
+        first = position[opposite_index] >= np.arange(len(index))
+        index = index[first]
+        opposite_index = opposite_index[first]
+
+        label = labels[index]
+        opposite_label = labels[opposite_index]
+        # set it to 0, so "no link" has the lowest priority
+        score = np.where(label == 0, 0, probs[index, label])
+        opposite_score = np.where(opposite_label == 0, 0, probs[opposite_index, opposite_label])
+
+        forward = score > opposite_score
+        reverse_map = self._get_label_reverse_array()
+        labels[opposite_index[forward]] = reverse_map[label[forward]]
+        labels[index[~forward]] = reverse_map[opposite_label[~forward]]
+
+        scores = np.where(forward, score, opposite_score)
+        label_scores[index] = scores
+        label_scores[opposite_index] = scores
+
+        return labels.tolist(), label_scores.tolist()
+
+    def _get_label_reverse_array(self):
+        '''
+        get reverse_labels() as a lookup array over all int labels
+        '''
+        return np.array(self.reverse_labels(range(len(LABELS))), dtype='int64')
 
-        # data tensor for left and right SDP subpaths
-        XL = None
-        XR = None
+    def _get_training_input(self, notes, pair_type, nolink_ratio=None, presence=False, shuffle=True, ordered=False, word_ids=False,
+                            seed=None):
+        '''
+        get (XL, XR, labels) to train on from notes.
+        no-link pairs are sampled before their paths are extracted, see _sample_training_pairs().
+        seed: seed for sampling and shuffling. Uses the global numpy random state if None
+        '''
+        if seed is None:
+            rng = np.random
+        else:
+            rng = np.random.RandomState(seed)
 
         if self.word_vectors is None:
             print 'Loading word embeddings...'
-            word_vectors = load_word2vec_binary(os.environ["TEA_PATH"] + '/GoogleNews-vectors-negative300.bin', verbose=0)
+            self.word_vectors = load_word_vectors(newsreader_dir=self.newsreader_dir)
 
         print 'Extracting dependency paths...'
         labels = []
+        path_words = [] # (left_words, right_words) of every pair used, in the order of labels
         for i, note in enumerate(notes):
 
-            # get the representation for the event/timex pairs in the note
-            # will be 3D tensor with axis zero holding the each pair, axis 1 holding the word embeddings
-            # (with length equal to word embedding length), and axis 2 hold each word.
-            # del_list is a list of indices for which no SDP could be obtained
-            left_vecs, right_vecs, id_pairs = self._extract_path_representations(note, self.word_vectors, pair_type, ordered=ordered)
+            id_pairs = self._get_candidate_pairs(note, pair_type, ordered=ordered)
 
             # perform a random check, to make sure the data is correctly augmented
             if not id_pairs:
                 print "No pair found:", note.annotated_note_path
                 continue
 
-            pos_case_indexes = []
-            neg_case_indexes = []
-            note_labels = []
-            for index, pair in enumerate(id_pairs):
-                if pair in note.id_to_labels:
-                    pos_case_indexes.append(index)
-                else:
-                    neg_case_indexes.append(index)
-                note_labels.append(note.id_to_labels.get(pair, 'None'))
-            note_labels = np.array(note_labels)
-
-            if nolink_ratio is not None:
-                np.random.shuffle(neg_case_indexes)
-                n_samples = min(len(neg_case_indexes), int(nolink_ratio * len(pos_case_indexes)) )
-                neg_case_indexes = neg_case_indexes[0:n_samples]
-                if not neg_case_indexes:
-                    training_indexes = np.array(pos_case_indexes, dtype=np.int32)
-                else:
-                    training_indexes = np.concatenate([pos_case_indexes, neg_case_indexes])
-                left_vecs = left_vecs[training_indexes, :, :]
-                right_vecs = right_vecs[training_indexes, :, :]
-                note_labels = note_labels[training_indexes]
+            # choose the pairs first, and only get the words on the left and right subpaths of those
+            id_pairs, note_labels = self._sample_training_pairs(note, id_pairs, nolink_ratio=nolink_ratio, rng=rng)
+            id_pair_to_path_words = self._extract_path_words(note, pair_type, ordered=ordered, id_pairs=id_pairs)
 
-            if labels == []:
-                labels = note_labels
-            else:
-                labels = np.concatenate((labels, note_labels))
-
-            # add the note's data to the combine data matrix
-            if XL is None:
-                XL = left_vecs
-            else:
-                XL = Network._pad_and_concatenate(XL, left_vecs, axis=0, pad_left=[2])
-
-            if XR is None:
-                XR = right_vecs
-            else:
-                XR = Network._pad_and_concatenate(XR, right_vecs, axis=0, pad_left=[2])
-
-        # pad XL and XR so that they have the same number of dimensions on the second axis
-        # any other dimension mis-matches are caused by actually errors and should not be padded away
-        XL, XR = Network._pad_to_match_dimensions(XL, XR, 2, pad_left=True)
-
-        # # extract longest input sequence in the training data, and ensure both matrices
-        # input_len = XL.shape[2]
+            labels += note_labels
+            path_words += [id_pair_to_path_words[pair] for pair in id_pairs]
 
         if presence:
             for i, label in enumerate(labels):
                 if label != 0:
                     labels[i] = 1
 
+        # shuffle the pairs before the tensors are built, which is much cheaper than shuffling the tensors
         if shuffle:
-            rng_state = np.random.get_state()
-            np.random.shuffle(XL)
-            np.random.set_state(rng_state)
-            np.random.shuffle(XR)
-            np.random.set_state(rng_state)
-            np.random.shuffle(labels)
+            rng_state = rng.get_state()
+            rng.shuffle(path_words)
+            rng.set_state(rng_state)
+            rng.shuffle(labels)
         del notes
         labels = self._convert_str_labels_to_int(labels)
 
+        # data tensor for left and right SDP subpaths, or word id matrix if word_ids is True
+        # XL and XR have the same length on the last axis
+        XL, XR = self._get_path_tensors(path_words, self.word_vectors, word_ids=word_ids)
+
         return XL, XR, labels
 
-    def _get_test_input(self, notes, pair_type, ordered=False):
-        # data tensor for left and right SDP subpaths
-        XL = None
-        XR = None
+    def _get_candidate_pairs(self, note, pair_type, ordered=False):
+        '''
+        get the sorted id pairs of a note that _extract_path_words() finds paths for, without extracting the paths
+        '''
+        assert pair_type in ('intra', 'cross', 'dct')
+
+        if pair_type == 'intra':
+            id_pairs = note.intra_sentence_pairs
+        elif pair_type == 'cross':
+            id_pairs = note.cross_sentence_pairs
+        else:
+            id_pairs = [(entity_id, 't0') for entity_id, _ in note.dct_pairs]
+
+        if ordered and pair_type != 'dct': # pairs are in narrative order only
+            id_pairs = [key for key in id_pairs if not (key[0][0] == key[1][0] and int(key[0][1:]) > int(key[1][1:]))]
+
+        return sorted(set(id_pairs))
+
+    def _sample_training_pairs(self, note, id_pairs, nolink_ratio=None, rng=np.random):
+        '''
+        choose the id pairs of a note used for training, from its sorted candidate id_pairs.
+        All tlinked pairs are used. if nolink_ratio is given, no-link pairs are sampled, nolink_ratio per tlinked pair.
+        Only the labels in note.id_to_labels are needed, so no path has to be extracted first.
+        Returns the chosen id pairs and their str labels
+        '''
+        pos_case_indexes = []
+        neg_case_indexes = []
+        note_labels = []
+        for index, pair in enumerate(id_pairs):
+            if pair in note.id_to_labels:
+                pos_case_indexes.append(index)
+            else:
+                neg_case_indexes.append(index)
+            note_labels.append(note.id_to_labels.get(pair, 'None'))
+
+        if nolink_ratio is not None:
+            rng.shuffle(neg_case_indexes)
+            n_samples = min(len(neg_case_indexes), int(nolink_ratio * len(pos_case_indexes)) )
+            neg_case_indexes = neg_case_indexes[0:n_samples]
+            training_indexes = pos_case_indexes + neg_case_indexes
+            id_pairs = [id_pairs[x] for x in training_indexes]
+            note_labels = [note_labels[x] for x in training_indexes]
+
+        return id_pairs, note_labels
+
+    def _get_test_input(self, notes, pair_type, ordered=False, word_ids=False):
 
         if self.word_vectors is None:
             print 'Loading word embeddings...'
-            self.word_vectors = load_word2vec_binary(os.environ["TEA_PATH"] + '/GoogleNews-vectors-negative300.bin', verbose=0)
+            self.word_vectors = load_word_vectors(newsreader_dir=self.newsreader_dir)
             # word_vectors = load_word2vec_binary(os.environ["TEA_PATH"]+'/wiki.dim-300.win-8.neg-15.skip.bin', verbose=0)
 
         print 'Extracting dependency paths...'
         labels = None
-        pair_index = {} # record note id and all the used entity pairs
-        index_offset = 0
+        note_pairs = [] # the used entity pairs of every note
+        path_words = [] # (left_words, right_words) of every pair, in the order of note_pairs
         for i, note in enumerate(notes):
 
-            # get the representation for the event/timex pairs in the note
-            # will be 3D tensor with axis zero holding the each pair, axis 1 holding the word embeddings
-            # (with length equal to word embedding length), and axis 2 hold each word.
-            # del_list is a list of indices for which no SDP could be obtained
-            left_vecs, right_vecs, id_pairs = self._extract_path_representations(note, self.word_vectors, pair_type, ordered=ordered)
+            # get the words on the left and right subpaths of the event/timex pairs in the note
+            # must sort the pairs to match the labels correctly
+            id_pair_to_path_words = self._extract_path_words(note, pair_type, ordered=ordered)
+            id_pairs = sorted(id_pair_to_path_words.keys())
 
             # only do the following for labeled data with tlinks
             # tlinks from test data are used to do evaluation
             if note.id_to_labels:
-                note_labels = []
-                index_to_reverse = []
-                for index, pair in enumerate(id_pairs): # id pairs that have tlinks
-                    #pair_index[(i, pair)] = index + index_offset
-
-                    label_from_file = note.id_to_labels.get(pair, 'None')
-                    opposite_from_file = note.id_to_labels.get((pair[1], pair[0]), 'None')
-                    if label_from_file == 'None' and opposite_from_file != 'None':
-                        # print note.annotated_note_path
-                        # print "id pair", pair, label_from_file
-                        # print "opposite", opposite_from_file
-                        index_to_reverse.append(index)
-                        note_labels.append(opposite_from_file) # save the opposite lable first, reverse later
-                    else:
-                        note_labels.append(label_from_file)
-
-                note_labels = self._convert_str_labels_to_int(note_labels)
-                labels_to_reverse = [note_labels[x] for x in index_to_reverse]
-                reversed = self.reverse_labels(labels_to_reverse)
-                print note.annotated_note_path
-                print "{} labels augmented".format(len(reversed))
-
-                note_labels = np.array(note_labels, dtype='int16')
-                index_to_reverse = np.array(index_to_reverse)
-                if index_to_reverse.any():
-                    note_labels[index_to_reverse] = reversed
-
+                note_labels = self._get_note_test_labels(note, id_pairs)
                 if labels is None:
                     labels = note_labels
                 else:
                     labels =np.concatenate((labels, note_labels))
 
-            for index, pair in enumerate(id_pairs):
-                pair_index[(i, pair)] = index + index_offset
+            note_pairs.append(id_pairs)
+            path_words += [id_pair_to_path_words[pair] for pair in id_pairs]
 
-            index_offset += len(id_pairs)
+        # data tensor for left and right SDP subpaths, or word id matrix if word_ids is True
+        # XL and XR have the same length on the last axis
+        XL, XR = self._get_path_tensors(path_words, self.word_vectors, word_ids=word_ids)
 
-            # add the note's data to the combine data matrix
-            if XL is None:
-                XL = left_vecs
-            else:
-                XL = Network._pad_and_concatenate(XL, left_vecs, axis=0, pad_left=[2])
+        return XL, XR, labels, PairTable.from_note_pairs(note_pairs)
 
-            if XR is None:
-                XR = right_vecs
+    def _get_note_test_labels(self, note, id_pairs):
+        '''
+        get the int labels of the id pairs of a labeled note. Pairs whose opposite pair has a tlink get
+        the reverse of its label
+        '''
+        note_labels = []
+        index_to_reverse = []
+        for index, pair in enumerate(id_pairs): # id pairs that have tlinks
+
+            label_from_file = note.id_to_labels.get(pair, 'None')
+            opposite_from_file = note.id_to_labels.get((pair[1], pair[0]), 'None')
+            if label_from_file == 'None' and opposite_from_file != 'None':
+                # print note.annotated_note_path
+                # print "id pair", pair, label_from_file
+                # print "opposite", opposite_from_file
+                index_to_reverse.append(index)
+                note_labels.append(opposite_from_file) # save the opposite lable first, reverse later
             else:
-                XR = Network._pad_and_concatenate(XR, right_vecs, axis=0, pad_left=[2])
+                note_labels.append(label_from_file)
+
+        note_labels = self._convert_str_labels_to_int(note_labels)
+        labels_to_reverse = [note_labels[x] for x in index_to_reverse]
+        reversed = self.reverse_labels(labels_to_reverse)
+        print note.annotated_note_path
+        print "{} labels augmented".format(len(reversed))
 
-        # pad XL and XR so that they have the same number of dimensions on the second axis
-        # any other dimension mis-matches are caused by actually errors and should not be padded away
-        XL, XR = Network._pad_to_match_dimensions(XL, XR, 2, pad_left=True)
+        note_labels = np.array(note_labels, dtype='int16')
+        index_to_reverse = np.array(index_to_reverse)
+        if index_to_reverse.any():
+            note_labels[index_to_reverse] = reversed
 
-        return XL, XR, labels, pair_index
+        return note_labels
+
+    def _get_sentence_training_input(self, notes, pair_type, nolink_ratio=None, ordered=False, seed=None):
+        '''
+        get (sentence_input, labels) to train a sentence model on, see _get_sentence_input().
+        no-link pairs are sampled as in _get_training_input(). Batches are shuffled while training, not here.
+        seed: seed for sampling. Uses the global numpy random state if None
+        '''
+        if seed is None:
+            rng = np.random
+        else:
+            rng = np.random.RandomState(seed)
+
+        print 'Extracting dependency paths...'
+        labels = []
+        note_pairs = []
+        for note in notes:
+            id_pairs = self._get_candidate_pairs(note, pair_type, ordered=ordered)
+            if not id_pairs:
+                print "No pair found:", note.annotated_note_path
+                continue
+
+            id_pairs, note_labels = self._sample_training_pairs(note, id_pairs, nolink_ratio=nolink_ratio, rng=rng)
+            labels += note_labels
+            note_pairs.append((note, id_pairs))
+
+        sentence_input = self._get_sentence_input(note_pairs, pair_type)
+        return sentence_input, self._convert_str_labels_to_int(labels)
+
+    def _get_sentence_test_input(self, notes, pair_type, ordered=False):
+        '''
+        get (sentence_input, labels, pair_table) of every candidate pair of the notes, as _get_test_input()
+        gets (XL, XR, labels, pair_table). See _get_sentence_input()
+        '''
+        print 'Extracting dependency paths...'
+        labels = None
+        note_pairs = []
+        for note in notes:
+            id_pairs = self._get_candidate_pairs(note, pair_type, ordered=ordered)
+            if note.id_to_labels:
+                note_labels = self._get_note_test_labels(note, id_pairs)
+                if labels is None:
+                    labels = note_labels
+                else:
+                    labels = np.concatenate((labels, note_labels))
+            note_pairs.append((note, id_pairs))
 
-    def _extract_path_words(self, note, pair_type, ordered=False):
+        sentence_input = self._get_sentence_input(note_pairs, pair_type)
+        return sentence_input, labels, PairTable.from_note_pairs([id_pairs for note, id_pairs in note_pairs])
+
+    def _get_sentence_input(self, note_pairs, pair_type):
+        '''
+        get the sentences the pairs are in, and where their subpaths are in them.
+        note_pairs is a list of (note, id_pairs). Returns the sentence_input tuple of
+            sentences: int32 word id arrays of the sentences, ids from self.word_index
+            pair_sentence: (n_pairs,) int32 array, index of the sentence of every pair
+            left_positions, right_positions: int32 arrays of the positions of the subpath tokens of every pair
+                                             in its sentence, in the order of _extract_path_words()
+        Pairs are in the order of note_pairs. A sentence is only given once, however many pairs it has.
+        The sentence of a cross-sentence pair is both of its sentences, one after the other
+        '''
+        sentences = []
+        pair_sentence = []
+        left_positions = []
+        right_positions = []
+        for note, id_pairs in note_pairs:
+            sentence_index = {} # (first sentence num, last sentence num) -> index in sentences
+            id_pair_to_positions = self._extract_path_positions(note, pair_type, id_pairs)
+
+            for pair in id_pairs:
+                sentence_nums, left, right = id_pair_to_positions[pair]
+                if sentence_nums not in sentence_index:
+                    sentence_index[sentence_nums] = len(sentences)
+                    words = [token['token'] for num in range(sentence_nums[0], sentence_nums[1] + 1)
+                             for token in note.pre_processed_text[num]]
+                    sentences.append(np.array(Network._get_word_ids(words, self.word_index), dtype='int32'))
+
+                pair_sentence.append(sentence_index[sentence_nums])
+                left_positions.append(np.array(left, dtype='int32'))
+                right_positions.append(np.array(right, dtype='int32'))
+
+        return sentences, np.array(pair_sentence, dtype='int32'), left_positions, right_positions
+
+    def _extract_path_positions(self, note, pair_type, id_pairs):
+        '''
+        get {id pair: ((first sentence num, last sentence num), left positions, right positions)} for pairs of a note.
+        Positions are token offsets in the sentences of the pair, one after the other.
+        An empty subpath is replaced by the tokens of the pair's entities
+        '''
+        if pair_type == 'intra':
+            id_pair_to_path = note.get_intra_sentence_subpaths(pairs=id_pairs)
+        elif pair_type == 'cross':
+            id_pair_to_path = note.get_cross_sentence_subpaths(pairs=id_pairs)
+        else:
+            # the same path in both directions, as in _extract_path_words()
+            t0_to_path = note.get_t0_subpaths(pairs=id_pairs)
+            id_pair_to_path = dict([((entity_id, 't0'), (path, path[::-1])) for entity_id, path in t0_to_path.items()])
+
+        id_pair_to_positions = {}
+        for pair in id_pairs:
+            entity_tokens = [note.id_to_tok[note.id_to_wordIDs[entity_id][0]] for entity_id in pair if entity_id != 't0']
+            sentence_nums = (min([token['sentence_num'] for token in entity_tokens]),
+                             max([token['sentence_num'] for token in entity_tokens]))
+
+            # offset of every sentence of the pair
+            starts = {sentence_nums[0]: 0}
+            for num in range(sentence_nums[0] + 1, sentence_nums[1] + 1):
+                starts[num] = starts[num - 1] + len(note.pre_processed_text[num - 1])
+
+            positions = []
+            for path in id_pair_to_path[pair]:
+                path_tokens = [note.id_to_tok['w' + x[1:]] for x in path] or entity_tokens
+                positions.append([starts[token['sentence_num']] + token['token_offset'] for token in path_tokens])
+
+            id_pair_to_positions[pair] = (sentence_nums, positions[0], positions[1])
+
+        return id_pair_to_positions
+
+    def _extract_path_words(self, note, pair_type, ordered=False, id_pairs=None):
+        '''
+        get {id pair: (left_words, right_words)} for the pairs of a note.
+        id_pairs: only extract the paths of these pairs, from _get_candidate_pairs()
+        '''
         id_pair_to_path_words = {}
 
         assert pair_type in ('intra', 'cross', 'dct')
 
         if pair_type == 'intra' or pair_type == 'both':
-            id_pair_to_path = note.get_intra_sentence_subpaths() #key: (src_id, target_id), value: [left_path, right_path]
+            id_pair_to_path = note.get_intra_sentence_subpaths(pairs=id_pairs) #key: (src_id, target_id), value: [left_path, right_path]
             if ordered: # pairs are in narrative order only
                 for key in id_pair_to_path.keys():
                     if key[0][0] == key[1][0] and int(key[0][1:]) > int(key[1][1:]):
@@ -459,7 +925,7 @@ class Network(object):
                 id_pair_to_path_words[id_pair] = (left_words, right_words)
 
         if pair_type == 'cross' or pair_type == 'both':
-            id_pair_to_path = note.get_cross_sentence_subpaths()
+            id_pair_to_path = note.get_cross_sentence_subpaths(pairs=id_pairs)
             # extract paths of all intra_sentence pairs
             # negative data (no relation) also included
 
@@ -480,7 +946,7 @@ class Network(object):
                 id_pair_to_path_words[id_pair] = (left_words, right_words)
 
         if pair_type == 'dct': # (event, t0) pairs
-            t0_to_path = note.get_t0_subpaths()
+            t0_to_path = note.get_t0_subpaths(pairs=id_pairs)
             for entity_id in t0_to_path:
                 left_path = t0_to_path[entity_id]
                 left_words = [note.id_to_tok['w' + x[1:]]['token'] for x in left_path]
@@ -494,65 +960,157 @@ class Network(object):
 
         id_pair_to_path_words = self._extract_path_words(note, pair_type, ordered=ordered)
 
-        left_vecs = None
-        right_vecs = None
-
-        # get the word vectors for every word in the left pathy
         # must sort it to match the labels correctly
-        for id_pair in sorted(id_pair_to_path_words.keys()):
-            path = id_pair_to_path_words[id_pair][0]
-            left_vecs_path = None
-            for word in path:
-                # try to get embedding for a given word. If the word is not in the vocabulary, use a vector of all 1s.
-                try:
-                    embedding = word_vectors[word]
-                except KeyError:
-                    embedding = np.random.uniform(low=-0.5, high=0.5, size=(300))
+        id_pairs = sorted(id_pair_to_path_words.keys())
+        if not id_pairs:
+            return None, None, id_pairs
 
-                # reshape to 3 dimensions so embeddings can be concatenated together to form the final input values
-                embedding = embedding[np.newaxis, :, np.newaxis]
-                if left_vecs_path is None:
-                    left_vecs_path = embedding
-                else:
-                    left_vecs_path = np.concatenate((left_vecs_path, embedding), axis=2)
+        left_vecs, right_vecs = self._get_path_tensors([id_pair_to_path_words[id_pair] for id_pair in id_pairs], word_vectors)
 
-            if left_vecs_path is None:
-                embedding = np.random.uniform(low=-0.5, high=0.5, size=(300))
-                left_vecs_path = embedding[np.newaxis, :, np.newaxis]
+        return left_vecs, right_vecs, id_pairs
 
-            if left_vecs is None:
-                left_vecs = left_vecs_path
-            else:
-                left_vecs = Network._pad_and_concatenate(left_vecs, left_vecs_path, axis=0, pad_left=[2])
+    def _get_path_tensors(self, path_words, word_vectors, word_ids=False):
+        """
+        build the input tensors of many pairs at once.
+        path_words is a list of (left_words, right_words), one item per pair.
+        Returns two (len(path_words), data_dim, max_len) float32 tensors, with every path padded with zeros on the left.
+        max_len is the longest left or right path.
+        If word_ids is True, returns (len(path_words), max_len) int32 matrices of ids from self.word_index instead.
+        """
+        if word_ids:
+            word_index = self.word_index
+        else:
+            word_index = {} # word -> row in the embedding table. Row 0 is for padding
+        left_ids = []
+        right_ids = []
+        for left_words, right_words in path_words:
+            left_ids.append(Network._get_word_ids(left_words, word_index))
+            right_ids.append(Network._get_word_ids(right_words, word_index))
 
-        # get the vectors for every word in the right path
-            path = id_pair_to_path_words[id_pair][1]
-            right_vecs_path = None
-            for word in path:
-                # try to get embedding for a given word. If the word is not in the vocabulary, use a vector of all 0s.
-                try:
-                    embedding = word_vectors[word]
-                except KeyError:
-                    embedding = np.random.uniform(low=-0.5, high=0.5, size=(300))
+        max_len = max([len(ids) for ids in left_ids + right_ids] + [1])
+        left_ids = Network._pad_ids(left_ids, max_len)
+        right_ids = Network._pad_ids(right_ids, max_len)
+        if word_ids:
+            return left_ids, right_ids
 
-                # reshape to 3 dimensions so embeddings can be concatenated together to form the final input values
-                embedding = embedding[np.newaxis, :, np.newaxis]
-                if right_vecs_path is None:
-                    right_vecs_path = embedding
-                else:
-                    right_vecs_path = np.concatenate((right_vecs_path, embedding), axis=2)
+        # embeddings of the distinct words only
+        table = Network._get_embedding_table(word_vectors, word_index, self.oov_vectors)
 
-            if right_vecs_path is None:
-                embedding = np.random.uniform(low=-0.5, high=0.5, size=(300))
-                right_vecs_path = embedding[np.newaxis, :, np.newaxis]
+        # a single gather for each tensor, (n_pairs, max_len, data_dim) -> (n_pairs, data_dim, max_len)
+        XL = table[left_ids].transpose(0, 2, 1)
+        XR = table[right_ids].transpose(0, 2, 1)
 
-            if right_vecs is None:
-                right_vecs = right_vecs_path
+        return XL, XR
+
+    def get_embedding_matrix(self, n_rows=None):
+        '''
+        (n_rows, data_dim) float32 embeddings of the word ids in self.word_index.
+        Row 0 and any rows beyond the vocabulary are zeros. n_rows defaults to the vocabulary size + 1.
+        '''
+        if self.word_vectors is None:
+            print 'Loading word embeddings...'
+            self.word_vectors = load_word_vectors(newsreader_dir=self.newsreader_dir)
+
+        return Network._get_embedding_table(self.word_vectors, self.word_index, self.oov_vectors, n_rows=n_rows)
+
+    @staticmethod
+    def _get_embedding_table(word_vectors, word_index, oov_vectors, n_rows=None):
+        words = sorted(word_index, key=word_index.get)
+        if n_rows is None:
+            n_rows = len(words) + 1
+        table = np.zeros((n_rows, oov_vectors.dim), dtype='float32')
+        if words:
+            table[1:len(words) + 1] = get_word_matrix(word_vectors, words, oov_vectors)
+        return table
+
+    def _get_id_model(self, model):
+        '''
+        get a word id model whose Embedding layers cover every word in self.word_index.
+        The embeddings are frozen, so the rows of words the model was not trained with can be filled in from the word vectors.
+        The model is copied with larger Embedding layers when the vocabulary outgrows them.
+        '''
+        n_rows = len(self.word_index) + 1
+        if isinstance(model, NumpyModel):
+            # its embeddings can take any number of rows
+            model.set_embedding_matrix(self.get_embedding_matrix(n_rows=n_rows))
+            return model
+
+        # kept on the model, so that it goes away with it
+        id_model = getattr(model, '_id_model', model)
+        input_dim = Network._get_embedding_layers(id_model)[0].input_dim
+        if input_dim < n_rows:
+            # leave room for the words of the next notes
+            input_dim = max(n_rows, 2 * input_dim)
+            id_model = Network._resize_embeddings(id_model, input_dim)
+            model._id_model = id_model
+
+        embedding_matrix = self.get_embedding_matrix(n_rows=input_dim)
+        for layer in Network._get_embedding_layers(id_model):
+            layer.set_weights([embedding_matrix])
+
+        return id_model
+
+    @staticmethod
+    def _resize_embeddings(model, input_dim):
+        '''
+        copy a model, changing the vocabulary size of its Embedding layers. Embedding weights are not copied
+        '''
+        config = json.loads(model.to_json())
+        Network._set_embedding_input_dim(config, input_dim)
+        resized = model_from_json(json.dumps(config))
+
+        for layer, resized_layer in zip(Network._get_layers(model), Network._get_layers(resized)):
+            if not isinstance(layer, Embedding):
+                resized_layer.set_weights(layer.get_weights())
+
+        return resized
+
+    @staticmethod
+    def _set_embedding_input_dim(config, input_dim):
+        if isinstance(config, dict):
+            if config.get('class_name') == 'Embedding':
+                config['config']['input_dim'] = input_dim
+            for value in config.values():
+                Network._set_embedding_input_dim(value, input_dim)
+        elif isinstance(config, list):
+            for value in config:
+                Network._set_embedding_input_dim(value, input_dim)
+
+    @staticmethod
+    def _get_layers(model):
+        '''
+        list the layers of a model, including the layers of nested Sequential and Merge layers
+        '''
+        layers = []
+        for layer in model.layers:
+            if hasattr(layer, 'layers'):
+                layers += Network._get_layers(layer)
             else:
-                right_vecs = Network._pad_and_concatenate(right_vecs, right_vecs_path, axis=0, pad_left=[2])
+                layers.append(layer)
+        return layers
 
-        return left_vecs, right_vecs, sorted(id_pair_to_path_words.keys())
+    @staticmethod
+    def _get_embedding_layers(model):
+        return [layer for layer in Network._get_layers(model) if isinstance(layer, Embedding)]
 
+    @staticmethod
+    def _get_word_ids(words, word_index):
+        '''
+        map the words of a path to rows of the embedding table, adding new words to word_index
+        '''
+        if not words:
+            words = [''] # empty paths are represented by a single (out of vocabulary) word
+        return [word_index.setdefault(word, len(word_index) + 1) for word in words]
+
+    @staticmethod
+    def _pad_ids(id_lists, max_len):
+        '''
+        (len(id_lists), max_len) int32 matrix of the id sequences, padded with 0 on the left
+        '''
+        ids = np.zeros((len(id_lists), max_len), dtype='int32')
+        for i, seq in enumerate(id_lists):
+            ids[i, max_len - len(seq):] = seq
+        return ids
 
     @staticmethod
     def _pad_and_concatenate(a, b, axis, pad_left=[]):
@@ -582,9 +1140,9 @@ class Network(object):
 
         # get function to pad correct side
         if pad_left:
-            concat = lambda X, _pad_shape, _axis: np.concatenate((np.zeros(tuple(_pad_shape)), X), axis=_axis)
+            concat = lambda X, _pad_shape, _axis: np.concatenate((np.zeros(tuple(_pad_shape), dtype=X.dtype), X), axis=_axis)
         else:
-            concat = lambda X, _pad_shape, _axis: np.concatenate((X, np.zeros(tuple(_pad_shape))), axis=_axis)
+            concat = lambda X, _pad_shape, _axis: np.concatenate((X, np.zeros(tuple(_pad_shape), dtype=X.dtype)), axis=_axis)
 
         a_axis = a.shape[axis]
         b_axis = b.shape[axis]
@@ -599,12 +1157,275 @@ class Network(object):
 
         return a, b
 
+    @staticmethod
+    def get_labels_from_probs(probs):
+        '''
+        get the labels model.predict_classes() would give, from the output of model.predict()
+        '''
+        if probs.shape[-1] > 1:
+            return probs.argmax(axis=-1)
+        return (probs > 0.5).astype('int32')
+
+    @staticmethod
+    def _get_path_lengths(XL, XR):
+        """
+        lengths of the pairs' inputs without padding, i.e. the longer of the two paths of each pair
+        """
+        lengths = []
+        for X in (XL, XR):
+            # (n_pairs, max_len) mask of the time steps holding a word
+            if X.ndim == 2:
+                is_word = X != 0
+            else:
+                is_word = np.any(X, axis=1)
+            # paths are padded on the left, so the first word tells the length
+            lengths.append(np.where(is_word.any(axis=1), X.shape[-1] - is_word.argmax(axis=1), 0))
+        return np.maximum(lengths[0], lengths[1])
+
+    @staticmethod
+    def _get_buckets(lengths, bucket_width):
+        """
+        group pairs by length, rounded up to a multiple of bucket_width
+        Returns {bucket length: array of pair indexes}
+        """
+        bucket_lengths = np.maximum((lengths + bucket_width - 1) // bucket_width, 1) * bucket_width
+        buckets = {}
+        for length in np.unique(bucket_lengths):
+            buckets[int(length)] = np.where(bucket_lengths == length)[0]
+        return buckets
+
+    @staticmethod
+    def _count_batches(buckets, batch_size):
+        return sum([(len(indexes) + batch_size - 1) // batch_size for indexes in buckets.values()])
+
+    @staticmethod
+    def _get_bucket(X, indexes, length):
+        """
+        the inputs of some pairs, padded or stripped to exactly length. Only the kept time steps are copied.
+        The input of a pair then only depends on its own length, not on the other pairs in X
+        """
+        time_axis = X.ndim - 1
+        bucket = Network._strip_to_length(X, length, time_axis).take(indexes, axis=0)
+        if bucket.shape[time_axis] < length:
+            filler = np.ones((1,) * time_axis + (length,))
+            bucket, _ = Network._pad_to_match_dimensions(bucket, filler, time_axis, pad_left=True)
+        return bucket
+
+    @staticmethod
+    def _bucket_batches(XL, XR, Y, buckets, batch_size, shuffle=True):
+        """
+        generate ([XL, XR], Y) batches forever, as fit_generator expects.
+        All pairs of a batch come from the same bucket, and are only padded to the length of the bucket.
+        """
+        while True:
+            batches = []
+            for length in sorted(buckets):
+                indexes = buckets[length]
+                if shuffle:
+                    indexes = np.random.permutation(indexes)
+                batches += [(length, indexes[i:i + batch_size]) for i in range(0, len(indexes), batch_size)]
+            if shuffle:
+                np.random.shuffle(batches)
+
+            for length, indexes in batches:
+                yield [Network._get_bucket(XL, indexes, length), Network._get_bucket(XR, indexes, length)], Y[indexes]
+
+    @staticmethod
+    def _predict_bucketed(model, XL, XR, bucket_width, batch_size=256):
+        """
+        predict the probabilities of every pair, one bucket of similar lengths at a time.
+        model must take inputs of any length
+        """
+        probs = np.zeros((XL.shape[0], model.output_shape[-1]), dtype='float32')
+        buckets = Network._get_buckets(Network._get_path_lengths(XL, XR), bucket_width)
+        for length, indexes in buckets.iteritems():
+            probs[indexes] = model.predict([Network._get_bucket(XL, indexes, length), Network._get_bucket(XR, indexes, length)],
+                                           batch_size=batch_size)
+        return probs
+
+    @staticmethod
+    def _get_sentence_batches(sentence_input, batch_size, bucket_width, shuffle=True):
+        """
+        group sentences of similar lengths into batches of about batch_size pairs. Sentences are added to a batch
+        until it has batch_size pairs or more. Lengths are rounded up to a multiple of bucket_width.
+        Returns a list of (bucket length, sentence indexes)
+        """
+        sentences, pair_sentence, _, _ = sentence_input
+        n_pairs = np.bincount(pair_sentence, minlength=len(sentences))
+        buckets = Network._get_buckets(np.array([len(sentence) for sentence in sentences]), bucket_width)
+
+        batches = []
+        for length in sorted(buckets):
+            indexes = buckets[length]
+            if shuffle:
+                indexes = np.random.permutation(indexes)
+            # cut the bucket where the number of pairs reaches batch_size
+            batch_ids = np.concatenate([[0], np.cumsum(n_pairs[indexes])[:-1]]) // max(batch_size, 1)
+            for batch_id in np.unique(batch_ids):
+                batches.append((length, indexes[batch_ids == batch_id]))
+        return batches
+
+    @staticmethod
+    def _get_sentence_batch(sentence_input, sentence_pairs, indexes, length):
+        """
+        build the model input of some sentences, padded with zeros on the right to length.
+        sentence_pairs: the pairs of every sentence, from _get_sentence_pairs().
+        Returns [word ids, left positions, right positions], and the (n_sentences, n_pairs) indexes of their pairs,
+        -1 for padding. Padding pairs pool the first token, so that they get finite probabilities
+        """
+        sentences, _, left_positions, right_positions = sentence_input
+        pairs = [sentence_pairs[i] for i in indexes]
+        n_pairs = max([len(p) for p in pairs])
+        path_len = max([max(len(left_positions[p]), len(right_positions[p])) for p in np.concatenate(pairs)])
+
+        words = np.zeros((len(indexes), length), dtype='int32')
+        left = np.full((len(indexes), n_pairs, path_len), -1, dtype='int32')
+        right = np.full((len(indexes), n_pairs, path_len), -1, dtype='int32')
+        rows = np.full((len(indexes), n_pairs), -1, dtype='int64')
+        for i, (sentence_index, sentence_pair_indexes) in enumerate(zip(indexes, pairs)):
+            words[i, :len(sentences[sentence_index])] = sentences[sentence_index]
+            rows[i, :len(sentence_pair_indexes)] = sentence_pair_indexes
+            for j, pair_index in enumerate(sentence_pair_indexes):
+                left[i, j, :len(left_positions[pair_index])] = left_positions[pair_index]
+                right[i, j, :len(right_positions[pair_index])] = right_positions[pair_index]
+
+        left[rows < 0, 0] = 0
+        right[rows < 0, 0] = 0
+        return [words, left, right], rows
+
+    @staticmethod
+    def _get_sentence_pairs(sentence_input):
+        """
+        get the array of pair indexes of every sentence
+        """
+        pair_sentence = sentence_input[1]
+        order = np.argsort(pair_sentence, kind='mergesort')
+        bounds = np.searchsorted(pair_sentence[order], np.arange(1, len(sentence_input[0])))
+        return np.split(order, bounds)
+
+    @staticmethod
+    def _take_sentences(sentence_input, indexes):
+        """
+        get the sentence_input of some sentences and their pairs, and the indexes of those pairs in sentence_input
+        """
+        sentences, pair_sentence, left_positions, right_positions = sentence_input
+        new_index = np.full(len(sentences), -1, dtype='int32')
+        new_index[indexes] = np.arange(len(indexes))
+        pair_indexes = np.nonzero(new_index[pair_sentence] >= 0)[0]
+
+        return ([sentences[i] for i in indexes], new_index[pair_sentence[pair_indexes]],
+                [left_positions[i] for i in pair_indexes], [right_positions[i] for i in pair_indexes]), pair_indexes
+
+    @staticmethod
+    def _sentence_batch_generator(sentence_input, Y, sample_weights, batch_size, bucket_width, shuffle=True):
+        """
+        generate ([word ids, left positions, right positions], Y, sample weights) batches of sentences forever,
+        as fit_generator expects. Padding pairs have a sample weight of 0
+        """
+        sentence_pairs = Network._get_sentence_pairs(sentence_input)
+        while True:
+            batches = Network._get_sentence_batches(sentence_input, batch_size, bucket_width, shuffle=shuffle)
+            if shuffle:
+                np.random.shuffle(batches)
+
+            for length, indexes in batches:
+                X, rows = Network._get_sentence_batch(sentence_input, sentence_pairs, indexes, length)
+                is_pair = rows >= 0
+                batch_Y = np.zeros(rows.shape + (Y.shape[-1],), dtype='float32')
+                batch_Y[is_pair] = Y[rows[is_pair]]
+                batch_weights = np.zeros(rows.shape, dtype='float32')
+                batch_weights[is_pair] = sample_weights[rows[is_pair]]
+                yield X, batch_Y, batch_weights
+
+    @staticmethod
+    def _predict_sentences(model, sentence_input, bucket_width, batch_size=256):
+        """
+        predict the probabilities of every pair with a sentence model, one batch of sentences at a time
+        """
+        probs = np.zeros((len(sentence_input[1]), model.output_shape[-1]), dtype='float32')
+        sentence_pairs = Network._get_sentence_pairs(sentence_input)
+        for length, indexes in Network._get_sentence_batches(sentence_input, batch_size, bucket_width, shuffle=False):
+            X, rows = Network._get_sentence_batch(sentence_input, sentence_pairs, indexes, length)
+            is_pair = rows >= 0
+            probs[rows[is_pair]] = model.predict_on_batch(X)[is_pair]
+        return probs
+
+    def _predict_cached(self, model, XL, XR, bucket_width=None, batch_size=256):
+        """
+        predict the probabilities of every pair, running each encoder once per distinct subpath.
+        Pairs often share subpaths, e.g. the paths of one entity to every other entity. The encoded subpaths are
+        looked up for every pair, and only the decoder runs per pair.
+        bucket_width: for models that take inputs of any length. Subpaths are encoded with the padding of their
+                      pair's bucket, as in _predict_bucketed(), so the probabilities are the same
+        """
+        encoders, decoder = self._get_split_model(model)
+
+        if bucket_width is None:
+            buckets = {None: slice(None)}
+        else:
+            buckets = Network._get_buckets(Network._get_path_lengths(XL, XR), bucket_width)
+
+        encoded = [None] * len(encoders)
+        for length, indexes in buckets.iteritems():
+            for i, (encoder, X) in enumerate(zip(encoders, (XL, XR))):
+                if length is not None:
+                    X = Network._get_bucket(X, indexes, length)
+                unique_X, inverse = Network._get_unique_rows(X)
+                unique_encoded = encoder(unique_X, batch_size=batch_size)
+
+                if encoded[i] is None:
+                    encoded[i] = np.zeros((XL.shape[0], unique_encoded.shape[-1]), dtype='float32')
+                encoded[i][indexes] = unique_encoded[inverse]
+
+        # the encoder outputs are concatenated in the order of the Merge layer
+        return decoder(np.concatenate(encoded, axis=-1), batch_size=batch_size)
+
+    def _get_split_model(self, model):
+        """
+        get the predict functions of the encoders of a model, and of its decoder on their concatenated outputs.
+        The decoder is a copy of the layers after the Merge layer, with the same weights
+        """
+        # kept on the model, so that it goes away with it
+        if hasattr(model, '_split_model'):
+            return model._split_model
+
+        if isinstance(model, NumpyModel):
+            encoders = [functools.partial(model.predict_branch, i) for i in range(len(model.branches))]
+            split_model = (encoders, model.predict_top)
+        else:
+            merge = model.layers[0]
+            encoders = [encoder.predict for encoder in merge.layers]
+
+            decoder = Sequential()
+            for i, layer in enumerate(model.layers[1:]):
+                config = layer.get_config()
+                if i == 0:
+                    config['batch_input_shape'] = (None, merge.output_shape[-1])
+                decoder.add(layer.__class__.from_config(config))
+                decoder.layers[-1].set_weights(layer.get_weights())
+            split_model = (encoders, decoder.predict)
+
+        model._split_model = split_model
+        return split_model
+
+    @staticmethod
+    def _get_unique_rows(X):
+        """
+        get the distinct rows of X, and the index of the distinct row of every row
+        """
+        rows = np.ascontiguousarray(X).reshape(X.shape[0], -1)
+        keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        return X[first], inverse
+
     @staticmethod
     def _strip_to_length(a, length, axis):
 
         if a.shape[axis] > length:
             snip = a.shape[axis] - length
-            a = a[:,:,snip:]
+            index = [slice(None)] * a.ndim
+            index[axis] = slice(snip, None)
+            a = a[tuple(index)]
 
         return a
 
@@ -690,26 +1511,12 @@ class Network(object):
         del_list = []
         left_vecs = None
         for j, path in enumerate(source_context):
-            vecs_context = None
-            for word in path:
-                # try to get embedding for a given word. If the word is not in the vocabulary, use a vector of all 1s.
-                try:
-                    embedding = word_vectors[word]
-                except KeyError:
-                    embedding = np.random.uniform(low=-0.5, high=0.5, size=(300))
-
-                # reshape to 3 dimensions so embeddings can be concatenated together to form the final input values
-                embedding = embedding[np.newaxis, :, np.newaxis]
-                if vecs_context is None:
-                    vecs_context = embedding
-                else:
-                    vecs_context = np.concatenate((vecs_context, embedding), axis=2)
-
             # if there were no vectors, the link involves the document creation time or is a cross sentence relation.
             # add index to list to indexes to remove and continue
-            if vecs_context is None:
+            if not path:
                 del_list.append(j)
                 continue
+            vecs_context = get_word_matrix(word_vectors, path, self.oov_vectors).T[np.newaxis, :, :]
             if left_vecs is None:
                 left_vecs = vecs_context
             else:
@@ -717,26 +1524,12 @@ class Network(object):
 
         right_vecs = None
         for j, path in enumerate(target_context):
-            vecs_context = None
-            for word in path:
-                # try to get embedding for a given word. If the word is not in the vocabulary, use a vector of all 1s.
-                try:
-                    embedding = word_vectors[word]
-                except KeyError:
-                    embedding = np.random.uniform(low=-0.5, high=0.5, size=(300))
-
-                # reshape to 3 dimensions so embeddings can be concatenated together to form the final input values
-                embedding = embedding[np.newaxis, :, np.newaxis]
-                if vecs_context is None:
-                    vecs_context = embedding
-                else:
-                    vecs_context = np.concatenate((vecs_context, embedding), axis=2)
-
             # if there were no vectors, the link involves the document creation time or is a cross sentence relation.
             # add index to list to indexes to remove and continue
-            if vecs_context is None:
+            if not path:
                 del_list.append(j)
                 continue
+            vecs_context = get_word_matrix(word_vectors, path, self.oov_vectors).T[np.newaxis, :, :]
             if right_vecs is None:
                 right_vecs = vecs_context
             else:
@@ -785,7 +1578,7 @@ class Network(object):
 
         return [LABELS[s] if s<12 else "None" for s in labels]
 
-   def reverse_labels(self, labels):
+    def reverse_labels(self, labels):
         processed_labels = []
 
         for label in labels:
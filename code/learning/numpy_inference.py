@@ -0,0 +1,403 @@
+'''
+Inference with NumPy only, for the models of Network.get_untrained_model() and EventNetwork.get_untrained_model().
+
+The saved architecture is read from its Keras JSON config, and the forward pass is run with batched float32 matmuls,
+without building a Keras graph or compiling backend functions. NumpyModel can be used in place of the Keras model
+by Network.single_predict(), EventNetwork.predict() and EventNetwork.predict_sentences().
+Supported layers: Embedding, Dropout, Permute, Masking, LSTM, Bidirectional(LSTM), TimeDistributed(Dropout),
+TimeDistributed(Dense), MaxPooling1D, GlobalMaxPooling1D, Flatten and Dense, in Sequential models merged by a
+legacy concat Merge layer. This covers EventNetwork.get_untrained_sentence_model() too.
+Functional models, i.e. the sentence models of Network.get_untrained_sentence_model(), are not supported.
+'''
+
+import os
+import json
+
+import numpy as np
+import h5py
+
+
+class UnsupportedModelError(ValueError):
+    '''a model the numpy engine cannot run'''
+    pass
+
+
+def load_numpy_model(arch_path, weights_path=None):
+    '''
+    load a model saved with its .arch.json and .weights.h5 files, or saved whole by model.save() if weights_path is None
+    '''
+    if weights_path is None:
+        with h5py.File(arch_path, 'r') as f:
+            config = json.loads(f.attrs['model_config'])
+            weights = _read_weights(f['model_weights'])
+    else:
+        config = json.load(open(arch_path))
+        with h5py.File(weights_path, 'r') as f:
+            weights = _read_weights(f)
+
+    if config.get('class_name') == 'Model':
+        raise UnsupportedModelError("{} is a functional model, e.g. a sentence model (train_network.py --sentence_encoder). "
+                                    "The numpy engine only runs Sequential models, use Keras for it".format(arch_path))
+    return NumpyModel(config, weights)
+
+
+def load_numpy_tlink_model(model_path, pair_type):
+    '''
+    load a model saved by train_network.py for pair_type ('intra', 'cross' or 'dct')
+    '''
+    return load_numpy_model(os.path.join(model_path, pair_type, '.arch.json'),
+                            os.path.join(model_path, pair_type, '.weights.h5'))
+
+
+def _read_weights(group):
+    '''
+    get {layer name: [weight arrays]} from a group written by Keras' save_weights_to_hdf5_group()
+    '''
+    weights = {}
+    for layer_name in group.attrs['layer_names']:
+        layer_group = group[layer_name]
+        weights[layer_name] = [np.asarray(layer_group[name], dtype='float32') for name in layer_group.attrs['weight_names']]
+    return weights
+
+
+def _get_sequential_layers(config):
+    # Keras 2.0 saves the layers of a Sequential model as a list, later versions under 'layers'
+    if isinstance(config, dict):
+        return config['layers']
+    return config
+
+
+def _activation(name):
+    if name == 'linear':
+        return lambda x: x
+    if name == 'tanh':
+        return np.tanh
+    if name == 'sigmoid':
+        return lambda x: 1. / (1. + np.exp(-x))
+    if name == 'hard_sigmoid':
+        return lambda x: np.clip(0.2 * x + 0.5, 0., 1.)
+    if name == 'relu':
+        return lambda x: np.maximum(x, 0.)
+    if name == 'softmax':
+        def softmax(x):
+            e = np.exp(x - x.max(axis=-1, keepdims=True))
+            return e / e.sum(axis=-1, keepdims=True)
+        return softmax
+    raise ValueError("activation not supported by the numpy engine: {}".format(name))
+
+
+class NumpyModel(object):
+    '''
+    A legacy Sequential model, whose first layer may be a concat Merge of Sequential models.
+    Each merged model takes one of the inputs, in the order of the Merge layer.
+    '''
+
+    def __init__(self, config, weights):
+        if config.get('class_name') != 'Sequential':
+            raise UnsupportedModelError("only Sequential models are supported by the numpy engine")
+
+        layer_configs = _get_sequential_layers(config['config'])
+        if layer_configs[0]['class_name'] == 'Merge':
+            merge_config = layer_configs[0]['config']
+            if merge_config.get('mode', 'concat') != 'concat':
+                raise ValueError("only concat Merge layers are supported by the numpy engine")
+            self.branches = [[NumpyLayer.create(layer, weights) for layer in _get_sequential_layers(branch['config'])]
+                             for branch in merge_config['layers']]
+            layer_configs = layer_configs[1:]
+        else:
+            self.branches = [[]]
+
+        self.layers = [NumpyLayer.create(layer, weights) for layer in layer_configs]
+        self.output_shape = (None, [layer for layer in self.layers if isinstance(layer, NumpyDense)][-1].kernel.shape[1])
+
+        # the input layer of each branch is the first one
+        self.input_shape = [branch[0].input_shape if branch else layer_configs[0]['config'].get('batch_input_shape')
+                            for branch in self.branches]
+        if len(self.input_shape) == 1:
+            self.input_shape = self.input_shape[0]
+
+    def predict(self, inputs, batch_size=256):
+        '''
+        get the output of the model, like keras.models.Sequential.predict()
+        '''
+        if not isinstance(inputs, (list, tuple)):
+            inputs = [inputs]
+
+        return NumpyModel._predict_batches(self._forward, inputs, batch_size)
+
+    def predict_on_batch(self, inputs):
+        if not isinstance(inputs, (list, tuple)):
+            inputs = [inputs]
+        return self._forward(inputs)
+
+    def predict_branch(self, i, X, batch_size=256):
+        '''
+        get the output of the i-th merged model, i.e. what the Merge layer gets from input i
+        '''
+        return NumpyModel._predict_batches(lambda batch: NumpyModel._run_layers(self.branches[i], batch[0]), [X], batch_size)
+
+    def predict_top(self, X, batch_size=256):
+        '''
+        get the output of the layers after the Merge layer, for the concatenated outputs of the merged models
+        '''
+        return NumpyModel._predict_batches(lambda batch: NumpyModel._run_layers(self.layers, batch[0]), [X], batch_size)
+
+    @staticmethod
+    def _predict_batches(forward, inputs, batch_size):
+        n = len(inputs[0])
+        outputs = []
+        for start in range(0, n, batch_size):
+            batch = [X[start:start + batch_size] for X in inputs]
+            outputs.append(forward(batch))
+
+        if not outputs:
+            return forward(inputs)
+        return np.concatenate(outputs)
+
+    def set_embedding_matrix(self, embedding_matrix):
+        '''
+        replace the weights of the (frozen) Embedding layers, see Network._get_id_model()
+        '''
+        for branch in self.branches:
+            for layer in branch + self.layers:
+                if isinstance(layer, NumpyEmbedding):
+                    layer.embeddings = np.asarray(embedding_matrix, dtype='float32')
+
+    def _forward(self, inputs):
+        branch_outputs = [NumpyModel._run_layers(branch, X) for branch, X in zip(self.branches, inputs)]
+
+        if len(branch_outputs) > 1:
+            X = np.concatenate(branch_outputs, axis=-1)
+        else:
+            X = branch_outputs[0]
+
+        return NumpyModel._run_layers(self.layers, X)
+
+    @staticmethod
+    def _run_layers(layers, X):
+        # word ids stay integers
+        if X.dtype.kind in 'fb':
+            X = X.astype('float32', copy=False)
+        mask = None
+        for layer in layers:
+            X, mask = layer(X, mask)
+        return X
+
+
+class NumpyLayer(object):
+    '''
+    A layer of a NumpyModel, created from its Keras config by NumpyLayer.create(). Every class of LAYER_CLASSES
+    defines __call__(X, mask), called with a batch and its timestep mask (or None), returning the output and its mask.
+    '''
+
+    def __init__(self, config, weights):
+        self.name = config['name']
+        self.input_shape = config.get('batch_input_shape')
+        if self.input_shape is not None:
+            self.input_shape = tuple(self.input_shape)
+
+    @staticmethod
+    def create(layer, weights):
+        class_name = layer['class_name']
+        config = layer['config']
+        if class_name == 'TimeDistributed':
+            # the wrapped layer is applied to the last axis anyway. Its weights are saved under the name of the wrapper
+            class_name = config['layer']['class_name']
+            if class_name not in ('Dropout', 'Dense'):
+                raise ValueError("only TimeDistributed(Dropout) and TimeDistributed(Dense) are supported by the numpy engine")
+            wrapper_config = config
+            config = dict(config['layer']['config'], name=wrapper_config['name'])
+            if 'batch_input_shape' in wrapper_config:
+                config['batch_input_shape'] = wrapper_config['batch_input_shape']
+
+        if class_name not in LAYER_CLASSES:
+            raise ValueError("layer not supported by the numpy engine: {}".format(class_name))
+        return LAYER_CLASSES[class_name](config, weights.get(config['name'], []))
+
+
+class NumpyDropout(NumpyLayer):
+    # no dropout at inference time
+
+    def __call__(self, X, mask):
+        return X, mask
+
+
+class NumpyEmbedding(NumpyLayer):
+
+    def __init__(self, config, weights):
+        NumpyLayer.__init__(self, config, weights)
+        self.embeddings = weights[0]
+        if self.input_shape is None:
+            self.input_shape = (None, config.get('input_length'))
+        self.mask_zero = config.get('mask_zero', False)
+
+    def __call__(self, X, mask):
+        X = np.asarray(X, dtype='int64')
+        if self.mask_zero:
+            mask = X != 0
+        return self.embeddings[X], mask
+
+
+class NumpyPermute(NumpyLayer):
+
+    def __init__(self, config, weights):
+        NumpyLayer.__init__(self, config, weights)
+        self.dims = tuple(config['dims'])
+
+    def __call__(self, X, mask):
+        return X.transpose((0,) + self.dims), mask
+
+
+class NumpyMasking(NumpyLayer):
+
+    def __init__(self, config, weights):
+        NumpyLayer.__init__(self, config, weights)
+        self.mask_value = config.get('mask_value', 0.)
+
+    def __call__(self, X, mask):
+        mask = np.any(X != self.mask_value, axis=-1)
+        return X * mask[:, :, np.newaxis], mask
+
+
+class NumpyLSTM(NumpyLayer):
+
+    def __init__(self, config, weights):
+        NumpyLayer.__init__(self, config, weights)
+        self.units = config.get('units', config.get('output_dim'))
+        self.activation = _activation(config.get('activation', 'tanh'))
+        self.recurrent_activation = _activation(config.get('recurrent_activation', config.get('inner_activation', 'hard_sigmoid')))
+        self.return_sequences = config.get('return_sequences', False)
+        self.go_backwards = config.get('go_backwards', False)
+
+        if len(weights) == 12:
+            # Keras 1: W, U and b of the gates i, c, f, o
+            W_i, U_i, b_i, W_c, U_c, b_c, W_f, U_f, b_f, W_o, U_o, b_o = weights
+            self.kernel = np.concatenate([W_i, W_f, W_c, W_o], axis=1)
+            self.recurrent_kernel = np.concatenate([U_i, U_f, U_c, U_o], axis=1)
+            self.bias = np.concatenate([b_i, b_f, b_c, b_o])
+        else:
+            # Keras 2: kernel, recurrent kernel and bias of the gates i, f, c, o
+            self.kernel, self.recurrent_kernel = weights[0], weights[1]
+            if len(weights) > 2:
+                self.bias = weights[2]
+            else:
+                self.bias = np.zeros(4 * self.units, dtype='float32')
+
+    def __call__(self, X, mask):
+        n, n_steps, input_dim = X.shape
+        units = self.units
+
+        # the input part of every gate at every timestep, in one matmul
+        X_gates = (X.reshape(n * n_steps, input_dim).dot(self.kernel) + self.bias).reshape(n, n_steps, 4 * units)
+
+        h = np.zeros((n, units), dtype='float32')
+        c = np.zeros((n, units), dtype='float32')
+        outputs = np.zeros((n, n_steps, units), dtype='float32')
+
+        steps = range(n_steps)
+        if self.go_backwards:
+            steps = steps[::-1]
+
+        for i, t in enumerate(steps):
+            z = X_gates[:, t] + h.dot(self.recurrent_kernel)
+            input_gate = self.recurrent_activation(z[:, :units])
+            forget_gate = self.recurrent_activation(z[:, units:2 * units])
+            c_new = forget_gate * c + input_gate * self.activation(z[:, 2 * units:3 * units])
+            output_gate = self.recurrent_activation(z[:, 3 * units:])
+            h_new = output_gate * self.activation(c_new)
+
+            if mask is not None:
+                # masked timesteps keep the previous states, and output the previous output
+                step_mask = mask[:, t, np.newaxis]
+                c_new = np.where(step_mask, c_new, c)
+                h_new = np.where(step_mask, h_new, h)
+            h, c = h_new, c_new
+            outputs[:, i] = h
+
+        if self.return_sequences:
+            return outputs, mask
+        return h, None
+
+
+class NumpyBidirectional(NumpyLayer):
+
+    def __init__(self, config, weights):
+        NumpyLayer.__init__(self, config, weights)
+        if config['layer']['class_name'] != 'LSTM' or config.get('merge_mode', 'concat') != 'concat':
+            raise ValueError("only concat Bidirectional(LSTM) is supported by the numpy engine")
+
+        # the weights of the forward layer come first
+        layer_config = config['layer']['config']
+        n_weights = len(weights) // 2
+        self.forward_layer = NumpyLSTM(layer_config, weights[:n_weights])
+        self.backward_layer = NumpyLSTM(dict(layer_config, go_backwards=not layer_config.get('go_backwards', False)),
+                                        weights[n_weights:])
+        self.return_sequences = layer_config.get('return_sequences', False)
+
+    def __call__(self, X, mask):
+        forward, forward_mask = self.forward_layer(X, mask)
+        backward, _ = self.backward_layer(X, mask)
+        if self.return_sequences:
+            # the backward outputs come in reverse order
+            backward = backward[:, ::-1]
+        return np.concatenate([forward, backward], axis=-1), forward_mask
+
+
+class NumpyMaxPooling1D(NumpyLayer):
+
+    def __init__(self, config, weights):
+        NumpyLayer.__init__(self, config, weights)
+        pool_size = config.get('pool_size', config.get('pool_length', 2))
+        strides = config.get('strides', config.get('stride'))
+        self.pool_size = pool_size[0] if isinstance(pool_size, (list, tuple)) else pool_size
+        if strides is None:
+            strides = self.pool_size
+        self.strides = strides[0] if isinstance(strides, (list, tuple)) else strides
+        if config.get('padding', config.get('border_mode', 'valid')) != 'valid':
+            raise ValueError("only valid padding is supported by the numpy engine")
+
+    def __call__(self, X, mask):
+        n_steps = (X.shape[1] - self.pool_size) // self.strides + 1
+        pooled = [X[:, t * self.strides:t * self.strides + self.pool_size].max(axis=1) for t in range(n_steps)]
+        return np.stack(pooled, axis=1), None
+
+
+class NumpyGlobalMaxPooling1D(NumpyLayer):
+
+    def __call__(self, X, mask):
+        return X.max(axis=1), None
+
+
+class NumpyFlatten(NumpyLayer):
+
+    def __call__(self, X, mask):
+        return X.reshape((len(X), int(np.prod(X.shape[1:])))), None
+
+
+class NumpyDense(NumpyLayer):
+
+    def __init__(self, config, weights):
+        NumpyLayer.__init__(self, config, weights)
+        if self.input_shape is None and config.get('input_dim') is not None:
+            self.input_shape = (None, config['input_dim'])
+        self.activation = _activation(config.get('activation', 'linear'))
+        self.kernel = weights[0]
+        if len(weights) > 1:
+            self.bias = weights[1]
+        else:
+            self.bias = np.zeros(self.kernel.shape[1], dtype='float32')
+
+    def __call__(self, X, mask):
+        return self.activation(X.dot(self.kernel) + self.bias), mask
+
+
+LAYER_CLASSES = {'Dropout': NumpyDropout,
+                 'Embedding': NumpyEmbedding,
+                 'Permute': NumpyPermute,
+                 'Masking': NumpyMasking,
+                 'LSTM': NumpyLSTM,
+                 'Bidirectional': NumpyBidirectional,
+                 'MaxPooling1D': NumpyMaxPooling1D,
+                 'GlobalMaxPooling1D': NumpyGlobalMaxPooling1D,
+                 'Flatten': NumpyFlatten,
+                 'Dense': NumpyDense}
@@ -0,0 +1,123 @@
+'''
+Columnar table of entity pairs, used instead of {(note_index, (e1, e2)): index} dicts when predicting tlinks.
+'''
+
+import numpy as np
+
+
+class PairTable(object):
+    '''
+    Entity pairs of a set of notes, one int array per column:
+        note: index of the note of the pair
+        source, target: interned entity ids, see entities
+        row: row of the pair in the labels and probabilities predicted for the table
+        opposite: row of the opposite pair (target, source) of the same note, or -1 if there is none
+    Pairs are sorted by note, and offsets[i]:offsets[i+1] are the pairs of note i.
+    '''
+
+    def __init__(self, note, source, target, row, entities, n_notes):
+        self.note = np.asarray(note, dtype='int32')
+        self.source = np.asarray(source, dtype='int32')
+        self.target = np.asarray(target, dtype='int32')
+        self.row = np.asarray(row, dtype='int32')
+        self.entities = np.array(entities, dtype=object) # entity id strings, indexed by the interned ids
+        self.n_notes = n_notes
+
+        self.offsets = np.searchsorted(self.note, np.arange(n_notes + 1))
+        self.opposite = self._get_opposite()
+
+    def __len__(self):
+        return len(self.note)
+
+    @classmethod
+    def from_note_pairs(cls, note_pairs):
+        '''
+        build a table from a list of the (source, target) pairs of every note.
+        Rows are numbered in the order of the pairs
+        '''
+        entity_index = {}
+        note = []
+        source = []
+        target = []
+        for i, pairs in enumerate(note_pairs):
+            for e1, e2 in pairs:
+                note.append(i)
+                source.append(entity_index.setdefault(e1, len(entity_index)))
+                target.append(entity_index.setdefault(e2, len(entity_index)))
+
+        entities = sorted(entity_index, key=entity_index.get)
+        return cls(note, source, target, np.arange(len(note)), entities, len(note_pairs))
+
+    @staticmethod
+    def concatenate(tables):
+        '''
+        merge tables of the same notes. Rows of the merged table are positions in the concatenated rows of the
+        tables, i.e. in np.concatenate([X[table.row] for table in tables]) for the data X of each table.
+        Within a note, pairs keep the order of the tables
+        '''
+        entity_index = {}
+        note = []
+        source = []
+        target = []
+        for table in tables:
+            # re-intern the entities of the table
+            ids = np.array([entity_index.setdefault(e, len(entity_index)) for e in table.entities], dtype='int32')
+            note.append(table.note)
+            source.append(ids[table.source])
+            target.append(ids[table.target])
+
+        note = np.concatenate(note)
+        order = np.argsort(note, kind='mergesort')
+        entities = sorted(entity_index, key=entity_index.get)
+        n_notes = max([table.n_notes for table in tables])
+
+        return PairTable(note[order], np.concatenate(source)[order], np.concatenate(target)[order], order,
+                         entities, n_notes)
+
+    def take(self, indexes):
+        '''
+        get a table of the pairs at indexes, in ascending order. Their rows are unchanged
+        '''
+        return PairTable(self.note[indexes], self.source[indexes], self.target[indexes], self.row[indexes],
+                         self.entities, self.n_notes)
+
+    def get_note_slice(self, note_index):
+        return slice(self.offsets[note_index], self.offsets[note_index + 1])
+
+    def get_pairs(self, indexes=slice(None)):
+        '''
+        get the (source, target) entity id strings of the pairs at indexes
+        '''
+        return zip(self.entities[self.source[indexes]].tolist(), self.entities[self.target[indexes]].tolist())
+
+    def get_first_of_couples(self):
+        '''
+        get the indexes of the pairs whose opposite pair has the same or a later row, or has no opposite pair.
+        This keeps one pair of every couple of opposite pairs
+        '''
+        position = np.zeros(self.row.max() + 1 if len(self) else 0, dtype='int64')
+        position[self.row] = np.arange(len(self))
+        has_opposite = self.opposite >= 0
+        first = ~has_opposite
+        first[has_opposite] = position[self.opposite[has_opposite]] >= np.nonzero(has_opposite)[0]
+
+        return np.nonzero(first)[0]
+
+    def _get_opposite(self):
+        '''
+        find the row of the opposite pair of every pair, by searching the sorted (note, source, target) keys
+        '''
+        if len(self) == 0:
+            return np.zeros(0, dtype='int32')
+
+        n_entities = len(self.entities)
+        note = self.note.astype('int64')
+        key = (note * n_entities + self.source) * n_entities + self.target
+        opposite_key = (note * n_entities + self.target) * n_entities + self.source
+
+        order = np.argsort(key, kind='mergesort')
+        sorted_key = key[order]
+        found_at = np.minimum(np.searchsorted(sorted_key, opposite_key), len(self) - 1)
+        found = sorted_key[found_at] == opposite_key
+
+        return np.where(found, self.row[order[found_at]], -1).astype('int32')
@@ -1,4 +1,5 @@
 from code.notes.utilities.timeml_utilities import get_doctime_timex
+from code.learning.pair_table import PairTable
 import re
 
 class TimeRefNetwork(object):
@@ -18,7 +19,7 @@ class TimeRefNetwork(object):
         try:
             dct = self.note.doctime
         except AttributeError:
-            dct = get_doctime_timex(self.note.note_path)
+            dct = get_doctime_timex(self.note.timeml_document)
         t0_value = dct.attrib['value']
         # currently we only care about dates, not hours etc.
         match = re.match('[\d\-]+', t0_value)
@@ -164,25 +165,18 @@ class TimeRefNetwork(object):
 
 def predict_timex_rel(notes):
     labels = []
-    pair_index = {}
-    index_offset = 0
+    note_pairs = []
     for i, note in enumerate(notes):
         time_ref = TimeRefNetwork(note)
         note_predictions, failed_pairs = time_ref.compare_timex_pairs()
         note.cross_sentence_pairs += failed_pairs # send them to cross-sentence model
 
-        n = len(note_predictions)
-        note_keys = [(i, pair) for pair, rel in note_predictions]
-        note_indexes = [x+index_offset for x in range(n)]
-        note_pair_index = dict(zip(note_keys, note_indexes))
-
+        note_pairs.append([pair for pair, rel in note_predictions])
         labels += note_predictions
-        pair_index.update(note_pair_index)
-        index_offset += n
 
     # only return relations from labels, not pairs
     labels = [x[1] for x in labels]
 
-    return labels, pair_index
+    return labels, PairTable.from_note_pairs(note_pairs)
 
 
@@ -0,0 +1,187 @@
+'''
+On-disk cache of Network training data, with one shard of .npy files per training note.
+
+The manifest records the parameters the data was built with, the word embeddings it was looked up in
+and a hash of every cached note. Shards of new or changed notes are built and added without
+rebuilding the others. The training data is assembled into memory-mapped files in the cache directory,
+so it is not held in memory during training.
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+import cPickle
+
+import numpy as np
+
+from word2vec import get_word_vectors_source
+from code.notes.note_cache import load_note
+
+CACHE_VERSION = 1
+MANIFEST = 'manifest.json'
+VOCABULARY = 'vocabulary.pickle' # words of the word ids, in id order, for word id caches
+
+
+def _md5_file(fname, block_size=1 << 20):
+    md5 = hashlib.md5()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), ''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class TrainingDataCache(object):
+    '''
+    Training data of a set of notes, for one pair type and sampling setting.
+    Caches built with other settings are kept in sibling directories.
+    '''
+
+    def __init__(self, cache_dir, pair_type, nolink_ratio=None, ordered=False, word_ids=False, word_vectors=None):
+        '''
+        word_vectors: the embeddings training data is looked up in, as returned by load_word_vectors(). An embedding
+        subset is identified by the embeddings it was cut from, see get_word_vectors_source()
+        '''
+        self.pair_type = pair_type
+        self.nolink_ratio = nolink_ratio
+        self.ordered = ordered
+        self.word_ids = word_ids
+
+        self.params = {'version': CACHE_VERSION, 'pair_type': pair_type, 'nolink_ratio': nolink_ratio,
+                       'ordered': ordered, 'word_ids': word_ids}
+        key = hashlib.md5(json.dumps(self.params, sort_keys=True)).hexdigest()[:12]
+        self.cache_dir = os.path.join(cache_dir, '%s-%s' % (pair_type, key))
+
+        # word ids do not depend on the embeddings
+        if word_ids:
+            self.params['word_vectors'] = None
+        else:
+            self.params['word_vectors'] = get_word_vectors_source(word_vectors)
+
+    def load(self, network, note_files, shuffle=True):
+        '''
+        get (XL, XR, labels) for the cached notes in note_files, formatted as by Network._get_training_input().
+        Shards of notes that are not in the cache, or changed since, are built with network first.
+        For word id caches, network.word_index is replaced with the vocabulary of the cache.
+        '''
+        manifest = self._read_manifest()
+        if self.word_ids:
+            vocabulary = self._read_vocabulary() if manifest['shards'] else []
+            network.word_index = dict((word, i + 1) for i, word in enumerate(vocabulary))
+
+        names = []
+        changed = False
+        for note_file in note_files:
+            name = os.path.basename(note_file)
+            note_md5 = _md5_file(note_file)
+            shard = manifest['shards'].get(name)
+            if shard is None or shard['note_md5'] != note_md5:
+                print "caching training data of", note_file
+                manifest['shards'][name] = self._write_shard(network, name, note_file, note_md5)
+                changed = True
+            names.append(name)
+
+        if changed:
+            if self.word_ids:
+                self._write_vocabulary(sorted(network.word_index, key=network.word_index.get))
+            self._write_manifest(manifest)
+
+        return self._read_shards(manifest, names, shuffle=shuffle)
+
+    def _read_manifest(self):
+        manifest_path = os.path.join(self.cache_dir, MANIFEST)
+        if os.path.isfile(manifest_path):
+            manifest = json.load(open(manifest_path))
+            if manifest['params'] == self.params:
+                return manifest
+            print "training data cache {} was built with other settings, rebuilding".format(self.cache_dir)
+
+        return {'params': self.params, 'shards': {}}
+
+    def _write_manifest(self, manifest):
+        # replace the manifest in one step, so it always describes complete shards
+        manifest_path = os.path.join(self.cache_dir, MANIFEST)
+        json.dump(manifest, open(manifest_path + '.tmp', 'w'), indent=1, sort_keys=True)
+        os.rename(manifest_path + '.tmp', manifest_path)
+
+    def _read_vocabulary(self):
+        return cPickle.load(open(os.path.join(self.cache_dir, VOCABULARY), 'rb'))
+
+    def _write_vocabulary(self, vocabulary):
+        vocabulary_path = os.path.join(self.cache_dir, VOCABULARY)
+        cPickle.dump(vocabulary, open(vocabulary_path + '.tmp', 'wb'), cPickle.HIGHEST_PROTOCOL)
+        os.rename(vocabulary_path + '.tmp', vocabulary_path)
+
+    def _get_shard_path(self, name, key):
+        return os.path.join(self.cache_dir, 'shards', '%s.%s.npy' % (name, key))
+
+    def _write_shard(self, network, name, note_file, note_md5):
+        if not os.path.isdir(os.path.join(self.cache_dir, 'shards')):
+            os.makedirs(os.path.join(self.cache_dir, 'shards'))
+
+        note = load_note(note_file)
+        XL, XR, labels = network._get_training_input([note], self.pair_type, nolink_ratio=self.nolink_ratio, shuffle=False,
+                                                     ordered=self.ordered, word_ids=self.word_ids)
+
+        np.save(self._get_shard_path(name, 'XL'), XL)
+        np.save(self._get_shard_path(name, 'XR'), XR)
+        np.save(self._get_shard_path(name, 'labels'), np.array(labels, dtype='int16'))
+
+        return {'note_md5': note_md5, 'n_pairs': len(labels), 'max_len': XL.shape[-1],
+                'dtype': str(XL.dtype), 'shape': list(XL.shape[1:-1])}
+
+    def _read_shards(self, manifest, names, shuffle=True):
+        '''
+        assemble the shards into single tensors, left padded to the longest path of all shards.
+        Shards are memory-mapped, and copied once into the (shuffled) rows of the tensors, which are memory-mapped too,
+        see _create_memmap()
+        '''
+        shards = [manifest['shards'][name] for name in names]
+        n_pairs = sum([shard['n_pairs'] for shard in shards])
+        max_len = max([shard['max_len'] for shard in shards] + [1])
+        if shards:
+            dtype = shards[0]['dtype']
+            shape = tuple(shards[0]['shape'])
+        elif self.word_ids:
+            dtype, shape = 'int32', ()
+        else:
+            dtype, shape = 'float32', (300,)
+
+        XL = self._create_memmap((n_pairs,) + shape + (max_len,), dtype)
+        XR = self._create_memmap((n_pairs,) + shape + (max_len,), dtype)
+        labels = np.zeros(n_pairs, dtype='int16')
+
+        if shuffle:
+            rows = np.random.permutation(n_pairs)
+        else:
+            rows = np.arange(n_pairs)
+
+        offset = 0
+        for name, shard in zip(names, shards):
+            if shard['n_pairs'] == 0:
+                continue
+            shard_rows = rows[offset:offset + shard['n_pairs']]
+            offset += shard['n_pairs']
+
+            for key, X in (('XL', XL), ('XR', XR)):
+                shard_X = np.load(self._get_shard_path(name, key), mmap_mode='r')
+                X[shard_rows, ..., max_len - shard_X.shape[-1]:] = shard_X
+            labels[shard_rows] = np.load(self._get_shard_path(name, 'labels'))
+
+        XL.flush()
+        XR.flush()
+        return XL, XR, list(labels)
+
+    def _create_memmap(self, shape, dtype):
+        '''
+        zero filled array memory-mapped from a file in the cache directory. The file is removed right away, so it
+        belongs to this process only, and its space is freed when the array is. Its pages are read back as needed
+        '''
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        fd, path = tempfile.mkstemp(dir=self.cache_dir, prefix='training_data.', suffix='.npy')
+        os.close(fd)
+        try:
+            return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+        finally:
+            os.remove(path)
@@ -0,0 +1,215 @@
+'''
+Stream Network training batches from cached notes, so that neither the notes nor the training tensors
+have to be held in memory.
+'''
+
+import itertools
+import multiprocessing
+import threading
+
+import numpy as np
+from keras.utils.np_utils import to_categorical
+
+from network import Network, LABELS
+from word2vec import load_word_vectors
+from code.notes.note_cache import load_note
+
+
+def _scan_note(args):
+    '''
+    count the training pairs and labels of a cached note, and get its longest path, its words,
+    and the input lengths of a sample of its training pairs
+    '''
+    note_file, pair_type, nolink_ratio, ordered = args
+    network = Network()
+    note = load_note(note_file)
+    # any pair may be sampled, so look at the paths of all of them
+    id_pair_to_path_words = network._extract_path_words(note, pair_type, ordered=ordered)
+
+    longest_path = 1
+    words = set()
+    for left_words, right_words in id_pair_to_path_words.values():
+        longest_path = max(longest_path, len(left_words), len(right_words))
+        words.update(left_words or [''])
+        words.update(right_words or [''])
+
+    # the number of sampled no-link pairs does not depend on the sample
+    id_pairs, labels = network._sample_training_pairs(note, sorted(id_pair_to_path_words.keys()), nolink_ratio=nolink_ratio)
+    label_counts = np.bincount(network._convert_str_labels_to_int(labels), minlength=len(LABELS))
+    # empty paths are input as a single word, like in Network._get_path_tensors()
+    lengths = np.array([max(len(id_pair_to_path_words[pair][0]), len(id_pair_to_path_words[pair][1]), 1) for pair in id_pairs],
+                       dtype='int32')
+
+    return len(labels), longest_path, label_counts, words, lengths
+
+
+def _sample_note(args):
+    '''
+    get the path words and int labels of the training pairs of a cached note
+    '''
+    note_file, pair_type, nolink_ratio, ordered, seed = args
+    network = Network()
+    note = load_note(note_file)
+
+    id_pairs = network._get_candidate_pairs(note, pair_type, ordered=ordered)
+    id_pairs, labels = network._sample_training_pairs(note, id_pairs, nolink_ratio=nolink_ratio, rng=np.random.RandomState(seed))
+    id_pair_to_path_words = network._extract_path_words(note, pair_type, ordered=ordered, id_pairs=id_pairs)
+
+    return [id_pair_to_path_words[pair] for pair in id_pairs], network._convert_str_labels_to_int(labels)
+
+
+class TrainingStream(object):
+    '''
+    Generator of ([XL, XR], Y) training batches, to be passed to Network.train_model_streaming().
+
+    The notes are read from their pickles in a new random order every epoch, and no-link pairs are sampled
+    again every epoch. A pool of worker processes reads and samples the next notes while batches are built.
+    Pairs are shuffled within a pool of shuffle_size pairs.
+    '''
+
+    def __init__(self, network, note_files, pair_type, nolink_ratio=None, ordered=False, batch_size=100, word_ids=False,
+                 max_len='auto', max_len_percentile=None, nb_classes=13, shuffle_size=5000, workers=2):
+        '''
+        Arguments:
+            network: Network building the batches. Its word vectors are loaded if needed
+            note_files: cached notes to train on
+            word_ids: make batches of word ids instead of word vectors. The words of every note are added to
+                      network.word_index when the stream is created
+            max_len: length every batch is padded (or stripped) to. 'auto' is the longest path in the notes.
+                     If None, each batch is only padded to its longest path, and batches are made of pairs with
+                     similar lengths, for models that take inputs of any length
+            max_len_percentile: cap the input length at this percentile of the path lengths of the pairs, as
+                                sampled when the notes are scanned. Longer paths are truncated
+            workers: number of processes reading notes. 0 reads them in the training process
+        '''
+        self.network = network
+        self.note_files = list(note_files)
+        self.pair_type = pair_type
+        self.nolink_ratio = nolink_ratio
+        self.ordered = ordered
+        self.batch_size = batch_size
+        self.word_ids = word_ids
+        self.nb_classes = nb_classes
+        self.shuffle_size = max(shuffle_size, batch_size)
+
+        if workers > 0:
+            self.pool = multiprocessing.Pool(workers)
+            self._map = self.pool.imap
+        else:
+            self.pool = None
+            self._map = itertools.imap
+
+        if network.word_vectors is None and not word_ids:
+            print 'Loading word embeddings...'
+            network.word_vectors = load_word_vectors(newsreader_dir=network.newsreader_dir)
+
+        self._scan()
+        if max_len_percentile is None:
+            self.truncate_len = None
+        else:
+            self.truncate_len = max(int(np.ceil(np.percentile(self.lengths, max_len_percentile))), 1)
+            print "max_len {} at percentile {}: {} of {} sampled pairs truncated".format(
+                self.truncate_len, max_len_percentile, np.sum(self.lengths > self.truncate_len), len(self.lengths))
+        if max_len == 'auto':
+            max_len = self.longest_path if self.truncate_len is None else min(self.longest_path, self.truncate_len)
+        self.max_len = max_len
+        self.steps_per_epoch = (self.n_pairs + batch_size - 1) // batch_size
+        print "training pairs: {}, batches per epoch: {}, max_len: {}".format(self.n_pairs, self.steps_per_epoch, self.max_len)
+
+        # fit_generator may read the stream from several threads
+        self.lock = threading.Lock()
+        self._batches = self._generate_batches()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        with self.lock:
+            return next(self._batches)
+
+    __next__ = next
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def _scan(self):
+        print 'Scanning notes...'
+        self.n_pairs = 0
+        self.longest_path = 1
+        self.label_counts = np.zeros(len(LABELS), dtype='int64')
+        lengths = []
+
+        args = [(note_file, self.pair_type, self.nolink_ratio, self.ordered) for note_file in self.note_files]
+        for n_pairs, longest_path, label_counts, words, note_lengths in self._map(_scan_note, args):
+            self.n_pairs += n_pairs
+            self.longest_path = max(self.longest_path, longest_path)
+            self.label_counts += label_counts
+            lengths.append(note_lengths)
+            if self.word_ids:
+                Network._get_word_ids(sorted(words), self.network.word_index)
+        self.lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype='int32')
+
+    def _generate_batches(self):
+        while True:
+            order = np.random.permutation(len(self.note_files))
+            args = [(self.note_files[i], self.pair_type, self.nolink_ratio, self.ordered, np.random.randint(2**31 - 1))
+                    for i in order]
+
+            path_words = []
+            labels = []
+            for note_path_words, note_labels in self._map(_sample_note, args):
+                path_words += note_path_words
+                labels += note_labels
+                if len(path_words) >= self.shuffle_size:
+                    batches, path_words, labels = self._split_batches(path_words, labels)
+                    for batch in batches:
+                        yield self._get_batch(*batch)
+
+            # the rest of the epoch, including the last partial batch
+            batches, _, _ = self._split_batches(path_words, labels, last=True)
+            for batch in batches:
+                yield self._get_batch(*batch)
+
+    def _split_batches(self, path_words, labels, last=False):
+        '''
+        shuffle the pairs and split them into batches. Returns the batches and the pairs left over
+        '''
+        order = np.random.permutation(len(path_words))
+        if last:
+            n_used = len(order)
+        else:
+            n_used = len(order) // self.batch_size * self.batch_size
+        used = order[:n_used]
+
+        if self.max_len is None:
+            # put pairs of similar lengths in the same batch
+            lengths = [max(len(path_words[i][0]), len(path_words[i][1])) for i in used]
+            used = used[np.argsort(lengths, kind='mergesort')]
+
+        batches = []
+        for i in range(0, n_used, self.batch_size):
+            batch = used[i:i + self.batch_size]
+            batches.append(([path_words[x] for x in batch], [labels[x] for x in batch]))
+        np.random.shuffle(batches)
+
+        left = order[n_used:]
+        return batches, [path_words[x] for x in left], [labels[x] for x in left]
+
+    def _get_batch(self, path_words, labels):
+        XL, XR = self.network._get_path_tensors(path_words, self.network.word_vectors, word_ids=self.word_ids)
+
+        if self.max_len is not None:
+            time_axis = XL.ndim - 1
+            filler = np.ones((1,) * time_axis + (self.max_len,))
+            XL, _ = Network._pad_to_match_dimensions(XL, filler, time_axis, pad_left=True)
+            XR, _ = Network._pad_to_match_dimensions(XR, filler, time_axis, pad_left=True)
+            XL = Network._strip_to_length(XL, self.max_len, time_axis)
+            XR = Network._strip_to_length(XR, self.max_len, time_axis)
+        elif self.truncate_len is not None:
+            # batches of any length are truncated too
+            XL = Network._strip_to_length(XL, self.truncate_len, XL.ndim - 1)
+            XR = Network._strip_to_length(XR, self.truncate_len, XR.ndim - 1)
+
+        return [XL, XR], to_categorical(labels, self.nb_classes)
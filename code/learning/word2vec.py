@@ -1,14 +1,35 @@
 import sys
 import os
+import glob
+import json
+import mmap
+import hashlib
+import bisect
+import collections
 import numpy as np
 import cPickle as pickle
 
+from code.notes.note_cache import NOTE_EXTENSION, get_cached_vocabulary
+
+# files making up a converted embedding store (see convert_word2vec_binary)
+STORE_VECTORS = 'vectors.npy'       # float32 matrix, one row per word, in the order of the original file
+STORE_WORDS = 'words.bin'           # all words concatenated, in sorted order
+STORE_OFFSETS = 'word_offsets.npy'  # int64, start of every sorted word in STORE_WORDS, plus the end of the last one
+STORE_ROWS = 'word_rows.npy'        # int32, row in STORE_VECTORS for every sorted word
+SUBSET_MANIFEST = 'manifest.json'   # note files a corpus subset was built from, its out of vocabulary words, and its source
+
+
+class WordVectorDict(dict):
+    """word -> vector dict of a parsed word2vec binary file. source identifies the file, see get_word_vectors_source()"""
+    source = None
+
 
 def load_word2vec_binary(fname='/data1/nlp-data/GoogleNews-vectors-negative300.bin', verbose=1, dev=False):
     """
     Loads 300x1 word vecs from Google (Mikolov) word2vec
     """
-    word_vecs = {}
+    word_vecs = WordVectorDict()
+    word_vecs.source = _get_file_source(fname)
     if verbose:
         print 'loading word2vec'
     with open(fname, "rb") as f:
@@ -36,6 +57,414 @@ def load_word2vec_binary(fname='/data1/nlp-data/GoogleNews-vectors-negative300.b
     return word_vecs
 
 
+def get_word2vec_path():
+    """path of the GoogleNews binary file shipped with TEA"""
+    return os.environ["TEA_PATH"] + '/GoogleNews-vectors-negative300.bin'
+
+
+def get_store_path(fname):
+    """default location of the converted store for a word2vec binary file"""
+    if fname.endswith('.bin'):
+        fname = fname[:-len('.bin')]
+    return fname + '.store'
+
+
+def _get_file_source(fname):
+    stat = os.stat(fname)
+    return {'path': os.path.abspath(fname), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def get_embeddings_source(fname=None):
+    """
+    identify the embeddings load_word_vectors(fname) reads when there is no subset: the converted store if there is one,
+    otherwise the word2vec binary file. None if neither exists
+    """
+    if fname is None:
+        fname = get_word2vec_path()
+    store_dir = fname if os.path.isdir(fname) else get_store_path(fname)
+
+    if os.path.isfile(os.path.join(store_dir, STORE_VECTORS)):
+        return _get_file_source(os.path.join(store_dir, STORE_VECTORS))
+    if os.path.isfile(fname):
+        return _get_file_source(fname)
+    return None
+
+
+def get_word_vectors_source(word_vectors):
+    """
+    identify the embeddings of word vectors returned by load_word_vectors(). A subset is identified by the embeddings
+    it was cut from, as it has the same vectors. None for other mappings
+    """
+    return getattr(word_vectors, 'source', None)
+
+
+def convert_word2vec_binary(fname, store_dir=None, verbose=1):
+    """
+    Convert a word2vec binary file into a store that can be memory-mapped by WordVectorStore.
+    This only needs to be done once. Returns the path of the store.
+    """
+    if store_dir is None:
+        store_dir = get_store_path(fname)
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    word_to_row = {}
+    with open(fname, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = data.find('\n')
+        vocab_size, layer1_size = map(int, data[:header_end].split())
+        binary_len = np.dtype('float32').itemsize * layer1_size
+
+        vectors = np.lib.format.open_memmap(os.path.join(store_dir, STORE_VECTORS), mode='w+',
+                                            dtype='float32', shape=(vocab_size, layer1_size))
+        position = header_end + 1
+        for row in xrange(vocab_size):
+            if verbose and row % (vocab_size/40 or 1) == 0:
+                print '%6.2f %%' % (100*float(row)/vocab_size)
+            word_end = data.find(' ', position)
+            word = data[position:word_end].lstrip('\n')
+            position = word_end + 1
+            vectors[row] = np.fromstring(data[position:position+binary_len], dtype='float32')
+            position += binary_len
+            # later duplicates win, like they do in load_word2vec_binary()
+            word_to_row[word] = row
+        vectors.flush()
+        del vectors
+        data.close()
+
+    _write_store_index(store_dir, word_to_row)
+
+    if verbose:
+        print "converted %d words to %s" % (len(word_to_row), store_dir)
+    return store_dir
+
+
+def _write_store_index(store_dir, word_to_row):
+    """write the sorted vocabulary of a store. word_to_row maps every word to its row in the vector matrix"""
+    words = sorted(word_to_row)
+    offsets = np.zeros(len(words)+1, dtype='int64')
+    with open(os.path.join(store_dir, STORE_WORDS), 'wb') as f:
+        for i, word in enumerate(words):
+            f.write(word)
+            offsets[i+1] = offsets[i] + len(word)
+    rows = np.array([word_to_row[word] for word in words], dtype='int32')
+    np.save(os.path.join(store_dir, STORE_OFFSETS), offsets)
+    np.save(os.path.join(store_dir, STORE_ROWS), rows)
+
+
+class _SortedWords(object):
+    """sequence view of the sorted words in a store, so bisect can search it without loading it"""
+
+    def __init__(self, words, offsets):
+        self.words = words
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.words[int(self.offsets[i]):int(self.offsets[i+1])]
+
+
+class WordVectorStore(collections.Mapping):
+    """
+    Read-only word -> vector mapping backed by a store written by convert_word2vec_binary().
+    Every file is memory-mapped, so opening a store takes milliseconds, and concurrent
+    processes share the same pages through the page cache.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.vectors = np.load(os.path.join(store_dir, STORE_VECTORS), mmap_mode='r')
+        offsets = np.load(os.path.join(store_dir, STORE_OFFSETS), mmap_mode='r')
+        self.rows = np.load(os.path.join(store_dir, STORE_ROWS), mmap_mode='r')
+
+        words_file = os.path.join(store_dir, STORE_WORDS)
+        if os.path.getsize(words_file) > 0:
+            with open(words_file, 'rb') as f:
+                words = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            words = ''
+        self._words = _SortedWords(words, offsets)
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    @property
+    def source(self):
+        return _get_file_source(os.path.join(self.store_dir, STORE_VECTORS))
+
+    def row(self, word):
+        """row of the word in self.vectors, or -1 if the word is not in the store"""
+        # a binary search of the memory-mapped index. Nothing is cached, so memory does not grow with the words looked up
+        key = word.encode('utf-8') if isinstance(word, unicode) else word
+        i = bisect.bisect_left(self._words, key)
+        if i < len(self._words) and self._words[i] == key:
+            return int(self.rows[i])
+        return -1
+
+    def __getitem__(self, word):
+        row = self.row(word)
+        if row < 0:
+            raise KeyError(word)
+        return self.vectors[row]
+
+    def __contains__(self, word):
+        return self.row(word) >= 0
+
+    def __len__(self):
+        return len(self._words)
+
+    def __iter__(self):
+        for i in xrange(len(self._words)):
+            yield self._words[i]
+
+
+class SubsetWordVectors(collections.Mapping):
+    """
+    Word -> vector mapping over a corpus subset written by build_word_vector_subset().
+    Words missing from the subset are looked up in the full embeddings, which are only loaded
+    the first time such a word is requested.
+    """
+
+    def __init__(self, subset_dir, load_full, oov_words=(), source=None):
+        self.subset = WordVectorStore(subset_dir)
+        self.oov_words = set(oov_words) # corpus words known to be missing from the full embeddings
+        self.source = source # the full embeddings, see get_embeddings_source()
+        self._load_full = load_full
+        self._full = None
+
+    @property
+    def dim(self):
+        return self.subset.dim
+
+    def _get_full(self):
+        if self._full is None:
+            print 'word not in embedding subset, loading full word vectors...'
+            self._full = self._load_full()
+        return self._full
+
+    def __getitem__(self, word):
+        row = self.subset.row(word)
+        if row >= 0:
+            return self.subset.vectors[row]
+        key = word.encode('utf-8') if isinstance(word, unicode) else word
+        if key in self.oov_words:
+            raise KeyError(word)
+        return self._get_full()[word]
+
+    def __contains__(self, word):
+        try:
+            self[word]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.subset)
+
+    def __iter__(self):
+        return iter(self.subset)
+
+
+class OOVVectors(object):
+    """
+    Vectors for out of vocabulary words. The vector of a word is drawn from a random state seeded by a stable
+    hash of the word, so a word always gets the same vector, in training and in prediction.
+    Recently used vectors are kept in a bounded LRU cache.
+    """
+
+    def __init__(self, dim=300, cache_size=100000, low=-0.5, high=0.5):
+        self.dim = dim
+        self.cache_size = cache_size
+        self.low = low
+        self.high = high
+        self._cache = collections.OrderedDict()
+
+    def _make_vector(self, word):
+        key = word.encode('utf-8') if isinstance(word, unicode) else word
+        seed = int(hashlib.md5(key).hexdigest()[:8], 16)
+        vector = np.random.RandomState(seed).uniform(low=self.low, high=self.high, size=self.dim).astype('float32')
+        vector.flags.writeable = False # shared by every occurrence of the word
+        return vector
+
+    def __getitem__(self, word):
+        try:
+            vector = self._cache.pop(word)
+        except KeyError:
+            vector = self._make_vector(word)
+            if len(self._cache) >= self.cache_size:
+                self._cache.popitem(last=False)
+        self._cache[word] = vector
+        return vector
+
+    def get_matrix(self, words):
+        """(len(words), dim) float32 matrix of the vectors of words"""
+        matrix = np.empty((len(words), self.dim), dtype='float32')
+        for i, word in enumerate(words):
+            matrix[i] = self[word]
+        return matrix
+
+
+def get_word_matrix(word_vectors, words, oov_vectors):
+    """
+    (len(words), dim) float32 matrix with the embedding of every word.
+    Words that are not in word_vectors get their vector from oov_vectors.
+    """
+    matrix = np.empty((len(words), oov_vectors.dim), dtype='float32')
+    if isinstance(word_vectors, (WordVectorStore, SubsetWordVectors)):
+        store = word_vectors if isinstance(word_vectors, WordVectorStore) else word_vectors.subset
+        # gather all known words from the store at once
+        rows = np.array([store.row(word) for word in words], dtype='int64')
+        known = rows >= 0
+        matrix[known] = store.vectors[rows[known]]
+        unknown = np.flatnonzero(~known)
+        if isinstance(word_vectors, SubsetWordVectors):
+            # words missing from the subset may be in the full embeddings
+            _fill_word_matrix(matrix, unknown, word_vectors, words, oov_vectors)
+        elif len(unknown):
+            matrix[unknown] = oov_vectors.get_matrix([words[i] for i in unknown])
+    else:
+        _fill_word_matrix(matrix, range(len(words)), word_vectors, words, oov_vectors)
+    return matrix
+
+
+def _fill_word_matrix(matrix, indexes, word_vectors, words, oov_vectors):
+    """look up the words at indexes one by one"""
+    for i in indexes:
+        try:
+            matrix[i] = word_vectors[words[i]]
+        except KeyError:
+            matrix[i] = oov_vectors[words[i]]
+
+
+def get_subset_path(newsreader_dir):
+    """location of the embedding subset for a directory of cached notes"""
+    return os.path.join(newsreader_dir, 'word_vectors.subset')
+
+
+def _note_cache_files(newsreader_dir):
+    """{file name: [size, mtime]} for every cached note in the directory, pickled or not"""
+    files = {}
+    for note_file in glob.glob(os.path.join(newsreader_dir, '*.pickle')) + glob.glob(os.path.join(newsreader_dir, '*' + NOTE_EXTENSION)):
+        stat = os.stat(note_file)
+        files[os.path.basename(note_file)] = [stat.st_size, int(stat.st_mtime)]
+    return files
+
+
+def get_note_vocabulary(note):
+    """all tokens of a note. These cover the words of every dependency path and context window"""
+    return set(tok['token'] for tok in note.id_to_tok.itervalues())
+
+
+def build_word_vector_subset(newsreader_dir, word_vectors=None, subset_dir=None, verbose=1):
+    """
+    Scan the cached notes in newsreader_dir and write a store holding only the vectors of their tokens.
+    The manifest of the subset records which note files it was built from, and the embeddings it was cut from.
+    """
+    if word_vectors is None:
+        word_vectors = load_word_vectors(verbose=verbose)
+    if subset_dir is None:
+        subset_dir = get_subset_path(newsreader_dir)
+    if not os.path.exists(subset_dir):
+        os.makedirs(subset_dir)
+
+    note_files = _note_cache_files(newsreader_dir)
+    vocabulary = set()
+    for i, note_file in enumerate(sorted(note_files)):
+        if verbose and i % 10 == 0:
+            print 'collecting vocabulary {}/{} {}'.format(i + 1, len(note_files), note_file)
+        vocabulary |= get_cached_vocabulary(os.path.join(newsreader_dir, note_file))
+
+    words = []
+    oov_words = []
+    for word in vocabulary:
+        key = word.encode('utf-8') if isinstance(word, unicode) else word
+        if word in word_vectors:
+            words.append(key)
+        else:
+            oov_words.append(key)
+
+    dim = len(word_vectors[words[0]]) if words else 300
+    vectors = np.zeros((len(words), dim), dtype='float32')
+    word_to_row = {}
+    for row, word in enumerate(words):
+        vectors[row] = word_vectors[word]
+        word_to_row[word] = row
+    np.save(os.path.join(subset_dir, STORE_VECTORS), vectors)
+    _write_store_index(subset_dir, word_to_row)
+
+    manifest = {'notes': note_files, 'oov_words': sorted(oov_words), 'source': get_word_vectors_source(word_vectors)}
+    json.dump(manifest, open(os.path.join(subset_dir, SUBSET_MANIFEST), 'w'))
+
+    if verbose:
+        print "wrote %d words (%d out of vocabulary) from %d notes to %s" % (len(words), len(oov_words), len(note_files), subset_dir)
+    return subset_dir
+
+
+def load_word_vector_subset(newsreader_dir, fname=None, verbose=0):
+    """
+    Load the embedding subset of newsreader_dir, if there is one, it was cut from the embeddings of fname,
+    and none of the notes it was built from changed since. Returns None otherwise.
+    Notes added after the subset was built are fine: their words are looked up in the full embeddings
+    when they are missing from the subset.
+    """
+    subset_dir = get_subset_path(newsreader_dir)
+    manifest_file = os.path.join(subset_dir, SUBSET_MANIFEST)
+    if not os.path.isfile(manifest_file):
+        return None
+
+    manifest = json.load(open(manifest_file))
+    source = get_embeddings_source(fname)
+    if manifest.get('source') is None or manifest['source'] != source:
+        print "embedding subset in %s was not cut from %s. rebuild it with build_word_vectors.py subset" % (
+            newsreader_dir, source['path'] if source is not None else fname)
+        return None
+
+    note_files = _note_cache_files(newsreader_dir)
+    # removed notes only leave unused words in the subset
+    if any(note_files[name] != stat for name, stat in manifest['notes'].iteritems() if name in note_files):
+        print "notes in %s changed since the embedding subset was built. rebuild it with build_word_vectors.py subset" % newsreader_dir
+        return None
+
+    if verbose:
+        print 'memory-mapping word vector subset from', subset_dir
+    oov_words = [word.encode('utf-8') for word in manifest['oov_words']]
+    return SubsetWordVectors(subset_dir, lambda: load_word_vectors(fname, verbose=verbose), oov_words=oov_words,
+                             source=manifest['source'])
+
+
+def load_word_vectors(fname=None, verbose=0, newsreader_dir=None):
+    """
+    Load word embeddings. The converted store is memory-mapped if one exists for the file,
+    otherwise the binary file is parsed with load_word2vec_binary().
+    fname may be a word2vec binary file or a store directory. Defaults to the GoogleNews vectors in TEA_PATH.
+    If newsreader_dir is given and has an up to date embedding subset, the subset is used instead.
+    """
+    if newsreader_dir is not None:
+        subset = load_word_vector_subset(newsreader_dir, fname=fname, verbose=verbose)
+        if subset is not None:
+            return subset
+
+    if fname is None:
+        fname = get_word2vec_path()
+
+    if os.path.isdir(fname):
+        store_dir = fname
+    else:
+        store_dir = get_store_path(fname)
+
+    if os.path.isfile(os.path.join(store_dir, STORE_VECTORS)):
+        if verbose:
+            print 'memory-mapping word vectors from', store_dir
+        return WordVectorStore(store_dir)
+
+    if verbose:
+        print 'no converted store found at %s, loading %s' % (store_dir, fname)
+    return load_word2vec_binary(fname, verbose=verbose)
+
+
 def load_word2vec_dep(fname):
     word_vecs = pickle.load(open(fname))
     return word_vecs
@@ -360,9 +360,9 @@ class EntNote(Note):
             output_path: directory to write the file to
         '''
         # TODO: create output directory if it does not exist
-        root = get_stripped_root(self.note_path)
+        root = get_stripped_root(self.timeml_document)
         length = len(offsets)
-        doc_time = get_doctime_timex(self.note_path).attrib["value"]
+        doc_time = get_doctime_timex(self.timeml_document).attrib["value"]
 
         # hack so events are detected in next for loop.
         for label in timexEventLabels:
@@ -3,6 +3,8 @@ import os
 import nltk.data
 
 from utilities.note_utils import valid_path
+from utilities.xml_utilities import XMLDocument
+from utilities.timeml_utilities import TimeMLDocument
 
 class Note(object):
 
@@ -22,12 +24,50 @@ class Note(object):
         if self.debug: print "Note class: calling destructor"
 
 
+    def __getstate__(self):
+
+        # parsed documents are not pickled, they are parsed again when needed
+        state = self.__dict__.copy()
+        state.pop('_timeml_document', None)
+        state.pop('_annotated_timeml_document', None)
+
+        return state
+
+
+    @property
+    def timeml_document(self):
+        """ the parsed note, see TimeMLDocument. The note is parsed once """
+
+        if getattr(self, '_timeml_document', None) is None:
+            self._timeml_document = TimeMLDocument(self.note_path)
+
+        return self._timeml_document
+
+
+    @property
+    def annotated_timeml_document(self):
+        """ the parsed annotated note, or None. Shared with timeml_document if both are the same document """
+
+        if self.annotated_note_path is None:
+            return None
+
+        if self.annotated_note_path is self.note_path or self.annotated_note_path == self.note_path:
+            return self.timeml_document
+
+        if getattr(self, '_annotated_timeml_document', None) is None:
+            self._annotated_timeml_document = TimeMLDocument(self.annotated_note_path)
+
+        return self._annotated_timeml_document
+
+
     def _set_note_path(self, n_path, annotated_n_path):
 
         if self.debug: print "Note class: setting note path"
 
-        valid_path(n_path)
-        if annotated_n_path is not None:
+        # documents held in memory have no path
+        if not isinstance(n_path, XMLDocument):
+            valid_path(n_path)
+        if annotated_n_path is not None and not isinstance(annotated_n_path, XMLDocument):
             valid_path(annotated_n_path)
         self.note_path = n_path
         self.annotated_note_path = annotated_n_path
@@ -3,6 +3,7 @@ import itertools
 import sys
 import re
 import copy
+import bisect
 import numpy as np
 
 from string import whitespace
@@ -30,7 +31,11 @@ from utilities.pre_processing import pre_processing
 
 class TimeNote(Note):
 
-    def __init__(self, timeml_note_path, annotated_timeml_path=None, verbose=False, denselabels=None):
+    def __init__(self, timeml_note_path, annotated_timeml_path=None, verbose=False, denselabels=None, pre_processed_note=None):
+        '''
+        pre_processed_note: a TimeNote of a document with the same text, e.g. the document before it was tagged.
+        Its NewsReader output is reused instead of running the pipeline again
+        '''
 
         if verbose: print "called TimeNote constructor"
 
@@ -40,10 +45,18 @@ class TimeNote(Note):
         # data = get_text(timeml_note_path)
 
         # original text body of timeml doc
-        self.original_text = get_text(timeml_note_path)
+        self.original_text = get_text(self.timeml_document)
 
-        # send body of document to NewsReader pipeline.
-        tokenized_text, token_to_offset, sentence_features, dependency_paths, id_to_tok = pre_processing.pre_process(self.original_text)
+        if pre_processed_note is None:
+            # send body of document to NewsReader pipeline.
+            tokenized_text, token_to_offset, sentence_features, dependency_paths, id_to_tok = pre_processing.pre_process(self.original_text)
+        else:
+            # char offsets of the tokens are offsets in the text
+            if pre_processed_note.original_text != self.original_text:
+                raise ValueError("the text of the document is not the text of the pre-processed note")
+            tokenized_text, token_to_offset, sentence_features, dependency_paths, id_to_tok = copy.deepcopy(
+                (pre_processed_note.pre_processed_text, pre_processed_note.token_to_offset,
+                 pre_processed_note.sentence_features, pre_processed_note.dependency_paths, pre_processed_note.id_to_tok))
 
         # {sentence_num: [{token},...], ...}
         self.pre_processed_text = tokenized_text
@@ -106,7 +119,7 @@ class TimeNote(Note):
 
     def get_tlinks(self):
         print "get tlinks from:", self.annotated_note_path
-        return get_tlinks(self.annotated_note_path)
+        return get_tlinks(self.annotated_timeml_document)
 
     def get_sentence_features(self):
         return self.sentence_features
@@ -281,8 +294,8 @@ class TimeNote(Note):
         if len(self.tlinks) > 0:
             return self.tlinks
         elif self.annotated_note_path is not None:
-            t_links = get_tlinks(self.annotated_note_path)
-            make_instances = get_make_instances(self.annotated_note_path)
+            t_links = get_tlinks(self.annotated_timeml_document)
+            make_instances = get_make_instances(self.annotated_timeml_document)
         else:
             print "no annotated timeml note to get tlinks from returning empty list..."
             self.tlinks = []
@@ -426,7 +439,7 @@ class TimeNote(Note):
 
         id_chunk_map, event_ids, timex_ids, sentence_chunks = self.get_id_chunk_map()
 
-        doctime = get_doctime_timex(self.note_path) # doc creation time
+        doctime = get_doctime_timex(self.timeml_document) # doc creation time
         doctime_id = doctime.attrib["tid"]
         self.doctime = doctime
 
@@ -472,6 +485,19 @@ class TimeNote(Note):
         return entity_pairs
 
     def get_id_chunk_map(self):
+        """
+        @return: id_chunk_map, event_ids, timex_ids, sentence_chunks of the labeled entities.
+                 Computed once, and again only when iob_labels are replaced (see get_labels() and set_iob_labels())
+        """
+        labels = self.get_labels()
+
+        cached = getattr(self, '_id_chunk_map_cache', None)
+        if cached is None or cached[0] is not labels:
+            self._id_chunk_map_cache = (labels, self._get_id_chunk_map())
+
+        return self._id_chunk_map_cache[1]
+
+    def _get_id_chunk_map(self):
 
         event_ids = set()
         timex_ids = set()
@@ -588,7 +614,7 @@ class TimeNote(Note):
 
         # TODO: need to add features for doctime. there aren't any.
         # add doc time. this is a timex.
-        doctime = get_doctime_timex(self.note_path)
+        doctime = get_doctime_timex(self.timeml_document)
         doctime_id = doctime.attrib["tid"]
         doctime_dict = {}
 
@@ -618,22 +644,45 @@ class TimeNote(Note):
         self.cross_sentence_pairs = []
         self.dct_pairs = []
         self.timex_pairs = []
-        for src_etid in self.id_to_wordIDs: # eventID/timexID -> words
-            for target_etid in self.id_to_wordIDs: # we allow both (e1, e2) and (e2, e1)
-                if src_etid == target_etid or src_etid == 't0':
-                    continue
-                if src_etid[0] == 't' and target_etid[0] == 't': # timex
-                    self.timex_pairs.append((src_etid, target_etid))
-                elif target_etid == 't0':    # (e, t0) pairs
-                    self.dct_pairs.append((src_etid, 't0'))
-                elif abs(self.id_to_sent[src_etid]-self.id_to_sent[target_etid]) == 1: # pairs of consec sentences
-                    self.cross_sentence_pairs.append((src_etid, target_etid))
-                elif self.id_to_sent[src_etid]-self.id_to_sent[target_etid] == 0:  # pairs in the same sentence
-                    self.intra_sentence_pairs.append((src_etid, target_etid))
-
-    def get_intra_sentence_subpaths(self):
+
+        # we allow both (e1, e2) and (e2, e1). Pairs are listed in the order of id_to_wordIDs, for sources and targets
+        etids = list(self.id_to_wordIDs) # eventID/timexID -> words
+        rank = dict((etid, i) for i, etid in enumerate(etids))
+        timex_ids = [etid for etid in etids if etid[0] == 't']
+
+        # entities other than t0 by sentence
+        sentence_entities = {}
+        for etid in etids:
+            if etid != 't0':
+                sentence_entities.setdefault(self.id_to_sent[etid], []).append(etid)
+
+        for src_etid in etids:
+            if src_etid == 't0':
+                continue
+
+            if src_etid[0] == 't': # timex
+                self.timex_pairs += [(src_etid, target_etid) for target_etid in timex_ids if target_etid != src_etid]
+            elif 't0' in rank:    # (e, t0) pairs
+                self.dct_pairs.append((src_etid, 't0'))
+
+            sentence_num = self.id_to_sent[src_etid]
+
+            # pairs of consec sentences
+            targets = sorted(sentence_entities.get(sentence_num - 1, []) + sentence_entities.get(sentence_num + 1, []),
+                             key=lambda etid: rank[etid])
+            self.cross_sentence_pairs += [(src_etid, target_etid) for target_etid in targets
+                                          if src_etid[0] != 't' or target_etid[0] != 't']
+
+            # pairs in the same sentence
+            self.intra_sentence_pairs += [(src_etid, target_etid) for target_etid in sentence_entities.get(sentence_num, [])
+                                          if target_etid != src_etid and (src_etid[0] != 't' or target_etid[0] != 't')]
+
+    def get_intra_sentence_subpaths(self, pairs=None):
+        # pairs: only get the paths of these pairs, from intra_sentence_pairs
+        if pairs is None:
+            pairs = self.intra_sentence_pairs
         id_pair_to_path = {}
-        for src_id, target_id in self.intra_sentence_pairs:
+        for src_id, target_id in pairs:
             src_wordID = self.id_to_wordIDs[src_id][0]
             target_wordID = self.id_to_wordIDs[target_id][0]
             # left path is always the target entity path
@@ -700,9 +749,12 @@ class TimeNote(Note):
             else:
                 word_id = parent
 
-    def get_cross_sentence_subpaths(self):
+    def get_cross_sentence_subpaths(self, pairs=None):
+        # pairs: only get the paths of these pairs, from cross_sentence_pairs
+        if pairs is None:
+            pairs = self.cross_sentence_pairs
         id_pair_to_path = {}
-        for src_id, target_id in self.cross_sentence_pairs:
+        for src_id, target_id in pairs:
             src_wordID = self.id_to_wordIDs[src_id][0]
             target_wordID = self.id_to_wordIDs[target_id][0]
 
@@ -760,9 +812,12 @@ class TimeNote(Note):
             id_pair_to_context[(src_id, target_id)] = (left_context, right_context)
         return id_pair_to_context
 
-    def get_t0_subpaths(self):
+    def get_t0_subpaths(self, pairs=None):
+        # pairs: only get the paths of these pairs, from dct_pairs
+        if pairs is None:
+            pairs = self.dct_pairs
         t0_path = {}
-        for item in self.dct_pairs:
+        for item in pairs:
             # get the first word from the sentence
             entity_id = item[0]
             sent_num = self.id_to_sent[entity_id]
@@ -851,17 +906,13 @@ class TimeNote(Note):
 
         if self.annotated_note_path is not None and self.iob_labels == []:
 
-            # don't want to modify original
-            pre_processed_text = copy.deepcopy(self.pre_processed_text)
-
             # need to create a list of tokens
             iob_labels = []
 
-            tagged_entities = get_tagged_entities(self.annotated_note_path)
-            _tagged_entities = copy.deepcopy(tagged_entities)
+            tagged_entities = get_tagged_entities(self.annotated_timeml_document)
 
-            raw_text = get_text(self.note_path)
-            labeled_text = get_text_with_taggings(self.annotated_note_path)
+            raw_text = get_text(self.timeml_document)
+            labeled_text = get_text_with_taggings(self.annotated_timeml_document)
 
             # lots of checks!
             for char in ['\n'] + list(whitespace):
@@ -877,83 +928,69 @@ class TimeNote(Note):
             labeled_text = re.sub("<TEXT>\n*", "", labeled_text)
             labeled_text = re.sub("\n*</TEXT>", "", labeled_text)
 
-            raw_index = 0
-            labeled_index = 0
+            # text between the tags of the labeled text, should be the raw text
+            text_pieces = []
 
-            raw_char_offset = 0
             labeled_char_offset = 0
 
             # should we count?
-            count_raw = True
             count_labeled = True
 
-            text1 = ""
-            text2 = ""
-
             start_count = 0
             end_count = 0
 
             offsets = {}
 
+            entity_index = 0
             tagged_element = None
 
             # need to get char based offset for each tagging within annotated timeml doc.
-            while raw_index < len(raw_text) or labeled_index < len(labeled_text):
-
-                if raw_index < len(raw_text):
-                    if count_raw is True:
-                        raw_char_offset += 1
-                        text1 += raw_text[raw_index]
-                    raw_index += 1
+            # only the '<' and '>' characters are visited, the text between them is counted at once.
+            labeled_index = 0
+            for match in re.finditer(r"[<>]", labeled_text):
 
-                if labeled_index < len(labeled_text):
+                position = match.start()
 
-                    # TODO: change this to be an re match.
-                    if labeled_text[labeled_index:labeled_index+1] == '<' and labeled_text[labeled_index:labeled_index+2] != '</':
+                if count_labeled is True:
+                    text_pieces.append(labeled_text[labeled_index:position])
+                    labeled_char_offset += position - labeled_index
 
-                        tagged_element = tagged_entities.pop(0)
+                if labeled_text[position] == '<':
 
-                        count_labeled = False
-                        start_count += 1
+                    if labeled_text[position:position+2] != '</':
+                        tagged_element = tagged_entities[entity_index]
+                        entity_index += 1
 
-                    elif labeled_text[labeled_index:labeled_index+2] == '</':
-                        count_labeled = False
-                        start_count += 1
+                    count_labeled = False
+                    start_count += 1
 
-                    if labeled_text[labeled_index:labeled_index+1] == ">":
+                else:
 
-                        if tagged_element != None:
+                    if tagged_element is not None:
 
-                            start = labeled_char_offset
-                            try:
-                                span = len(tagged_element.text)
-                            except TypeError: # sometimes tagged_element.text is None
-                                span = 0
-                            end = labeled_char_offset + span - 1
+                        start = labeled_char_offset
+                        try:
+                            span = len(tagged_element.text)
+                        except TypeError: # sometimes tagged_element.text is None
+                            span = 0
+                        end = labeled_char_offset + span - 1
 
-                            # spans should be unique?
-                            offsets[(start, end)] = {"tagged_xml_element":tagged_element, "text":tagged_element.text}
+                        # spans should be unique?
+                        offsets[(start, end)] = {"tagged_xml_element":tagged_element, "text":tagged_element.text}
 
-                            # ensure the text at the offset is correct
-                            # try:
-                            #     assert raw_text[start:end + 1] == tagged_element.text, "\'{}\' != \'{}\'".format( raw_text[start:end + 1], tagged_element.text)
-                            # except AssertionError:
-                            #     print raw_text[start:end + 1]
-                            #     print tagged_element.text
-                            #     sys.exit("AssertionError")
-                            tagged_element = None
+                        tagged_element = None
 
-                        end_count += 1
-                        count_labeled = True
+                    end_count += 1
+                    count_labeled = True
 
-                        labeled_index += 1
-                        continue
+                labeled_index = position + 1
 
-                    if count_labeled is True:
-                        labeled_char_offset += 1
-                        text2 += labeled_text[labeled_index]
+            if count_labeled is True:
+                text_pieces.append(labeled_text[labeled_index:])
+                labeled_char_offset += len(labeled_text) - labeled_index
 
-                    labeled_index += 1
+            text1 = raw_text
+            text2 = ''.join(text_pieces)
 
             try:
                 assert text1 == text2, "{} != {}".format(text1, text2)
@@ -971,16 +1008,17 @@ class TimeNote(Note):
                 sys.exit()
 
             assert start_count == end_count, "{} != {}".format(start_count, end_count)
-            assert raw_index == len(raw_text) and labeled_index == len(labeled_text)
-            assert raw_char_offset == labeled_char_offset
-            assert len(tagged_entities) == 0
+            assert len(raw_text) == labeled_char_offset
+            assert entity_index == len(tagged_entities)
             assert tagged_element is None
-            assert len(offsets) == len(_tagged_entities)
+            assert len(offsets) == len(tagged_entities)
+
+            span_index = TimeNote.get_span_index(offsets)
 
-            for sentence_num in sorted(pre_processed_text.keys()):
+            for sentence_num in sorted(self.pre_processed_text.keys()):
 
                 # list of dicts
-                sentence = pre_processed_text[sentence_num]
+                sentence = self.pre_processed_text[sentence_num]
 
                 # iobs in a sentence
                 iobs_sentence = []
@@ -990,7 +1028,7 @@ class TimeNote(Note):
 
 
                     # set proper iob label to token
-                    iob_label, entity_type, entity_id, entity_value = TimeNote.get_label(token, offsets)
+                    iob_label, entity_type, entity_id, entity_value = TimeNote.find_label(token, span_index)
 
                     if iob_label is not 'O':
                         assert entity_id is not None
@@ -1119,9 +1157,9 @@ class TimeNote(Note):
         '''
 
         # TODO: create output directory if it does not exist
-        root = get_stripped_root(self.note_path)
+        root = get_stripped_root(self.timeml_document)
         length = len(offsets)
-        doc_time = get_doctime_timex(self.note_path).attrib["value"]
+        doc_time = get_doctime_timex(self.timeml_document).attrib["value"]
 
         # hack so events are detected in next for loop.
         for label in timexEventLabels:
@@ -1246,58 +1284,89 @@ class TimeNote(Note):
         # NOTE: never call this directly. input is tested within _read
         tok_span = (token["char_start_offset"], token["char_end_offset"])
 
-        label = 'O'
-        entity_id = None
-        entity_type = None
-        entity_value = None
-
         for span in offsets:
 
             if offsets[span]["tagged_xml_element"].tag not in ["EVENT", "TIMEX3"]:
                 continue
 
             if TimeNote.same_start_offset(span, tok_span):
+                return TimeNote.get_entity_label(offsets[span]["tagged_xml_element"], 'B_')
 
-                labeled_entity = offsets[span]["tagged_xml_element"]
+            elif TimeNote.subsumes(span, tok_span):
+                return TimeNote.get_entity_label(offsets[span]["tagged_xml_element"], 'I_')
 
-                if 'class' in labeled_entity.attrib:
-                    label = 'B_' + labeled_entity.attrib["class"]  # e.g. B_OCCURRENCE
-                elif 'type' in labeled_entity.attrib:
-                    label = 'B_' + labeled_entity.attrib["type"]   # e.g. B_DATE
+        return 'O', None, None, None
 
-                if 'eid' in labeled_entity.attrib:
-                    entity_id = labeled_entity.attrib["eid"]
-                else:
-                    entity_id = labeled_entity.attrib["tid"]
+    @staticmethod
+    def get_span_index(offsets):
+        """
+        sorted index of the EVENT and TIMEX3 spans of offsets, as used by find_label().
+        Spans are also ranked in the order get_label() visits them, so both find the same span
+        """
+        spans = []
+        for rank, span in enumerate(offsets):
+            if offsets[span]["tagged_xml_element"].tag in ["EVENT", "TIMEX3"]:
+                spans.append((span[0], rank, span[1], offsets[span]["tagged_xml_element"]))
+        spans.sort(key=lambda x: (x[0], x[1]))
 
-                if 'value' in labeled_entity.attrib:
-                    entity_value = labeled_entity.attrib["value"]
+        return [span[0] for span in spans], spans
 
-                # TODO: There are other attributes, which may be useful in the future
+    @staticmethod
+    def find_label(token, span_index):
+        """
+        same as get_label(), with a bisect on the start offsets of the spans instead of a scan of all spans.
+        Tagged entities do not overlap, so only the spans with the same start offset as the token,
+        or with the last start offset before it, can match
+        """
+        starts, spans = span_index
+        tok_span = (token["char_start_offset"], token["char_end_offset"])
 
-                entity_type = labeled_entity.tag # EVENT or TIMEX3
+        found = None
 
-                break
+        i = bisect.bisect_left(starts, tok_span[0])
+        j = i
+        while j < len(spans) and starts[j] == tok_span[0]:
+            if found is None or spans[j][1] < found[0][1]:
+                found = (spans[j], 'B_')
+            j += 1
 
-            elif TimeNote.subsumes(span, tok_span):
+        if i > 0:
+            j = i - 1
+            while j >= 0 and starts[j] == starts[i - 1]:
+                if TimeNote.subsumes((spans[j][0], spans[j][2]), tok_span):
+                    if found is None or spans[j][1] < found[0][1]:
+                        found = (spans[j], 'I_')
+                j -= 1
 
-                labeled_entity = offsets[span]["tagged_xml_element"]
+        if found is None:
+            return 'O', None, None, None
 
-                if 'class' in labeled_entity.attrib:
-                    label = 'I_' + labeled_entity.attrib["class"]
-                else:
-                    label = 'I_' + labeled_entity.attrib["type"]
+        return TimeNote.get_entity_label(found[0][3], found[1])
 
-                if 'eid' in labeled_entity.attrib:
-                    entity_id = labeled_entity.attrib["eid"]
-                else:
-                    entity_id = labeled_entity.attrib["tid"]
-                if 'value' in labeled_entity.attrib:
-                    entity_value = labeled_entity.attrib["value"]
+    @staticmethod
+    def get_entity_label(labeled_entity, prefix):
+        """
+        label, entity type, id and value of a token in a tagged entity. prefix is 'B_' for its first token, 'I_' otherwise
+        """
+        label = 'O'
+        entity_value = None
 
-                entity_type = labeled_entity.tag
+        if 'class' in labeled_entity.attrib:
+            label = prefix + labeled_entity.attrib["class"]  # e.g. B_OCCURRENCE
+        elif 'type' in labeled_entity.attrib or prefix == 'I_':
+            label = prefix + labeled_entity.attrib["type"]   # e.g. B_DATE
 
-                break
+        if 'eid' in labeled_entity.attrib:
+            entity_id = labeled_entity.attrib["eid"]
+        else:
+            entity_id = labeled_entity.attrib["tid"]
+
+        if 'value' in labeled_entity.attrib:
+            entity_value = labeled_entity.attrib["value"]
+
+        # TODO: There are other attributes, which may be useful in the future
+
+        entity_type = labeled_entity.tag # EVENT or TIMEX3
 
         if entity_type == "EVENT":
             # don't need iob tagging just what the type is.
@@ -0,0 +1,574 @@
+'''
+Cache of the notes of TimeML documents, in the newsreader_annotations directory, and its on-disk format.
+
+Notes are cached by NoteCache, under a hash of the contents of their documents and of PIPELINE_VERSION, so
+edited documents get new notes. Entries are written to a temporary file and renamed, and only one process
+builds a missing entry, so that processes can share a cache directory.
+
+A note is written as a compressed .npz file of typed arrays:
+
+    header            json: format version, note class, the kind of every column, and for entries of NoteCache,
+                      the pipeline version and whether the note was built with annotations
+    strings.*         string table. Every string in the arrays below is an index into it, -1 for None
+    sentences.*       sentence numbers of pre_processed_text, and their lengths
+    tokens.*          one column per token attribute (token, id, pos, lemma, char offsets, ...), in
+                      the order of pre_processed_text. Attributes missing from some tokens have a mask.
+                      Values that fit no array (e.g. nested lists) are pickled in tokens.values
+    labels.*          columns of iob_labels, one row per token, the same way
+    tlinks.*          ids, relation types and TLINK ids of the tlinks
+    deps.*, tree.*    dependency relations and parents of dependency_paths
+    state             the rest of the note, pickled. Tokens and labels are referenced by their rows
+
+Members of the file are read when they are first needed, so e.g. the vocabulary of a note is read
+without loading the rest of it. Notes cached by earlier versions (.parsed.pickle and .parsed.note.npz files)
+are not used, see migrate_note_cache.py to convert them.
+'''
+
+import os
+import re
+import glob
+import json
+import fcntl
+import hashlib
+import tempfile
+import cPickle
+import importlib
+from contextlib import contextmanager
+from cStringIO import StringIO
+
+import numpy as np
+
+NOTE_CACHE_VERSION = 1
+NOTE_EXTENSION = '.note.npz'
+LEGACY_EXTENSION = '.pickle'
+
+# increase when the NewsReader pre-processing or TimeNote change the notes they build, so that cached notes are rebuilt
+PIPELINE_VERSION = 1
+
+LOCK_DIR = '.locks'
+
+_MISSING = object()
+
+
+def get_document_name(tml):
+    '''name of a document, without directory and .tml extension'''
+    name = os.path.basename(tml)
+    if '.tml' in name:
+        name = name[0:name.index('.tml')]
+    return name
+
+
+def is_legacy_note_file(fname):
+    '''notes cached under the name of their document only, by earlier versions'''
+    return ((fname.endswith(LEGACY_EXTENSION) and '.parsed' in os.path.basename(fname)) or
+            fname.endswith('.parsed' + NOTE_EXTENSION) or fname.endswith('.parsed.predict' + NOTE_EXTENSION))
+
+
+class NoteCache(object):
+    '''
+    TimeNotes of TimeML documents, cached in a directory. Entries are named after the document, and keyed by
+    a hash of the documents the note was built from and of PIPELINE_VERSION
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_key(self, tml, annotated_tml=None):
+        '''hash identifying the note TimeNote(tml, annotated_tml) in the cache'''
+        md5 = hashlib.md5(json.dumps({'pipeline': PIPELINE_VERSION, 'format': NOTE_CACHE_VERSION,
+                                      'annotated': annotated_tml is not None, 'same': annotated_tml == tml}))
+        md5.update(open(tml, 'rb').read())
+        if annotated_tml is not None and annotated_tml != tml:
+            md5.update(open(annotated_tml, 'rb').read())
+        return md5.hexdigest()[:16]
+
+    def get_note_path(self, tml, annotated_tml=None):
+        '''path of the entry of TimeNote(tml, annotated_tml), whether it exists or not'''
+        return os.path.join(self.cache_dir, '{}.{}{}'.format(get_document_name(tml), self.get_key(tml, annotated_tml),
+                                                               NOTE_EXTENSION))
+
+    def find_note(self, name, annotated=True, exclude=()):
+        '''
+        path of the most recent entry of the document name, built with or without annotations by the current
+        PIPELINE_VERSION, whatever the contents of the document. Entries in exclude are skipped. None if there is none
+        '''
+        source = _get_source(annotated)
+        entry_pattern = re.compile(re.escape(name) + r'\.[0-9a-f]{16}' + re.escape(NOTE_EXTENSION) + '$')
+        exclude = set([os.path.abspath(note_path) for note_path in exclude])
+
+        found = []
+        for note_path in glob.glob(os.path.join(self.cache_dir, name + '.*' + NOTE_EXTENSION)):
+            if not entry_pattern.match(os.path.basename(note_path)) or os.path.abspath(note_path) in exclude:
+                continue
+            try:
+                cache_file = NoteCacheFile(note_path)
+            except ValueError:
+                # other format version
+                continue
+            try:
+                if cache_file.header.get('source') == source:
+                    found.append((os.path.getmtime(note_path), note_path))
+            finally:
+                cache_file.close()
+
+        if not found:
+            return None
+        return max(found)[1]
+
+    def get_note(self, tml, annotated_tml=None, save=True):
+        '''
+        get TimeNote(tml, annotated_tml) from the cache. If it is missing, it is created, and cached if save is True
+        '''
+        note_path = self.get_note_path(tml, annotated_tml)
+        if os.path.isfile(note_path):
+            return load_note(note_path)
+
+        if not save:
+            return self._create_note(tml, annotated_tml)
+
+        with self._lock(note_path):
+            # another process may have cached it while this one waited
+            if os.path.isfile(note_path):
+                return load_note(note_path)
+
+            note = self._create_note(tml, annotated_tml)
+            save_note(note, note_path, source=_get_source(annotated_tml is not None))
+
+        return note
+
+    def get_note_file(self, tml, annotated_tml=None):
+        '''
+        get the path of the entry of TimeNote(tml, annotated_tml). If it is missing, the note is created and cached,
+        but not kept in memory
+        '''
+        note_path = self.get_note_path(tml, annotated_tml)
+        if not os.path.isfile(note_path):
+            with self._lock(note_path):
+                if not os.path.isfile(note_path):
+                    save_note(self._create_note(tml, annotated_tml), note_path,
+                              source=_get_source(annotated_tml is not None))
+
+        return note_path
+
+    def add_note(self, note, tml, annotated_tml=None):
+        '''cache a note built from tml and annotated_tml, unless it is already. Returns the path of its entry'''
+        note_path = self.get_note_path(tml, annotated_tml)
+        with self._lock(note_path):
+            if not os.path.isfile(note_path):
+                save_note(note, note_path, source=_get_source(annotated_tml is not None))
+
+        return note_path
+
+    @staticmethod
+    def _create_note(tml, annotated_tml):
+        # the NewsReader pipeline is only loaded when a note has to be built
+        from TimeNote import TimeNote
+        print "creating note of", tml
+        return TimeNote(tml, annotated_tml)
+
+    @contextmanager
+    def _lock(self, note_path):
+        '''
+        hold an exclusive lock on an entry. Lock files are kept, removing them would let two processes lock
+        different files of the same entry
+        '''
+        lock_dir = os.path.join(self.cache_dir, LOCK_DIR)
+        if not os.path.isdir(lock_dir):
+            try:
+                os.makedirs(lock_dir)
+            except OSError:
+                # created by another process
+                if not os.path.isdir(lock_dir):
+                    raise
+
+        lock_file = open(os.path.join(lock_dir, os.path.basename(note_path) + '.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+
+def load_note(note_path):
+    '''load a cached note, written by save_note() or pickled'''
+    if note_path.endswith(LEGACY_EXTENSION):
+        return cPickle.load(open(note_path, 'rb'))
+
+    cache_file = NoteCacheFile(note_path)
+    try:
+        return cache_file.load_note()
+    finally:
+        cache_file.close()
+
+
+def _get_source(annotated):
+    '''how the notes of NoteCache entries were built, see NoteCache.find_note()'''
+    return {'pipeline': PIPELINE_VERSION, 'annotated': annotated}
+
+
+def save_note(note, note_path, source=None):
+    '''
+    write a note in the cache format. It is written to a temporary file first, and renamed,
+    so that note_path is always a complete note
+    '''
+    arrays = _NoteWriter(note, source=source).get_arrays()
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(note_path)),
+                                    prefix=os.path.basename(note_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        # mkstemp only lets the owner read the file
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, note_path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def get_cached_vocabulary(note_path):
+    '''all tokens of a cached note, without loading the note'''
+    if note_path.endswith(LEGACY_EXTENSION):
+        note = load_note(note_path)
+        return set(tok['token'] for tok in note.id_to_tok.itervalues())
+
+    cache_file = NoteCacheFile(note_path)
+    try:
+        return set(cache_file.get_token_column('token'))
+    finally:
+        cache_file.close()
+
+
+def _get_class(module_name, class_name):
+    return getattr(importlib.import_module(str(module_name)), str(class_name))
+
+
+class _StringTable(object):
+
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def add(self, string):
+        if string is None:
+            return -1
+        # str and unicode strings are told apart
+        key = (type(string), string)
+        if key not in self.index:
+            self.index[key] = len(self.strings)
+            self.strings.append(string)
+        return self.index[key]
+
+    def get_arrays(self):
+        data = [s.encode('utf-8') if isinstance(s, unicode) else s for s in self.strings]
+        offsets = np.zeros(len(data) + 1, dtype='int64')
+        offsets[1:] = np.cumsum([len(s) for s in data])
+        return {'strings.data': np.frombuffer(''.join(data), dtype='uint8'),
+                'strings.offsets': offsets,
+                'strings.unicode': np.array([isinstance(s, unicode) for s in self.strings], dtype='int8')}
+
+
+def _read_strings(data, offsets, is_unicode):
+    data = data.tostring()
+    strings = []
+    for start, end, u in zip(offsets[:-1], offsets[1:], is_unicode):
+        s = data[start:end]
+        strings.append(s.decode('utf-8') if u else s)
+    return strings
+
+
+def _get_column_kind(values):
+    '''kind of the array a column is stored in, or None if it can only be pickled'''
+    present = [v for v in values if v is not _MISSING]
+    if all([type(v) is bool for v in present]):
+        return 'bool'
+    if all([type(v) in (int, long) for v in present]):
+        return 'int'
+    if all([type(v) is float for v in present]):
+        return 'float'
+    if all([v is None or isinstance(v, basestring) for v in present]):
+        return 'str'
+    if all([type(v) is list and all([isinstance(x, basestring) for x in v]) for v in present]):
+        return 'str_list'
+    return None
+
+
+class _NoteWriter(object):
+
+    def __init__(self, note, source=None):
+        self.note = note
+        self.strings = _StringTable()
+        self.arrays = {}
+        self.header = {'version': NOTE_CACHE_VERSION,
+                       'class': [note.__class__.__module__, note.__class__.__name__],
+                       'tokens': {}, 'labels': {}, 'tlinks': False, 'dependency_paths': None,
+                       'source': source}
+
+        # rows of the objects referenced from the pickled state, by id()
+        self.persistent_rows = {}
+
+    def get_arrays(self):
+        state = self.note.__getstate__() if hasattr(self.note, '__getstate__') else self.note.__dict__.copy()
+        # recomputed when needed
+        state.pop('_id_chunk_map_cache', None)
+
+        tokens = self._write_tokens(state)
+        self._write_labels(state, tokens)
+        self._write_tlinks(state)
+        self._write_dependency_paths(state)
+
+        out = StringIO()
+        pickler = cPickle.Pickler(out, cPickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = lambda obj: self.persistent_rows.get(id(obj))
+        pickler.dump(state)
+        self.arrays['state'] = np.frombuffer(out.getvalue(), dtype='uint8')
+
+        self.arrays.update(self.strings.get_arrays())
+        self.arrays['header'] = np.frombuffer(json.dumps(self.header), dtype='uint8')
+
+        return self.arrays
+
+    def _write_columns(self, prefix, rows, kinds):
+        '''write the dicts in rows as one column per key. Values that fit no array are pickled, by key and row'''
+        keys = []
+        for row in rows:
+            for key in row:
+                if key not in keys:
+                    keys.append(key)
+
+        pickled = {}
+        for key in keys:
+            values = [row.get(key, _MISSING) for row in rows]
+            kind = _get_column_kind(values)
+            mask = np.array([v is not _MISSING for v in values], dtype='int8')
+
+            if kind is None:
+                pickled[key] = dict((i, v) for i, v in enumerate(values) if v is not _MISSING)
+                continue
+
+            name = '%s.%s' % (prefix, key)
+            if kind == 'str_list':
+                lengths = [len(v) if v is not _MISSING else 0 for v in values]
+                self.arrays[name + '.offsets'] = np.concatenate([[0], np.cumsum(lengths)]).astype('int64')
+                self.arrays[name] = np.array([self.strings.add(x) for v in values if v is not _MISSING for x in v],
+                                             dtype='int32')
+            else:
+                default = None if kind == 'str' else 0
+                values = [default if v is _MISSING else v for v in values]
+                if kind == 'str':
+                    self.arrays[name] = np.array([self.strings.add(v) for v in values], dtype='int32')
+                else:
+                    self.arrays[name] = np.array(values, dtype={'bool': 'int8', 'int': 'int64', 'float': 'float64'}[kind])
+
+            if not mask.all():
+                self.arrays[name + '.mask'] = mask
+            kinds[key] = kind
+
+        self.arrays[prefix + '.values'] = np.frombuffer(cPickle.dumps(pickled, cPickle.HIGHEST_PROTOCOL), dtype='uint8')
+
+    def _write_tokens(self, state):
+        pre_processed_text = state.pop('pre_processed_text')
+        sentence_nums = sorted(pre_processed_text)
+        tokens = [token for sentence_num in sentence_nums for token in pre_processed_text[sentence_num]]
+
+        self.arrays['sentences.keys'] = np.array(sentence_nums, dtype='int64')
+        self.arrays['sentences.lengths'] = np.array([len(pre_processed_text[num]) for num in sentence_nums], dtype='int64')
+
+        self._write_columns('tokens', tokens, self.header['tokens'])
+        for row, token in enumerate(tokens):
+            self.persistent_rows[id(token)] = ('token', row)
+
+        return tokens
+
+    def _write_labels(self, state, tokens):
+        iob_labels = state['iob_labels']
+        lengths = self.arrays['sentences.lengths']
+        if len(iob_labels) == 0 or [len(sentence) for sentence in iob_labels] != list(lengths):
+            return
+
+        labels = [label for sentence in iob_labels for label in sentence]
+        if not all([type(label) is dict for label in labels]):
+            return
+
+        state.pop('iob_labels')
+        self._write_columns('labels', labels, self.header['labels'])
+        for row, label in enumerate(labels):
+            self.persistent_rows[id(label)] = ('label', row)
+
+    def _write_tlinks(self, state):
+        tlinks = state.get('tlinks')
+        if not tlinks:
+            return
+
+        # entities of the same id are the same list, as in get_id_chunk_map()
+        entities = {}
+        for tlink in tlinks:
+            if type(tlink) is not dict or sorted(tlink) != ['rel_type', 'src_entity', 'src_id', 'target_entity',
+                                                             'target_id', 'tlink_id']:
+                return
+            for id_key, entity_key in (('src_id', 'src_entity'), ('target_id', 'target_entity')):
+                if not isinstance(tlink[id_key], basestring) or entities.setdefault(tlink[id_key], tlink[entity_key]) is not tlink[entity_key]:
+                    return
+            if not isinstance(tlink['rel_type'], basestring) or not (tlink['tlink_id'] is None or isinstance(tlink['tlink_id'], basestring)):
+                return
+
+        state.pop('tlinks')
+        state['_cache_tlink_entities'] = entities
+        for key in ('src_id', 'target_id', 'rel_type', 'tlink_id'):
+            self.arrays['tlinks.' + key] = np.array([self.strings.add(tlink[key]) for tlink in tlinks], dtype='int32')
+        self.header['tlinks'] = True
+
+    def _write_dependency_paths(self, state):
+        dependency_paths = state.get('dependency_paths')
+        if dependency_paths is None or not hasattr(dependency_paths, 'deps') or not hasattr(dependency_paths, 'tree'):
+            return
+        if not set(dependency_paths.__dict__) <= set(['deps', 'tree', 'seen']):
+            return
+
+        triples = [(_from, _to, rfunc) for _from in dependency_paths.deps
+                   for _to, rfunc in dependency_paths.deps[_from].iteritems()]
+        nodes = list(dependency_paths.tree)
+        if not all([isinstance(x, basestring) for triple in triples for x in triple] + [isinstance(node, basestring) for node in nodes]):
+            return
+
+        state.pop('dependency_paths')
+        for i, key in enumerate(('from', 'to', 'rfunc')):
+            self.arrays['deps.' + key] = np.array([self.strings.add(triple[i]) for triple in triples], dtype='int32')
+        self.arrays['tree.node'] = np.array([self.strings.add(node) for node in nodes], dtype='int32')
+        self.arrays['tree.parent'] = np.array([self.strings.add(dependency_paths.tree[node].parent) for node in nodes], dtype='int32')
+
+        tree_node = dependency_paths.tree[nodes[0]] if nodes else None
+        self.header['dependency_paths'] = {
+            'class': [dependency_paths.__class__.__module__, dependency_paths.__class__.__name__],
+            'node_class': [tree_node.__class__.__module__, tree_node.__class__.__name__] if tree_node is not None else None}
+
+
+class NoteCacheFile(object):
+    '''
+    a note written by save_note(). Its members are read when they are first needed
+    '''
+
+    def __init__(self, note_path):
+        self.note_path = note_path
+        self.data = np.load(note_path)
+        self.header = json.loads(self.data['header'].tostring())
+        if self.header['version'] != NOTE_CACHE_VERSION:
+            raise ValueError("{} was written in version {} of the note cache format, not {}. See migrate_note_cache.py".format(
+                             note_path, self.header['version'], NOTE_CACHE_VERSION))
+        self._strings = None
+
+    def close(self):
+        self.data.close()
+
+    @property
+    def strings(self):
+        if self._strings is None:
+            self._strings = _read_strings(self.data['strings.data'], self.data['strings.offsets'], self.data['strings.unicode'])
+        return self._strings
+
+    def get_string_column(self, name):
+        strings = self.strings
+        return [strings[i] if i >= 0 else None for i in self.data[name]]
+
+    def get_token_column(self, key):
+        '''values of a token attribute, for every token. None if a token does not have it'''
+        return self._get_column('tokens', key, self.header['tokens'][key])
+
+    def _get_column(self, prefix, key, kind):
+        name = '%s.%s' % (prefix, key)
+        if kind == 'str':
+            values = self.get_string_column(name)
+        elif kind == 'str_list':
+            offsets = self.data[name + '.offsets']
+            flat = self.get_string_column(name)
+            values = [flat[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        elif kind == 'bool':
+            values = [bool(v) for v in self.data[name]]
+        else:
+            values = self.data[name].tolist()
+
+        if name + '.mask' in self.data.files:
+            values = [v if present else None for v, present in zip(values, self.data[name + '.mask'])]
+        return values
+
+    def _get_rows(self, prefix, kinds, n_rows):
+        '''the dicts written by _NoteWriter._write_columns()'''
+        rows = [{} for _ in range(n_rows)]
+        for key, kind in kinds.iteritems():
+            values = self._get_column(prefix, key, kind)
+            if '%s.%s.mask' % (prefix, key) in self.data.files:
+                for row, value, present in zip(rows, values, self.data['%s.%s.mask' % (prefix, key)]):
+                    if present:
+                        row[key] = value
+            else:
+                for row, value in zip(rows, values):
+                    row[key] = value
+
+        pickled = cPickle.loads(self.data[prefix + '.values'].tostring())
+        for key, values in pickled.iteritems():
+            for i, value in values.iteritems():
+                rows[i][key] = value
+        return rows
+
+    def load_note(self):
+        '''the note, as it was when it was saved'''
+        lengths = self.data['sentences.lengths']
+        n_tokens = int(np.sum(lengths))
+        ends = np.cumsum(lengths)
+
+        # the pickled state refers to tokens and labels by their rows, so they are read first
+        rows = {'token': self._get_rows('tokens', self.header['tokens'], n_tokens), 'label': None}
+        if self.header['labels']:
+            rows['label'] = self._get_rows('labels', self.header['labels'], n_tokens)
+        tokens = rows['token']
+
+        unpickler = cPickle.Unpickler(StringIO(self.data['state'].tostring()))
+        unpickler.persistent_load = lambda pid: rows[pid[0]][pid[1]]
+        state = unpickler.load()
+
+        sentence_nums = self.data['sentences.keys'].tolist()
+        state['pre_processed_text'] = dict((num, tokens[end - length:end])
+                                           for num, length, end in zip(sentence_nums, lengths, ends))
+
+        if self.header['labels']:
+            labels = rows['label']
+            state['iob_labels'] = [labels[end - length:end] for length, end in zip(lengths, ends)]
+
+        if self.header['tlinks']:
+            entities = state.pop('_cache_tlink_entities')
+            columns = dict((key, self.get_string_column('tlinks.' + key)) for key in ('src_id', 'target_id', 'rel_type', 'tlink_id'))
+            state['tlinks'] = [{"src_entity": entities[src_id], "src_id": src_id, "target_id": target_id,
+                                "target_entity": entities[target_id], "rel_type": rel_type, "tlink_id": tlink_id}
+                               for src_id, target_id, rel_type, tlink_id in zip(columns['src_id'], columns['target_id'],
+                                                                               columns['rel_type'], columns['tlink_id'])]
+
+        if self.header['dependency_paths'] is not None:
+            state['dependency_paths'] = self._load_dependency_paths()
+
+        note_class = _get_class(*self.header['class'])
+        note = note_class.__new__(note_class)
+        note.__dict__.update(state)
+        return note
+
+    def _load_dependency_paths(self):
+        header = self.header['dependency_paths']
+        path_class = _get_class(*header['class'])
+        dependency_paths = path_class.__new__(path_class)
+
+        deps = {}
+        for _from, _to, rfunc in zip(*[self.get_string_column('deps.' + key) for key in ('from', 'to', 'rfunc')]):
+            deps.setdefault(_from, {})[_to] = rfunc
+
+        tree = {}
+        nodes = self.get_string_column('tree.node')
+        if nodes:
+            node_class = _get_class(*header['node_class'])
+            for node, parent in zip(nodes, self.get_string_column('tree.parent')):
+                tree[node] = node_class(parent=parent, children=[])
+            for _from in deps:
+                tree[_from].children += list(deps[_from])
+
+        dependency_paths.deps = deps
+        dependency_paths.tree = tree
+        return dependency_paths
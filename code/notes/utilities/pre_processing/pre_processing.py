@@ -10,6 +10,14 @@ from news_reader import NewsReader
 
 pre_processor = None
 
+def start():
+    """ start the NewsReader pipeline now, instead of when the first document is pre-processed """
+
+    global pre_processor
+
+    if pre_processor is None:
+        pre_processor = NewsReader()
+
 def pre_process(text):
     """ pre-process contents of a document
 
@@ -18,10 +26,7 @@ def pre_process(text):
         pre_process(text)
     """
 
-    global pre_processor
-
-    if pre_processor is None:
-        pre_processor = NewsReader()
+    start()
 
     naf_tagged_doc = pre_processor.pre_process(text) # output a string of xml doc
 
@@ -1,4 +1,5 @@
 
+import copy
 import xml.etree.ElementTree as ET
 from note_utils import valid_path
 
@@ -10,8 +11,66 @@ import re
 
 import glob
 
+class TimeMLDocument(object):
+    """
+    a timeml document, parsed once. Can be passed instead of a path or an XMLDocument to the functions below,
+    which then read the parsed tree instead of parsing the document again
+    """
+
+    def __init__(self, timeml_doc):
+
+        self.name = str(timeml_doc)
+        self.root = xml_utilities.get_root(timeml_doc)
+
+        self.text_element = get_text_element_from_root(self.root)
+        self.tagged_entities = list(self.text_element) if self.text_element is not None else []
+
+        self.make_instances = []
+        self.tlinks = []
+        self.doctime = None
+
+        for e in self.root:
+            if e.tag == "MAKEINSTANCE":
+                self.make_instances.append(e)
+            elif e.tag == "TLINK":
+                self.tlinks.append(e)
+            elif e.tag == "DCT" and self.doctime is None:
+                self.doctime = e[0]
+
+        # {preserve_quotes: text}
+        self._text = {}
+        self._text_with_taggings = {}
+
+    def __str__(self):
+        return self.name
+
+    def get_text(self, preserve_quotes=False):
+
+        if preserve_quotes not in self._text:
+            self._text[preserve_quotes] = _element_to_text(self.text_element, preserve_quotes)
+
+        return self._text[preserve_quotes]
+
+    def get_text_with_taggings(self, preserve_quotes=False):
+
+        if preserve_quotes not in self._text_with_taggings:
+            self._text_with_taggings[preserve_quotes] = _element_to_tagged_text(self.text_element, preserve_quotes)
+
+        return self._text_with_taggings[preserve_quotes]
+
+def get_timeml_document(timeml_doc):
+    """ get the parsed timeml document of a path or an XMLDocument """
+
+    if isinstance(timeml_doc, TimeMLDocument):
+        return timeml_doc
+
+    return TimeMLDocument(timeml_doc)
+
 def get_text_element(timeml_doc):
 
+    if isinstance(timeml_doc, TimeMLDocument):
+        return timeml_doc.text_element
+
     root = xml_utilities.get_root(timeml_doc)
 
     text_element = None
@@ -96,7 +155,12 @@ def annotate_root(timeml_root, tag, attributes = {}, msg="don't know where from!
 
 def get_text_with_taggings(timeml_doc, preserve_quotes=False):
 
-    text_e = get_text_element(timeml_doc)
+    if isinstance(timeml_doc, TimeMLDocument):
+        return timeml_doc.get_text_with_taggings(preserve_quotes)
+
+    return _element_to_tagged_text(get_text_element(timeml_doc), preserve_quotes)
+
+def _element_to_tagged_text(text_e, preserve_quotes):
 
     string = ET.tostring(text_e)
 
@@ -112,7 +176,11 @@ def get_text_with_taggings(timeml_doc, preserve_quotes=False):
 def get_stripped_root(timeml_doc):
     ''' gets the root of a timeml doc without any timex, event, or tlink annotations '''
 
-    root = xml_utilities.get_root(timeml_doc)
+    if isinstance(timeml_doc, TimeMLDocument):
+        # the root is modified below
+        root = copy.deepcopy(timeml_doc.root)
+    else:
+        root = xml_utilities.get_root(timeml_doc)
 
     # raw text for use in overriding timex/event annotated text
     text = get_text(timeml_doc, preserve_quotes=True)
@@ -139,7 +207,13 @@ def get_stripped_root(timeml_doc):
 def get_text(timeml_doc, preserve_quotes=False):
     """ gets raw text of document, xml tags removed """
 
-    text_e = get_text_element(timeml_doc)
+    if isinstance(timeml_doc, TimeMLDocument):
+        return timeml_doc.get_text(preserve_quotes)
+
+    return _element_to_text(get_text_element(timeml_doc), preserve_quotes)
+
+def _element_to_text(text_e, preserve_quotes):
+
     # string =  ET.tostring(text_e)
 
     string = ET.tostring(text_e, encoding='utf8', method='text')
@@ -156,6 +230,9 @@ def get_text(timeml_doc, preserve_quotes=False):
 def get_tagged_entities(timeml_doc):
     """ gets tagged entities within timeml text """
 
+    if isinstance(timeml_doc, TimeMLDocument):
+        return list(timeml_doc.tagged_entities)
+
     text_element = get_text_element(timeml_doc)
 
     return list(text_element)
@@ -195,6 +272,10 @@ def display_taggings_in_doc(timeml_docs):
 
 def get_make_instances(timeml_doc):
     """ gets the event instances in a timeml doc """
+
+    if isinstance(timeml_doc, TimeMLDocument):
+        return list(timeml_doc.make_instances)
+
     root = xml_utilities.get_root(timeml_doc)
 
     make_instances = []
@@ -211,6 +292,9 @@ def get_tlinks(timeml_doc):
 
     """ get tlinks from annotated document """
 
+    if isinstance(timeml_doc, TimeMLDocument):
+        return list(timeml_doc.tlinks)
+
     root = xml_utilities.get_root(timeml_doc)
 
     tlinks = []
@@ -264,6 +348,9 @@ def get_doctime_timex(timeml_doc):
 
     """ get the document creation time timex """
 
+    if isinstance(timeml_doc, TimeMLDocument):
+        return timeml_doc.doctime
+
     root = xml_utilities.get_root(timeml_doc)
 
     doctime = None
@@ -13,8 +13,31 @@ def strip_quotes(text):
 
     return text
 
+class XMLDocument(object):
+    """ an xml document held in memory. Can be passed instead of a path to the functions reading xml documents """
+
+    def __init__(self, contents, name='document'):
+        self.contents = contents
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+def read_xml(xml_doc):
+    """ get the contents of an xml document, from its path or an XMLDocument """
+
+    if isinstance(xml_doc, XMLDocument):
+        return xml_doc.contents
+
+    valid_path(xml_doc)
+
+    return open(xml_doc, 'r').read()
+
 def get_root(xml_doc_path):
 
+    if isinstance(xml_doc_path, XMLDocument):
+        return get_root_from_str(xml_doc_path.contents)
+
     valid_path(xml_doc_path)
 
     tree = ET.parse(xml_doc_path)
@@ -1,24 +1,29 @@
 import os
-import cPickle
 import glob
 
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 #np.random.seed(1337)
 
 from keras.models import Sequential, Graph
 from keras.layers import Embedding, LSTM, Dense, Merge, MaxPooling1D, TimeDistributed, Flatten, Masking, Input, Dropout, Permute
+from keras.layers import Bidirectional
 from keras.regularizers import l2, activity_l2
-from code.learning.word2vec import load_word2vec_binary
+from code.learning.word2vec import load_word_vectors, get_word_matrix, OOVVectors
 from keras.callbacks import ModelCheckpoint, EarlyStopping
 
 from code.learning.network import Network
 from code.config import env_paths
-from code.notes.TimeNote import TimeNote
+from code.notes.note_cache import NoteCache
+
+CONTEXT_SIZE = 9 # words in the context window of a token, centered on it
 
 
 class EventNetwork(object):
-    def __init__(self, word_vectors=None):
+    def __init__(self, word_vectors=None, newsreader_dir=None):
         self.word_vectors = word_vectors
+        self.newsreader_dir = newsreader_dir # use the embedding subset of this note directory, if it has one
+        self.oov_vectors = OOVVectors()
 
     def get_untrained_model(self, encoder_dropout=0, decoder_dropout=0.5, input_dropout=0.5, reg_W=0, reg_B=0, reg_act=0,
                             LSTM_size=128, dense_size=30, maxpooling=True, data_dim=300, max_len=10, nb_classes=13):
@@ -93,34 +98,104 @@ class EventNetwork(object):
         decoder.compile(loss='binary_crossentropy', optimizer='adam', metrics=['accuracy'])
         return decoder
 
-    def _extract_word_representations(self, word_list):
-        """Given a list of words, return the embeddings"""
+    def get_untrained_sentence_model(self, encoder_dropout=0, decoder_dropout=0.5, input_dropout=0.5, reg_W=0, reg_B=0, reg_act=0,
+                                     LSTM_size=128, dense_size=30, data_dim=300):
+        '''
+        Creates a network that tags every token of a sentence in one pass, instead of encoding a window per token.
+        A BiLSTM runs over the word vectors of the sentence, and the same four attributes as in get_untrained_model()
+        are added to its output at every token.
+        Inputs: (n_sentences, n_tokens, data_dim) word vectors and (n_sentences, n_tokens, 4) attributes
+        Output: (n_sentences, n_tokens, 1) event probabilities
+        params:
+            LSTM_size: number of units in each direction of the BiLSTM
+            All other params are as in get_untrained_model()
+        '''
+        W_reg = l2(reg_W) if reg_W != 0 else None
+        B_reg = l2(reg_B) if reg_B != 0 else None
+        act_reg = activity_l2(reg_act) if reg_act != 0 else None
+
+        # encode the words of the sentence
+        encoder_L = Sequential()
+        encoder_L.add(Dropout(input_dropout, input_shape=(None, data_dim)))
+        encoder_L.add(Bidirectional(LSTM(LSTM_size, return_sequences=True, inner_activation="sigmoid")))
+        if encoder_dropout != 0:
+            encoder_L.add(TimeDistributed(Dropout(encoder_dropout)))
+
+        # encode the pos tags and is_predicate of every token
+        encoder_R = Sequential()
+        encoder_R.add(TimeDistributed(Dense(3), input_shape=(None, 4)))
+
+        # classify every token
+        decoder = Sequential()
+        decoder.add(Merge([encoder_L, encoder_R], mode='concat'))
+        decoder.add(TimeDistributed(
+            Dense(dense_size, W_regularizer=W_reg, b_regularizer=B_reg, activity_regularizer=act_reg, activation='sigmoid')))
+        if decoder_dropout != 0:
+            decoder.add(Dropout(decoder_dropout))
+        decoder.add(TimeDistributed(Dense(1, activation='sigmoid')))
+
+        # padding tokens get a sample weight of 0
+        decoder.compile(loss='binary_crossentropy', optimizer='adam', metrics=['accuracy'], sample_weight_mode='temporal')
+        return decoder
+
+    @staticmethod
+    def is_sentence_model(model):
+        '''
+        whether a model was made by get_untrained_sentence_model(). Its inputs have no fixed number of tokens
+        '''
+        return model.input_shape[0][1] is None
+
+    def _get_word_matrix(self, words):
+        """Given a list of words, return their (len(words), data_dim) embeddings"""
         if self.word_vectors is None:
             print 'Loading word embeddings...'
-            self.word_vectors = load_word2vec_binary(os.environ["TEA_PATH"] + '/GoogleNews-vectors-negative300.bin', verbose=0)
-
-        vecs = None
-        for word in word_list:
-            # try to get embedding for a given word. If the word is not in the vocabulary, use a vector of all 1s.
-            try:
-                embedding = self.word_vectors[word]
-            except KeyError:
-                embedding = np.random.uniform(low=-0.5, high=0.5, size=(300))
-
-            # reshape to 3 dimensions so embeddings can be concatenated together to form the final input values
-            embedding = embedding[np.newaxis, :, np.newaxis]
-            if vecs is None:
-                vecs = embedding
-            else:
-                vecs = np.concatenate((vecs, embedding), axis=2)
-
-        return vecs
+            self.word_vectors = load_word_vectors(newsreader_dir=self.newsreader_dir)
+
+        # out of vocabulary words get a fixed vector derived from the word itself
+        return get_word_matrix(self.word_vectors, words, self.oov_vectors)
+
+    def _get_context_windows(self, note, word_indexes):
+        """
+        get the (len(word_indexes), CONTEXT_SIZE, data_dim) context windows of some tokens of a note, by word index
+        (1 for 'w1'). A window holds the words from CONTEXT_SIZE/2 before to CONTEXT_SIZE/2 after the token, within
+        the document, and is padded with zeros on the right.
+        The embeddings of the document are looked up once, and the windows are rows of a strided view over them
+        """
+        max_id = len(note.id_to_tok) # word ids starts with 1
+        half = CONTEXT_SIZE // 2
+        vectors = self._get_word_matrix([note.id_to_tok['w'+str(x)]['token'] for x in range(1, max_id+1)])
+
+        # zeros around the document, so that the window of token i starts at row i - 1
+        padded = np.zeros((max_id + 2 * half, vectors.shape[1]), dtype='float32')
+        padded[half:half + max_id] = vectors
+        windows = as_strided(padded, shape=(max_id, CONTEXT_SIZE, padded.shape[1]),
+                             strides=(padded.strides[0], padded.strides[0], padded.strides[1]))
+
+        rows = np.asarray(word_indexes, dtype='int64') - 1
+        context = windows[rows]
+
+        # windows at the start of the document begin with its first word, and are padded on the right instead
+        for i in np.flatnonzero(rows < half):
+            n_words = rows[i] + half + 1
+            context[i, :n_words] = padded[half:half + n_words]
+            context[i, n_words:] = 0
+
+        return context
+
+    @staticmethod
+    def _get_window_input(contexts, max_id):
+        """
+        concatenate context windows into the (n_tokens, data_dim, window length) input of the model.
+        Windows are only as long as the longest document allows
+        """
+        return np.concatenate(contexts)[:, :min(CONTEXT_SIZE, max_id)].transpose(0, 2, 1)
 
     def get_input(self, notes, shuffle=True, neg_ratio=3):
 
-        word_vectors = None
-        attribute_vectors = None
+        contexts = []
+        attributes = []
         labels = []
+        max_ids = []
         for note in notes:
             print "processing file ", note.annotated_note_path
             if hasattr(note, 'event_ids'):
@@ -131,6 +206,8 @@ class EventNetwork(object):
             # every event tag corresponds to a list of words, pick the first word
             event_wordIDs = [note.id_to_wordIDs[x][0] for x in event_ids]
             max_id = len(note.id_to_tok) # word ids starts with 1
+            if max_id == 0:
+                continue
 
             all_wordIDs = set(['w'+str(x) for x in range(1,max_id+1)])
             nonevent_wordIDs = all_wordIDs - set(event_wordIDs)
@@ -139,32 +216,17 @@ class EventNetwork(object):
 
             training_wordIDs = event_wordIDs + nonevent_wordIDs
 
-            for wordID in training_wordIDs:
-                word_index = int(wordID[1:]) # wordID example: 'w31'
-                left_edge = max(1, word_index - 4)
-                right_edge = min(max_id, word_index + 4)
-
-                context_tokens = [note.id_to_tok['w'+str(x)] for x in range(left_edge, right_edge+1)]
-                context_words = [x['token'] for x in context_tokens]
-                vecs = self._extract_word_representations(context_words)
-                if word_vectors is None:
-                    word_vectors = vecs
-                else:
-                    word_vectors = Network._pad_and_concatenate(word_vectors, vecs, axis=0)
-
-                tok = note.id_to_tok[wordID]
-                attributes = np.array([tok.get('is_main_verb', False), tok.get('is_predicate', False),
-                                       tok['pos']=='V', tok['pos']=='N'])
-                attributes = attributes[np.newaxis, :]
-                if attribute_vectors is None:
-                    attribute_vectors = attributes
-                else:
-                    attribute_vectors = np.concatenate((attribute_vectors, attributes), axis=0)
-
-                if wordID in event_wordIDs:
-                    labels.append(1)
-                else:
-                    labels.append(0)
+            # wordID example: 'w31'
+            contexts.append(self._get_context_windows(note, [int(wordID[1:]) for wordID in training_wordIDs]))
+            attributes.append(EventNetwork._get_attributes([note.id_to_tok[wordID] for wordID in training_wordIDs]))
+            labels += [1] * len(event_wordIDs) + [0] * len(nonevent_wordIDs)
+            max_ids.append(max_id)
+
+        if not contexts:
+            return None, None, labels
+
+        word_vectors = EventNetwork._get_window_input(contexts, max(max_ids))
+        attribute_vectors = np.concatenate(attributes)
 
         if shuffle:
             rng_state = np.random.get_state()
@@ -179,51 +241,74 @@ class EventNetwork(object):
     def get_test_input(self, note):
         """Given a note, return data for every token"""
 
-        max_id = len(note.id_to_tok)  # word ids starts with 1
-        word_vectors = None
-        attribute_vectors = None
-
-        for sent_num in note.pre_processed_text:
-            for tok in note.pre_processed_text[sent_num]:
-                wordID = tok['id']
-                word_index = int(wordID[1:]) # wordID example: 'w31'
-                left_edge = max(1, word_index - 4)
-                right_edge = min(max_id, word_index + 4)
-
-                context_tokens = [note.id_to_tok['w'+str(x)] for x in range(left_edge, right_edge+1)]
-                context_words = [x['token'] for x in context_tokens]
-                vecs = self._extract_word_representations(context_words)
-                if word_vectors is None:
-                    word_vectors = vecs
-                else:
-                    word_vectors = Network._pad_and_concatenate(word_vectors, vecs, axis=0)
-
-                attributes = np.array([tok.get('is_main_verb', False), tok.get('is_predicate', False),
-                                       tok['pos']=='V', tok['pos']=='N'])
-                attributes = attributes[np.newaxis, :]
-                if attribute_vectors is None:
-                    attribute_vectors = attributes
-                else:
-                    attribute_vectors = np.concatenate((attribute_vectors, attributes), axis=0)
+        tokens = [tok for sent_num in note.pre_processed_text for tok in note.pre_processed_text[sent_num]]
+        if not tokens:
+            return None, None
+
+        # wordID example: 'w31'
+        context = self._get_context_windows(note, [int(tok['id'][1:]) for tok in tokens])
+        word_vectors = EventNetwork._get_window_input([context], len(note.id_to_tok))
+        attribute_vectors = EventNetwork._get_attributes(tokens)
+
+        return word_vectors, attribute_vectors
+
+    @staticmethod
+    def get_sentences(note):
+        '''
+        get the tokens of every sentence of a note, in the order of the sentences
+        '''
+        return [note.pre_processed_text[sent_num] for sent_num in sorted(note.pre_processed_text)]
+
+    @staticmethod
+    def _get_attributes(tokens):
+        return np.array([[tok.get('is_main_verb', False), tok.get('is_predicate', False), tok['pos']=='V', tok['pos']=='N']
+                         for tok in tokens], dtype='float32').reshape(len(tokens), 4)
+
+    def get_sentence_input(self, notes):
+        '''
+        get (word vectors, attributes, labels) of every sentence of the notes, to train a sentence model.
+        Every token is used, labeled 1 if it is the first word of an event
+        '''
+        word_vectors, attribute_vectors, labels = [], [], []
+        for note in notes:
+            print "processing file ", note.annotated_note_path
+            if hasattr(note, 'event_ids'):
+                event_ids = note.event_ids
+            else:
+                id_chunk_map, event_ids, timex_ids, sentence_chunks = note.get_id_chunk_map()
+            event_wordIDs = set([note.id_to_wordIDs[x][0] for x in event_ids])
+
+            note_vectors, note_attributes = self.get_sentence_test_input(note)
+            word_vectors += note_vectors
+            attribute_vectors += note_attributes
+            labels += [np.array([tok['id'] in event_wordIDs for tok in tokens], dtype='float32')
+                       for tokens in EventNetwork.get_sentences(note)]
+
+        return word_vectors, attribute_vectors, labels
+
+    def get_sentence_test_input(self, note):
+        '''
+        get the (n_tokens, data_dim) word vectors and (n_tokens, 4) attributes of every sentence of a note,
+        in the order of get_sentences()
+        '''
+        sentences = EventNetwork.get_sentences(note)
+        words = [tok['token'] for tokens in sentences for tok in tokens]
+
+        # a single lookup for the whole note
+        vectors = self._get_word_matrix(words)
+        ends = np.cumsum([len(tokens) for tokens in sentences])
+        word_vectors = np.split(vectors.astype('float32'), ends[:-1])
+        attribute_vectors = [EventNetwork._get_attributes(tokens) for tokens in sentences]
 
         return word_vectors, attribute_vectors
 
     def get_notes(self, annotated_dir, newsreader_dir, save_notes=False):
         annotated_files = sorted(glob.glob(os.path.join(annotated_dir, '*.tml')))
 
-        base_names = [os.path.basename(x) for x in annotated_files]
-        note_files = [os.path.join(newsreader_dir, x[0:x.index(".tml")] + '.parsed.pickle') for x in base_names]
+        note_cache = NoteCache(newsreader_dir)
 
-        notes = []
-        for i, note_file in enumerate(note_files):
-            if os.path.exists(note_file):
-                notes.append(cPickle.load(open(note_file)))
-            else:
-                note = TimeNote(annotated_files[i], None) # we do not need tlinks
-                notes.append(note)
-                if save_notes:
-                    cPickle.dump(note, open(note_file, 'w'))
-        return notes
+        # we do not need tlinks
+        return [note_cache.get_note(annotated_file, None, save=save_notes) for annotated_file in annotated_files]
 
     def train_model(self, training_data, validation_data=None, model_destination='./', epochs=500,
                     weight_classes=False, batch_size=256,
@@ -279,13 +364,13 @@ class EventNetwork(object):
                                      batch_size=batch_size, validation_data=([V_XL, V_XR], V_Y),
                                      callbacks=[checkpoint, earlystopping])
 
-        test = model.predict_classes([V_XL, V_XR])
+        test = Network.get_labels_from_probs(model.predict([V_XL, V_XR], batch_size=batch_size))
 
         Network.class_confusion(test, V_Y, 2)
 
         return model, training_history.history
 
-    def predict(self, model, test_data, predict_prob=False):
+    def predict(self, model, test_data, predict_prob=False, batch_size=256):
 
         XL, XR = test_data
 
@@ -300,14 +385,151 @@ class EventNetwork(object):
             XL = Network._strip_to_length(XL, model_input_len, 2)
 
         print "predicting..."
-        labels = model.predict_classes([XL, XR])
-        if predict_prob:
-            probs = model.predict_proba([XL, XR])
+        # a single forward pass gives both the labels and the probabilities
+        probs = model.predict([XL, XR], batch_size=batch_size)
+        labels = Network.get_labels_from_probs(probs)
+        if not predict_prob:
+            probs = None
+
+        return labels, probs
+
+    def train_sentence_model(self, training_data, validation_data=None, model_destination='./', epochs=500,
+                             weight_classes=False, batch_size=256, encoder_dropout=0, decoder_dropout=0.5, input_dropout=0.5,
+                             reg_W=0, reg_B=0, reg_act=0, LSTM_size=128, dense_size=30, data_dim=300, bucket_width=4):
+        '''
+        train a sentence model, see get_untrained_sentence_model().
+        training_data and validation_data are from get_sentence_input(). Without validation_data, 20% of the
+        training sentences are used for validation.
+        batch_size: number of tokens per batch. Sentences of similar lengths are batched together, see _get_sentence_batches()
+        '''
+        XL, XR, Y = training_data
+        print "training data: {} sentences, {} tokens".format(len(XL), sum([len(y) for y in Y]))
+
+        # use weighting to assist with the imbalanced data set problem, as sample weights of the tokens
+        class_weight = {1: 1.0, 0: 1.0}
+        if weight_classes:
+            N = sum([len(y) for y in Y])
+            n_pos = sum([y.sum() for y in Y])
+            neg_weight = 1.0 * n_pos / N # inversely proportional to frequency
+            class_weight = {1: 1-neg_weight, 0: neg_weight}
+        sample_weights = [np.where(y > 0, class_weight[1], class_weight[0]).astype('float32') for y in Y]
+
+        model = self.get_untrained_sentence_model(encoder_dropout=encoder_dropout, decoder_dropout=decoder_dropout,
+                                                  input_dropout=input_dropout, reg_W=reg_W, reg_B=reg_B, reg_act=reg_act,
+                                                  LSTM_size=LSTM_size, dense_size=dense_size, data_dim=data_dim)
+
+        # split off validation data with 20 80 split
+        if validation_data is None:
+            n_val = len(XL) / 5
+            V_XL, V_XR, V_Y = XL[:n_val], XR[:n_val], Y[:n_val]
+            XL, XR, Y, sample_weights = XL[n_val:], XR[n_val:], Y[n_val:], sample_weights[n_val:]
         else:
+            V_XL, V_XR, V_Y = validation_data
+        V_weights = [np.ones(len(y), dtype='float32') for y in V_Y]
+
+        # train the network
+        print 'Training network...'
+        earlystopping = EarlyStopping(monitor='val_loss', patience=20, verbose=0, mode='auto')
+        checkpoint = ModelCheckpoint(model_destination + 'model.h5', monitor='val_acc', save_best_only=True)
+
+        training_batches = EventNetwork._get_sentence_batches([len(y) for y in Y], batch_size, bucket_width, shuffle=False)
+        val_batches = EventNetwork._get_sentence_batches([len(y) for y in V_Y], batch_size, bucket_width, shuffle=False)
+        training_history = model.fit_generator(
+            EventNetwork._sentence_batch_generator(XL, XR, Y, sample_weights, batch_size, bucket_width),
+            len(training_batches), epochs=epochs,
+            validation_data=EventNetwork._sentence_batch_generator(V_XL, V_XR, V_Y, V_weights, batch_size, bucket_width, shuffle=False),
+            validation_steps=len(val_batches), callbacks=[checkpoint, earlystopping])
+
+        test, probs = self.predict_sentences(model, (V_XL, V_XR), batch_size=batch_size, bucket_width=bucket_width)
+
+        Network.class_confusion(test, np.concatenate(V_Y).astype('int32') if V_Y else [], 2)
+
+        return model, training_history.history
+
+    def predict_sentences(self, model, test_data, predict_prob=False, batch_size=256, bucket_width=4):
+        '''
+        predict with a sentence model. test_data is from get_sentence_test_input().
+        Returns the labels, and probabilities if predict_prob is True, of the tokens of all sentences one after the other
+        '''
+        XL, XR = test_data
+        lengths = [len(x) for x in XL]
+        probs = [None] * len(XL)
+
+        print "predicting..."
+        for length, indexes in EventNetwork._get_sentence_batches(lengths, batch_size, bucket_width, shuffle=False):
+            batch_probs = model.predict_on_batch([EventNetwork._get_sentence_batch(XL, indexes, length),
+                                                  EventNetwork._get_sentence_batch(XR, indexes, length)])
+            for i, sentence_index in enumerate(indexes):
+                probs[sentence_index] = batch_probs[i, :lengths[sentence_index]]
+
+        if probs:
+            probs = np.concatenate(probs)
+        else:
+            probs = np.zeros((0, 1), dtype='float32')
+        labels = Network.get_labels_from_probs(probs).ravel()
+        if not predict_prob:
             probs = None
 
         return labels, probs
 
+    def predict_event_tokens(self, model, note, batch_size=256):
+        '''
+        get the tokens of a note that a windowed or a sentence model tags as events
+        '''
+        if EventNetwork.is_sentence_model(model):
+            data = self.get_sentence_test_input(note)
+            predictions, probs = self.predict_sentences(model, data, batch_size=batch_size)
+            tokens = [tok for tokens in EventNetwork.get_sentences(note) for tok in tokens]
+            return [token for token, pred in zip(tokens, predictions) if pred]
+
+        data = self.get_test_input(note)
+        predictions, probs = self.predict(model, data, batch_size=batch_size)
+        return [note.id_to_tok['w' + str(i+1)] for i, pred in enumerate(predictions) if pred]
+
+    @staticmethod
+    def _get_sentence_batches(lengths, batch_size, bucket_width, shuffle=True):
+        '''
+        group sentences by length, rounded up to a multiple of bucket_width, into batches of about batch_size tokens.
+        Returns a list of (bucket length, sentence indexes)
+        '''
+        buckets = Network._get_buckets(np.array(lengths, dtype='int64'), bucket_width)
+        batches = []
+        for length in sorted(buckets):
+            indexes = buckets[length]
+            if shuffle:
+                indexes = np.random.permutation(indexes)
+            n_sentences = max(batch_size // length, 1)
+            batches += [(length, indexes[i:i + n_sentences]) for i in range(0, len(indexes), n_sentences)]
+        return batches
+
+    @staticmethod
+    def _get_sentence_batch(X, indexes, length):
+        '''
+        stack the (n_tokens, dim) arrays of some sentences, padded with zeros on the right to length
+        '''
+        batch = np.zeros((len(indexes), length) + X[indexes[0]].shape[1:], dtype='float32')
+        for i, sentence_index in enumerate(indexes):
+            batch[i, :len(X[sentence_index])] = X[sentence_index]
+        return batch
+
+    @staticmethod
+    def _sentence_batch_generator(XL, XR, Y, sample_weights, batch_size, bucket_width, shuffle=True):
+        '''
+        generate ([XL, XR], Y, sample weights) batches of sentences forever, as fit_generator expects.
+        Padding tokens have a sample weight of 0
+        '''
+        lengths = [len(y) for y in Y]
+        Y = [y[:, np.newaxis] for y in Y]
+        while True:
+            batches = EventNetwork._get_sentence_batches(lengths, batch_size, bucket_width, shuffle=shuffle)
+            if shuffle:
+                np.random.shuffle(batches)
+
+            for length, indexes in batches:
+                yield ([EventNetwork._get_sentence_batch(XL, indexes, length), EventNetwork._get_sentence_batch(XR, indexes, length)],
+                       EventNetwork._get_sentence_batch(Y, indexes, length),
+                       EventNetwork._get_sentence_batch(sample_weights, indexes, length))
+
 
     # def single_predict(self, XL, XR, model, predict_prob=False):
     #     '''
@@ -343,8 +565,9 @@ if __name__ == "__main__":
     val_dir = '../sandbox/val_set'
     newsreader_dir = './newsreader_annotations/12cls_half_neg/'
     model_dir = './model_destination/event/'
+    sentence_model = False # tag whole sentences with a BiLSTM, instead of a window per token
 
-    network = EventNetwork()
+    network = EventNetwork(newsreader_dir=newsreader_dir)
     training_notes = network.get_notes(training_dir, newsreader_dir, save_notes=False)
     # # downsample to get a quick check
     # np.random.shuffle(training_notes)
@@ -355,15 +578,23 @@ if __name__ == "__main__":
     #val_notes = val_notes[0:5]
     print "all notes loaded"
 
-    training_data = network.get_input(training_notes)
+    if sentence_model:
+        get_input = network.get_sentence_input
+    else:
+        get_input = network.get_input
+
+    training_data = get_input(training_notes)
     print "training data loaded"
 
-    val_data = network.get_input(val_notes)
+    val_data = get_input(val_notes)
     print "validation data loaded"
 
     print "all data loaded successfully"
 
-    NN, history = network.train_model(training_data, validation_data=val_data, model_destination=model_dir, weight_classes=True, maxpooling=True)
+    if sentence_model:
+        NN, history = network.train_sentence_model(training_data, validation_data=val_data, model_destination=model_dir, weight_classes=True)
+    else:
+        NN, history = network.train_model(training_data, validation_data=val_data, model_destination=model_dir, weight_classes=True, maxpooling=True)
     architecture = NN.to_json()
     open(model_dir + '.arch.json', "wb").write(architecture)
     NN.save_weights(model_dir + '.weights.h5')
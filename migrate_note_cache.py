@@ -0,0 +1,79 @@
+'''
+Convert the notes cached by earlier versions in a newsreader_annotations directory (.parsed.pickle,
+.parsed.predict.pickle and .parsed.note.npz files) into entries of the note cache, see code/notes/note_cache.py.
+Entries are keyed by the current contents of the documents the notes were built from, so notes of
+documents that were edited since they were cached should be removed rather than converted.
+'''
+
+import sys
+import os
+from code.config import env_paths
+if env_paths()["PY4J_DIR_PATH"] is None:
+    sys.exit("PY4J_DIR_PATH environment variable not specified")
+
+import argparse
+import glob
+
+from code.notes.note_cache import NoteCache, is_legacy_note_file, load_note
+
+
+def migrate_note(note_cache, legacy_file, remove=False):
+    '''
+    add a note cached by an earlier version to note_cache. Returns the path of its entry,
+    or None if the documents of the note cannot be found
+    '''
+    note = load_note(legacy_file)
+
+    documents = [note.note_path, note.annotated_note_path]
+    if not all([document is None or (isinstance(document, basestring) and os.path.isfile(document)) for document in documents]):
+        print "cannot find the documents of", legacy_file
+        return None
+
+    note_path = note_cache.add_note(note, note.note_path, note.annotated_note_path)
+
+    # the entry should hold the same tokens and tlinks
+    cached = load_note(note_path)
+    assert sorted(cached.id_to_tok) == sorted(note.id_to_tok)
+    assert len(cached.tlinks) == len(note.tlinks)
+
+    if remove:
+        os.remove(legacy_file)
+    return note_path
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("newsreader_annotations",
+                        help="Where newsreader pipeline parsed file objects go")
+
+    parser.add_argument("--remove",
+                        action='store_true',
+                        default=False,
+                        help="Remove the notes of earlier versions once they are converted")
+
+    args = parser.parse_args()
+
+    if os.path.isdir(args.newsreader_annotations) is False:
+        sys.exit("invalid path for time note dir")
+
+    note_cache = NoteCache(args.newsreader_annotations)
+    legacy_files = sorted([f for f in glob.glob(os.path.join(args.newsreader_annotations, '*')) if is_legacy_note_file(f)])
+
+    legacy_size = note_size = n_converted = 0
+    for i, legacy_file in enumerate(legacy_files):
+        print 'converting note {}/{} {}'.format(i + 1, len(legacy_files), legacy_file)
+        size = os.path.getsize(legacy_file)
+        note_path = migrate_note(note_cache, legacy_file, remove=args.remove)
+        if note_path is not None:
+            legacy_size += size
+            note_size += os.path.getsize(note_path)
+            n_converted += 1
+
+    print "converted {}/{} notes, {:.1f} MB -> {:.1f} MB".format(n_converted, len(legacy_files), legacy_size / 1e6,
+                                                              note_size / 1e6)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,6 @@ if env_paths()["PY4J_DIR_PATH"] is None:
     sys.exit("PY4J_DIR_PATH environment variable not specified")
 
 import os
-import cPickle
 import argparse
 import glob
 
@@ -17,15 +16,13 @@ from code.learning import model
 from code.learning.model_event import EventWriter
 from code.learning.model_event import tag_timex
 from keras.models import load_model
+from code.learning.numpy_inference import load_numpy_model
 
-from code.learning.word2vec import load_word2vec_binary
-
-timenote_imported = False
+from code.learning.word2vec import load_word_vectors
+from code.notes.note_cache import NoteCache
 
 def main():
 
-    global timenote_imported
-
     parser = argparse.ArgumentParser()
 
     parser.add_argument("timex_dir",
@@ -41,6 +38,15 @@ def main():
     parser.add_argument("newsreader_annotations",
                         help="Where newsreader pipeline parsed file objects go")
 
+    parser.add_argument("--batch_size",
+                        default=256,
+                        type=int,
+                        help="Number of tokens per forward pass of the event model")
+
+    parser.add_argument("--numpy",
+                        action='store_true',
+                        default=False,
+                        help="Run the event model with NumPy only, instead of Keras")
 
     args = parser.parse_args()
 
@@ -62,11 +68,13 @@ def main():
 
     files_to_annotate = glob.glob(predict_dir + "/*")
 
-    pickled_timeml_notes = [os.path.basename(l) for l in glob.glob(newsreader_dir + "/*")]
-
     # event model
-    NNet = load_model(os.path.join(model_path, 'model.h5'))
-    word_vectors = load_word2vec_binary(os.environ["TEA_PATH"] + '/GoogleNews-vectors-negative300.bin', verbose=0)
+    if args.numpy:
+        NNet = load_numpy_model(os.path.join(model_path, 'model.h5'))
+    else:
+        NNet = load_model(os.path.join(model_path, 'model.h5'))
+    word_vectors = load_word_vectors(newsreader_dir=newsreader_dir)
+    note_cache = NoteCache(newsreader_dir)
 
     #read in files as notes
     for i, tml in enumerate(files_to_annotate):
@@ -79,20 +87,12 @@ def main():
             stashed_name = stashed_name[0:stashed_name.index('tml')]
         stashed_name = '.'.join(stashed_name)
 
-        if stashed_name + ".parsed.predict.pickle" in pickled_timeml_notes:
-            print "loading stashed"
-            note = cPickle.load(open(newsreader_dir + "/" + stashed_name + ".parsed.predict.pickle", "rb"))
-        else:
-            if timenote_imported is False:
-                from code.notes.TimeNote import TimeNote
-                timenote_imported = True
-            note = TimeNote(tml, tml) # need the second argument to get timex tags
-            cPickle.dump(note, open(newsreader_dir + "/" + stashed_name + ".parsed.predict.pickle", "wb"))
+        note = note_cache.get_note(tml, tml) # need the second argument to get timex tags
 
         entityLabels = [label for line in note.iob_labels for label in line]
         tokens = [token for num in note.pre_processed_text for token in note.pre_processed_text[num]]
 
-        event_writer = EventWriter(note, word_vectors=word_vectors, NNet=NNet)
+        event_writer = EventWriter(note, word_vectors=word_vectors, NNet=NNet, batch_size=args.batch_size)
         tml_root = event_writer.tag_text(entityLabels, tokens, note)
         note_path = os.path.join(annotation_destination, stashed_name + ".tml")
         EventWriter.write_tags(tml_root, note_path)
@@ -9,33 +9,19 @@ import numpy
 numpy.random.seed(1337)
 
 import argparse
-import cPickle
 import glob
 import os
 
-from keras.models import model_from_json
-
 from code.learning.network import Network
-from code.notes.TimeNote import TimeNote
-from code.learning.time_ref import predict_timex_rel
-from code.learning.break_cycle import modify_tlinks
+from code.notes.note_cache import NoteCache
+from code.learning.annotator import load_tlink_model, predict_tlinks, get_annotated_timeml
+from code.learning.numpy_inference import UnsupportedModelError
 
-timenote_imported = False
 if env_paths()["PY4J_DIR_PATH"] is None:
     sys.exit("PY4J_DIR_PATH environment variable not specified")
 
-def basename(s):
-    if '.tml' in s:
-        s = os.path.basename(s[0:s.index(".tml")])
-    if 'TE3input' in s:
-        s = os.path.basename(s[0:s.index(".TE3input")])
-    return s
-
-
 def main():
 
-    global timenote_imported
-
     parser = argparse.ArgumentParser()
 
     parser.add_argument("predict_dir",
@@ -62,6 +48,27 @@ def main():
                         default=False,
                         help="Use gold data from the given files to produce evaluation metrics")
 
+    parser.add_argument("--batch_size",
+                        default=256,
+                        type=int,
+                        help="Number of pairs per forward pass of the models")
+
+    parser.add_argument("--numpy",
+                        action='store_true',
+                        default=False,
+                        help="Run the models with NumPy only, instead of Keras. "
+                             "Sentence encoder models (train_network.py --sentence_encoder) are not supported")
+
+    parser.add_argument("--cache_encoders",
+                        action='store_true',
+                        default=False,
+                        help="Encode every distinct dependency subpath once, and only run the decoder per pair")
+
+    parser.add_argument("--window",
+                        default=20,
+                        type=int,
+                        help="Number of documents to predict together. The output does not depend on it")
+
     args = parser.parse_args()
 
     annotation_destination = args.annotation_destination
@@ -101,88 +108,31 @@ def main():
     # one-to-one pairing of annotated file and un-annotated
     # assert len(gold_files) == len(tml_files)
 
-    network = Network()
+    network = Network(newsreader_dir=newsreader_dir)
+    note_cache = NoteCache(newsreader_dir)
 
-    intra_model = model_from_json(open(os.path.join(args.intra_model_path, 'intra', '.arch.json')).read())
-    intra_model.load_weights(os.path.join(args.intra_model_path, 'intra', '.weights.h5'))
-    cross_model = model_from_json(open(os.path.join(args.cross_model_path, 'cross', '.arch.json')).read())
-    cross_model.load_weights(os.path.join(args.cross_model_path, 'cross', '.weights.h5'))
-    dct_model = model_from_json(open(os.path.join(args.dct_model_path, 'dct', '.arch.json')).read())
-    dct_model.load_weights(os.path.join(args.dct_model_path, 'dct', '.weights.h5'))
+    try:
+        intra_model = load_tlink_model(args.intra_model_path, 'intra', use_numpy=args.numpy)
+        cross_model = load_tlink_model(args.cross_model_path, 'cross', use_numpy=args.numpy)
+        dct_model = load_tlink_model(args.dct_model_path, 'dct', use_numpy=args.numpy)
+    except UnsupportedModelError as e:
+        sys.exit(str(e))
 
-    for i, tml in enumerate(gold_files):
+    # predict a window of notes at a time, with one forward pass per model
+    for window_start in range(0, len(gold_files), args.window):
+        notes = []
+        for i, tml in enumerate(gold_files[window_start:window_start + args.window], window_start):
 
-        print '\n\nprocessing file {}/{} {}'.format(i + 1,
-                                                    len(gold_files),
-                                                    tml)
-        if os.path.isfile(os.path.join(newsreader_dir, basename(tml) + ".parsed.pickle")):
-            tmp_note = cPickle.load(open(os.path.join(newsreader_dir, basename(tml) + ".parsed.pickle"), "rb"))
-        else:
-            tmp_note = TimeNote(tml, tml)
-            cPickle.dump(tmp_note, open(newsreader_dir + "/" + basename(tml) + ".parsed.pickle", "wb"))
-
-        # notes.append(tmp_note)
-        notes = [tmp_note] # required to be a list
-
-        intra_labels, intra_probs, intra_pair_index = network.single_predict(notes, intra_model, 'intra', predict_prob=True)
-        intra_labels, intra_pair_index, intra_scores = network.smart_predict(intra_labels, intra_probs, intra_pair_index, type='str')
-
-        cross_labels, cross_probs, cross_pair_index = network.single_predict(notes, cross_model, 'cross', predict_prob=True)
-        cross_labels, cross_pair_index, cross_scores = network.smart_predict(cross_labels, cross_probs, cross_pair_index, type='str')
-
-        timex_labels, timex_pair_index = predict_timex_rel(notes)
-
-        dct_labels, dct_probs, dct_pair_index = network.single_predict(notes, dct_model, 'dct', predict_prob=True)
-        dct_labels = network._convert_int_labels_to_str(dct_labels)
-        dct_scores = [max(probs) for probs in dct_probs]
-        assert len(dct_labels) == len(dct_scores)
-
-        for i, note in enumerate(notes):
-            note_id_pairs = []
-            note_labels = []
-            note_scores = []
-
-            for key in intra_pair_index.keys(): #  {(note_id, (ei, ej)) : index}
-                # the dictionary is dynamically changing, so we need to check
-                if key not in intra_pair_index:
-                    continue
-                if key[0] == i:
-                    note_id_pairs.append(key[1])
-                    note_labels.append(intra_labels[intra_pair_index[key]])
-                    note_scores.append(intra_scores[intra_pair_index[key]])
-                    intra_pair_index.pop(key)
-                    opposite_key = (key[0], (key[1][1], key[1][0]))
-                    intra_pair_index.pop(opposite_key)
-
-            for key in cross_pair_index.keys():  # {(note_id, (ei, ej)) : index}
-                # the dictionary is dynamically changing, so we need to check
-                if key not in cross_pair_index:
-                    continue
-                if key[0] == i:
-                    note_id_pairs.append(key[1])
-                    note_labels.append(cross_labels[cross_pair_index[key]])
-                    note_scores.append(cross_scores[cross_pair_index[key]])
-                    cross_pair_index.pop(key)
-                    opposite_key = (key[0], (key[1][1], key[1][0]))
-                    cross_pair_index.pop(opposite_key)
-
-            for key in timex_pair_index.keys():  # {(note_id, (t, t)) : index}
-                if key[0] == i:
-                    note_id_pairs.append(key[1])
-                    note_labels.append(timex_labels[timex_pair_index[key]])
-                    note_scores.append(1.0) # trust timex tlinks
-                    timex_pair_index.pop(key)
-
-            for key in dct_pair_index.keys():  # {(note_id, (ei, t0)) : index}
-                if key[0] == i:
-                    note_id_pairs.append(key[1])
-                    note_labels.append(dct_labels[dct_pair_index[key]])
-                    note_scores.append(max(dct_probs[dct_pair_index[key]]))
-                    #note_scores.append(0.0)
-                    dct_pair_index.pop(key)
-
-            # note_labels, note_scores = resolve_coref(note, note_id_pairs, note_labels, note_scores)
-            note_labels = modify_tlinks(note_id_pairs, note_labels, note_scores)
+            print '\n\nprocessing file {}/{} {}'.format(i + 1,
+                                                        len(gold_files),
+                                                        tml)
+            tmp_note = note_cache.get_note(tml, tml)
+
+            notes.append(tmp_note)
+
+        tlinks = predict_tlinks(network, notes, intra_model, cross_model, dct_model, batch_size=args.batch_size,
+                                cache_encoders=args.cache_encoders)
+        for note, (note_id_pairs, note_labels, note_scores) in zip(notes, tlinks):
             save_predictions(note, note_id_pairs, note_labels, annotation_destination)
 
 
@@ -212,72 +162,9 @@ def resolve_coref(note, note_id_pairs, note_labels, note_scores):
 def save_predictions(note, id_pairs, note_labels, annotation_destination):
     note_path = os.path.join(annotation_destination, note.note_path.split('/')[-1])
     print "saving predictions in", note_path
-    with open(note.annotated_note_path, 'r') as f:
-        raw_text = []
-        for line in f:
-            if '<MAKEINSTANCE' in line:
-                break
-            elif '<TLINK' in line:
-                break
-            else:
-                raw_text.append(line)
-
-    raw_text = ''.join(raw_text)
-    tlinks = []
-    makeinstances = []
-
-    for i, (id_pair, note_label) in enumerate(zip(id_pairs, note_labels)):
-        if note_label != 'None':
-            src_eid, target_eid = id_pair
-            if src_eid[0] == 'e' and target_eid[0] == 'e':
-                src_eiid = 'ei' + src_eid[1:]
-                target_eiid = 'ei' + target_eid[1:]
-                lid = 'l' + str(i)
-                tlink = '<TLINK eventInstanceID="{}" lid="{}" relType="{}" relatedToEventInstance="{}"/>'.format(
-                                                                                                    src_eiid, lid,
-                                                                                                    note_label, target_eiid)
-                makeinstance = '<MAKEINSTANCE eiid="{}" eventID="{}" pos="UNKNOWN" tense="NONE"/>'.format(src_eiid, src_eid)
-                makeinstances.append(makeinstance)
-                makeinstance = '<MAKEINSTANCE eiid="{}" eventID="{}" pos="UNKNOWN" tense="NONE"/>'.format(target_eiid, target_eid)
-                makeinstances.append(makeinstance)
-
-            elif src_eid[0] == 'e' and target_eid[0] == 't':
-                src_eiid = 'ei' + src_eid[1:]
-                target_tid = target_eid
-                lid = 'l' + str(i)
-                tlink = '<TLINK eventInstanceID="{}" lid="{}" relType="{}" relatedToTime="{}"/>'.format(src_eiid, lid,
-                                                                                                note_label, target_tid)
-                makeinstance = '<MAKEINSTANCE eiid="{}" eventID="{}" pos="UNKNOWN" tense="NONE"/>'.format(src_eiid, src_eid)
-                makeinstances.append(makeinstance)
-
-            elif src_eid[0] == 't' and target_eid[0] == 'e':
-                src_tid = src_eid
-                target_eiid = 'ei' + target_eid[1:]
-                lid = 'l' + str(i)
-                tlink = '<TLINK timeID="{}" lid="{}" relType="{}" relatedToEventInstance="{}"/>'.format(src_tid, lid,
-                                                                                                note_label, target_eiid)
-                makeinstance = '<MAKEINSTANCE eiid="{}" eventID="{}" pos="UNKNOWN" tense="NONE"/>'.format(target_eiid, target_eid)
-                makeinstances.append(makeinstance)
-
-            elif src_eid[0] == 't' and target_eid[0] == 't':
-                src_tid = src_eid
-                target_tid = target_eid
-                lid = 'l' + str(i)
-                tlink = '<TLINK timeID="{}" lid="{}" relType="{}" relatedToTime="{}"/>'.format(src_tid, lid,
-                                                                                               note_label, target_tid)
-            tlinks.append(tlink)
-
-    raw_text = raw_text.replace('</TimeML>', '')
-    makeinstances = sorted(list(set(makeinstances)))
-    for makeinstance in makeinstances:
-        raw_text += '\n' + makeinstance
-    for tlink in sorted(list(set(tlinks))):
-        raw_text += '\n' + tlink
-
-    raw_text += '\n</TimeML>'
 
     with open(note_path, 'w') as f:
-        f.write(raw_text)
+        f.write(get_annotated_timeml(note, id_pairs, note_labels))
 
 
 def process_note(note, labels, del_list, label_index, probs):
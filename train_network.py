@@ -10,12 +10,13 @@ if env_paths()["PY4J_DIR_PATH"] is None:
 
 import argparse
 import glob
-import cPickle
 import json
 
 from code.learning.network import Network
-from code.notes.TimeNote import TimeNote
-from code.learning.word2vec import load_word2vec_binary
+from code.learning.training_stream import TrainingStream
+from code.learning.training_cache import TrainingDataCache
+from code.notes.note_cache import NoteCache
+from code.learning.word2vec import load_word_vectors
 
 from keras.models import model_from_json
 from keras.models import load_model
@@ -69,10 +70,52 @@ def main():
                         type=float,
                         help="no link downsampling ratio. e.g. 0.5 means # of nolinks are 50% of # positive tlinks")
 
+    parser.add_argument("--word_ids",
+                        action='store_true',
+                        default=False,
+                        help="Feed word ids to a frozen embedding layer instead of feeding word vectors")
+
+    parser.add_argument("--max_len_percentile",
+                        default=None,
+                        type=float,
+                        help="Cap the input length at this percentile of the dependency path lengths. e.g. 99")
+
+    parser.add_argument("--bucket_width",
+                        default=None,
+                        type=int,
+                        help="Train on batches of pairs with similar path lengths, rounded up to a multiple of this width")
+
+    parser.add_argument("--sentence_encoder",
+                        action='store_true',
+                        default=False,
+                        help="Train a model that encodes every sentence once with a BiLSTM, and pools the states of the subpath tokens of every pair")
+
+    parser.add_argument("--stream",
+                        action='store_true',
+                        default=False,
+                        help="Read training notes and build batches while training, instead of building all training data first")
+
+    parser.add_argument("--workers",
+                        default=2,
+                        type=int,
+                        help="Number of processes reading notes ahead of training, with --stream")
+
+    parser.add_argument("--cache_dir",
+                        default=None,
+                        help="Where to cache training data. Defaults to training_data.cache in train_dir")
+
+    parser.add_argument("--no_cache",
+                        action='store_true',
+                        default=False,
+                        help="Build training data from the notes without caching it")
+
     args = parser.parse_args()
 
     assert args.pair_type in ('intra', 'cross', 'both', 'dct')
 
+    if args.sentence_encoder and args.stream:
+        sys.exit("--stream is not supported with --sentence_encoder")
+
     # validate file paths
     if os.path.isdir(args.newsreader_annotations) is False:
         sys.exit("invalid path for time note dir")
@@ -123,80 +166,141 @@ def main():
     else:
         NNet = None
 
+    if args.no_cache:
+        cache_dir = None
+    elif args.cache_dir is None:
+        cache_dir = os.path.join(args.train_dir, 'training_data.cache')
+    else:
+        cache_dir = args.cache_dir
+
     NN, history = trainNetwork(gold_files, val_files, args.newsreader_annotations, args.pair_type, ordered=args.pair_ordered,
-                               no_val=args.no_val, nolink_ratio=args.nolink_ratio, callbacks=[checkpoint, earlystopping], train_dir=args.train_dir)
+                               no_val=args.no_val, nolink_ratio=args.nolink_ratio, callbacks=[checkpoint, earlystopping], cache_dir=cache_dir,
+                               word_ids=args.word_ids, max_len_percentile=args.max_len_percentile, bucket_width=args.bucket_width,
+                               stream=args.stream, workers=args.workers, sentence_encoder=args.sentence_encoder)
     architecture = NN.to_json()
     open(model_destination + '.arch.json', "wb").write(architecture)
     NN.save_weights(model_destination + '.weights.h5')
     json.dump(history, open(model_destination + 'training_history.json', 'w'))
 
 
-def basename(name):
-    name = os.path.basename(name)
-    name = name.replace('.TE3input', '')
-    name = name.replace('.tml', '')
-    return name
-
-
 def get_notes(files, newsreader_dir):
 
     if not files:
         return None
 
     notes = []
+    note_cache = NoteCache(newsreader_dir)
 
     for i, tml in enumerate(files):
         if i % 10 == 0:
             print 'processing file {}/{} {}'.format(i + 1, len(files), tml)
-        if os.path.isfile(os.path.join(newsreader_dir, basename(tml) + ".parsed.pickle")):
-            tmp_note = cPickle.load(open(os.path.join(newsreader_dir, basename(tml) + ".parsed.pickle"), "rb"))
-        else:
-            tmp_note = TimeNote(tml, tml)
-            cPickle.dump(tmp_note, open(newsreader_dir + "/" + basename(tml) + ".parsed.pickle", "wb"))
+        tmp_note = note_cache.get_note(tml, tml)
 
         notes.append(tmp_note)
     return notes
 
 
-def trainNetwork(gold_files, val_files, newsreader_dir, pair_type, ordered=False, no_val=False, nolink_ratio=1.0, callbacks=[], train_dir='./'):
+def get_note_files(files, newsreader_dir):
+    '''
+    get the paths to the cached notes of files. Missing notes are created and cached, but not kept in memory
+    '''
+    note_files = []
+    note_cache = NoteCache(newsreader_dir)
+
+    for i, tml in enumerate(files):
+        if i % 10 == 0:
+            print 'processing file {}/{} {}'.format(i + 1, len(files), tml)
+        note_files.append(note_cache.get_note_file(tml, tml))
+    return note_files
+
+
+def trainNetwork(gold_files, val_files, newsreader_dir, pair_type, ordered=False, no_val=False, nolink_ratio=1.0, callbacks=[], cache_dir=None,
+                 word_ids=False, max_len_percentile=None, bucket_width=None, stream=False, workers=2, sentence_encoder=False):
     '''
     Train a neural network for classification of temporal realtions.
+    Training data is cached in cache_dir, if given. See TrainingDataCache.
+    sentence_encoder: train a sentence model instead, see Network.get_untrained_sentence_model(). Its training data is not cached
     '''
 
     print "Called trainNetwork"
 
     global N_CLASSES
 
-    if not os.path.isfile(train_dir+'training_data.pkl'):
-        notes = get_notes(gold_files, newsreader_dir)
     if not no_val:
         val_notes = get_notes(val_files, newsreader_dir)
 
-    network = Network()
+    network = Network(newsreader_dir=newsreader_dir)
     print "loading word vectors..."
-    network.word_vectors = load_word2vec_binary(os.environ["TEA_PATH"] + '/GoogleNews-vectors-negative300.bin', verbose=0)
+    network.word_vectors = load_word_vectors(newsreader_dir=newsreader_dir)
 
-    if os.path.isfile(train_dir+'training_data.pkl'):
-        print "loading pkl file... this may take over 10 minutes"
-        training_data = cPickle.load(open(train_dir+'training_data.pkl'))
-        print "training data size:", training_data[0].shape, training_data[1].shape, len(training_data[2])
-    else:
-        # nolink_ration = # no tlink cases / # tlink cases
-        training_data = network._get_training_input(notes, pair_type=pair_type, nolink_ratio=nolink_ratio, shuffle=True, ordered=ordered)
-        print "training data size:", training_data[0].shape, training_data[1].shape, len(training_data[2])
+    if sentence_encoder:
+        notes = get_notes(gold_files, newsreader_dir)
+        training_data = network._get_sentence_training_input(notes, pair_type=pair_type, nolink_ratio=nolink_ratio, ordered=ordered)
+        print "training data size:", len(training_data[0][0]), "sentences", len(training_data[1]), "pairs"
 
         if not no_val and val_notes is not None:
-            val_data = network._get_test_input(val_notes, pair_type=pair_type, ordered=ordered)
+            val_data = network._get_sentence_test_input(val_notes, pair_type=pair_type, ordered=ordered)
+            print "validation data size:", len(val_data[0][0]), "sentences", len(val_data[0][1]), "pairs"
+        else:
+            val_data = None
+
+        NNet, history = network.train_sentence_model(training_data, epochs=200, val_input=val_data, no_val=no_val, weight_classes=False,
+        batch_size=100, encoder_dropout=0, decoder_dropout=0.5, input_dropout=0.6, reg_W=0, reg_B=0, reg_act=0, LSTM_size=128,
+        dense_size=100, nb_classes=N_CLASSES, callbacks=callbacks, ordered=ordered,
+        bucket_width=4 if bucket_width is None else bucket_width)
+
+        return NNet, history
+
+    if stream:
+        training_stream = TrainingStream(network, get_note_files(gold_files, newsreader_dir), pair_type, nolink_ratio=nolink_ratio,
+                                         ordered=ordered, batch_size=100, word_ids=word_ids, nb_classes=N_CLASSES, workers=workers,
+                                         max_len='auto' if bucket_width is None else None, max_len_percentile=max_len_percentile)
+
+        if not no_val and val_notes is not None:
+            val_data = network._get_test_input(val_notes, pair_type=pair_type, ordered=ordered, word_ids=word_ids)
             print "validation data size:", val_data[0].shape, val_data[1].shape, len(val_data[2])
         else:
             val_data = None
 
-        del network.word_vectors
-        NNet, history = network.train_model(None, epochs=200, training_input=training_data, val_input=val_data, no_val=no_val, weight_classes=False, batch_size=100,
-        encoder_dropout=0, decoder_dropout=0.5, input_dropout=0.6, reg_W=0, reg_B=0, reg_act=0, LSTM_size=256,
-        dense_size=100, maxpooling=True, data_dim=300, max_len='auto', nb_classes=N_CLASSES, callbacks=callbacks, ordered=ordered)
+        try:
+            NNet, history = network.train_model_streaming(training_stream, epochs=200, val_input=val_data, weight_classes=False,
+            encoder_dropout=0, decoder_dropout=0.5, input_dropout=0.6, reg_W=0, reg_B=0, reg_act=0, LSTM_size=256,
+            dense_size=100, maxpooling=True, data_dim=300, nb_classes=N_CLASSES, callbacks=callbacks, ordered=ordered)
+        finally:
+            training_stream.close()
 
         return NNet, history
 
+    # nolink_ration = # no tlink cases / # tlink cases
+    if cache_dir is not None:
+        cache = TrainingDataCache(cache_dir, pair_type, nolink_ratio=nolink_ratio, ordered=ordered, word_ids=word_ids,
+                                  word_vectors=network.word_vectors)
+        print "loading training data from", cache.cache_dir
+        training_data = cache.load(network, get_note_files(gold_files, newsreader_dir), shuffle=True)
+    else:
+        notes = get_notes(gold_files, newsreader_dir)
+        training_data = network._get_training_input(notes, pair_type=pair_type, nolink_ratio=nolink_ratio, shuffle=True, ordered=ordered,
+                                                   word_ids=word_ids)
+    print "training data size:", training_data[0].shape, training_data[1].shape, len(training_data[2])
+
+    if not no_val and val_notes is not None:
+        val_data = network._get_test_input(val_notes, pair_type=pair_type, ordered=ordered, word_ids=word_ids)
+        print "validation data size:", val_data[0].shape, val_data[1].shape, len(val_data[2])
+    else:
+        val_data = None
+
+    if word_ids:
+        embedding_matrix = network.get_embedding_matrix()
+    else:
+        embedding_matrix = None
+
+    del network.word_vectors
+    NNet, history = network.train_model(None, epochs=200, training_input=training_data, val_input=val_data, no_val=no_val, weight_classes=False, batch_size=100,
+    encoder_dropout=0, decoder_dropout=0.5, input_dropout=0.6, reg_W=0, reg_B=0, reg_act=0, LSTM_size=256,
+    dense_size=100, maxpooling=True, data_dim=300, max_len='auto', nb_classes=N_CLASSES, callbacks=callbacks, ordered=ordered,
+    embedding_matrix=embedding_matrix, max_len_percentile=max_len_percentile, bucket_width=bucket_width)
+
+    return NNet, history
+
 if __name__ == "__main__":
   main()